@@ -2,6 +2,7 @@
 #include <Wire.h>
 
 const uint32_t BAUD = 115200;
+#define SKETCH_VERSION "1.6" // Reported in the ID handshake reply, bump when the protocol changes
 
 int STATE = 0; // Default to emergency stop to close everything down
 // MFC Setpoint Values
@@ -53,6 +54,54 @@ uint8_t bufPos = 0;
 char outBuffer[OUTBUF_SIZE]; // the actual buffered output message
 uint32_t seq = 1;
 
+#define ESTOP_CHAR '!' // One byte E-stop from the host, acted on the moment it is read
+#define LED_BLINK_MS 250
+uint32_t ledOffAt = 0; // millis() to turn the frame LED off, 0 when off
+
+// Continuous telemetry: "T,rate_hz,oversample" reads every analog pin rate_hz * oversample
+// times a second, averages each oversample reads and sends "D,<micros>,<telemetry line>"
+// rate_hz times a second. "T,0" stops it. Command replies carry the same "D,<micros>," prefix (1.5+).
+#define STREAM_PINS 10
+#define STREAM_MAX_HZ 200
+#define STREAM_LINE_BYTES 100 // longest "D," line, a stream line must fit its period at BAUD
+#define ADC_READ_US 112       // one analogRead, oversampling may use at most half the loop time
+uint16_t streamRate = 0;      // Hz, 0 = reply to commands only
+uint16_t oversample = 1;
+uint32_t samplePeriodUs = 0;  // between reads of all pins
+uint32_t nextSampleUs = 0;
+uint16_t samplesTaken = 0;
+uint32_t adcSum[STREAM_PINS];
+uint32_t readingsStamp = 0;   // micros() the stored readings were taken at, sent with every telemetry line
+// Analog pins in the order storeReadings() expects them
+const uint8_t streamPins[STREAM_PINS] = {MFC1_READ_PIN, MFC2_READ_PIN, MFC3_READ_PIN, MFC4_READ_PIN, MFC5_READ_PIN,
+                                         MixingChamberPressure_PIN, PipePressure_PIN, GasSensor1_PIN, GasSensor2_PIN, TempSensor_PIN};
+
+// Command watchdog (1.6+): "W,ms" stops the flows like an E-stop when no command line (setpoint
+// frame, segment, poll or "K" heartbeat) has arrived for ms while a test or custom flows run,
+// so a crashed host or pulled cable does not leave gas flowing. "W,0" turns it off, the default at boot.
+#define WATCHDOG_MAX_MS 60000
+uint32_t watchdogMs = 0;
+uint32_t lastCommandAt = 0; // millis() of the last complete command line
+
+// Setpoint ramp segments: the host queues "ramp to these flows over this many ms"
+// and the firmware interpolates the DAC outputs locally every RAMP_PERIOD_MS
+#define SEG_QUEUE_SIZE 16
+#define RAMP_PERIOD_MS 10
+struct Segment
+{
+    uint32_t duration; // ms
+    int valve;
+    float target[5];   // SLPM at the end of the segment
+};
+Segment segQueue[SEG_QUEUE_SIZE];
+uint8_t segHead = 0;   // segment being ramped
+uint8_t segCount = 0;  // segments queued, including the active one
+bool segActive = false;
+uint32_t segStart = 0; // millis() the active segment started
+uint32_t lastRamp = 0;
+float segFrom[5];      // flows at the start of the active segment
+float *mfcStores[5] = {&MFC1_store, &MFC2_store, &MFC3_store, &MFC4_store, &MFC5_store};
+
 
 // Vairables for DAC connection 
 #define MCP4728_ADDR 0x60 // 4 output DAC adress
@@ -86,16 +135,59 @@ void loop()
     {
         // Logic to detect new serial data input and run rest of protocol
         char c = Serial.read();
-        if (c == '\n')
+        if (c == ESTOP_CHAR)
         {
-            digitalWrite(LED_BUILTIN,HIGH);
-            delay(250);
-            digitalWrite(LED_BUILTIN,LOW);
-            lineBuffer[bufPos] = 0; // for serial read logic
-        if (parseLine(lineBuffer))
-        {
-            sendLine();
+            emergencyStop(); // drops any half received line
+            bufPos = 0;
         }
+        else if (c == '\n')
+        {
+            lineBuffer[bufPos] = 0; // for serial read logic
+            lastCommandAt = millis(); // any command shows the host is alive
+            if (strcmp(lineBuffer, "ID") == 0)
+            {
+                sendId(); // Identity handshake, answered immediately so port discovery stays fast
+            }
+            else if (lineBuffer[0] == 'S' && lineBuffer[1] == ',')
+            {
+                if (parseSegment(lineBuffer)) // Queue a ramp segment, no LED delay so ramps stay smooth
+                {
+                    sendLine();
+                }
+            }
+            else if (strcmp(lineBuffer, "P") == 0)
+            {
+                sendLine(); // Telemetry poll, setpoints unchanged
+            }
+            else if (strcmp(lineBuffer, "K") == 0)
+            {
+                // Heartbeat while streaming, only feeds the watchdog: no reply, the stream carries the telemetry
+            }
+            else if (lineBuffer[0] == 'W' && lineBuffer[1] == ',')
+            {
+                if (parseWatchdog(lineBuffer)) // Set the command watchdog
+                {
+                    sendLine();
+                }
+            }
+            else if (lineBuffer[0] == 'T' && lineBuffer[1] == ',')
+            {
+                if (parseStream(lineBuffer)) // Start or stop continuous telemetry
+                {
+                    sendLine();
+                }
+            }
+            else
+            {
+                // Blink without delay() so a following E-stop byte is not held up
+                digitalWrite(LED_BUILTIN,HIGH);
+                ledOffAt = millis() + LED_BLINK_MS;
+                if (ledOffAt == 0) ledOffAt = 1;
+                if (parseLine(lineBuffer))
+                {
+                    sendLine();
+                }
+            }
             bufPos = 0;
         }
         else if (c != '\r')
@@ -104,6 +196,61 @@ void loop()
                 lineBuffer[bufPos++] = c;
         }
     }
+    checkWatchdog();
+    updateRamp();
+    updateStream();
+    if (ledOffAt != 0 && (int32_t)(millis() - ledOffAt) >= 0)
+    {
+        digitalWrite(LED_BUILTIN,LOW);
+        ledOffAt = 0;
+    }
+}
+
+void emergencyStop()
+{
+    // Close the valve and zero every MFC first, then clear the ramp queue and report
+    VALVE = 0;
+    digitalWrite(VALVE_SET_PIN, 0);
+    for (uint8_t i = 0; i < 5; i++)
+    {
+        *mfcStores[i] = 0;
+    }
+    applySetpoints();
+    segCount = 0;
+    segActive = false;
+    if (STATE != 0)
+    {
+        STATE = 0;
+        seq = 1;
+    }
+    sendLine(); // acknowledgement: telemetry with STATE 0
+}
+
+void checkWatchdog()
+{
+    // Flows commanded but the host has gone quiet: stop everything and say why
+    if (watchdogMs == 0 || (STATE != 2 && STATE != 3))
+    {
+        return;
+    }
+    if (millis() - lastCommandAt > watchdogMs)
+    {
+        sendError("Command watchdog expired");
+        emergencyStop();
+    }
+}
+
+bool parseWatchdog(const char *s)
+{
+    // "W,ms", 0 turns the watchdog off
+    long ms = atol(s + 2);
+    if (ms < 0 || ms > WATCHDOG_MAX_MS)
+    {
+        sendError("Watchdog must be 0 to 60000 ms");
+        return false;
+    }
+    watchdogMs = ms;
+    return true;
 }
 
 void DAC_begin() {
@@ -145,6 +292,12 @@ void DAC_writeVoltage(uint8_t channel, float voltage) {
 
 
 
+void sendId()
+{
+    // Reply to the host handshake: "ID,SBGC,<version>"
+    Serial.write("ID,SBGC," SKETCH_VERSION "\n");
+}
+
 void sendError(const char *msg)
 {
     outBuffer[0] = '\0';
@@ -219,6 +372,10 @@ bool parseLine(const char *s)
         }
     }
 
+    // A direct setpoint frame overrides any queued ramp
+    segCount = 0;
+    segActive = false;
+
     VALVE = newValve;
     MFC1_store = m1;
     MFC2_store = m2;
@@ -231,6 +388,115 @@ bool parseLine(const char *s)
     return true;
 }
 
+bool parseSegment(const char *s)
+{
+    // "S,state,valve,duration_ms,m1,m2,m3,m4,m5"
+    int newState;
+    int newValve;
+    unsigned long duration;
+    char f[5][16];
+
+    int fields = sscanf(
+        s,
+        "S,%d,%d,%lu,%15[^,],%15[^,],%15[^,],%15[^,],%15s",
+        &newState,
+        &newValve,
+        &duration,
+        f[0], f[1], f[2], f[3], f[4]
+    );
+
+    if (fields != 8)
+    {
+        sendError("Invalid segment field count (expected 8)");
+        return false;
+    }
+    if (newValve < 0 || newValve > 1)
+    {
+        sendError("Valve must be 0 or 1");
+        return false;
+    }
+    if (newState <= 0)
+    {
+        sendError("Invalid STATE value for segment");
+        return false;
+    }
+    if (segCount >= SEG_QUEUE_SIZE)
+    {
+        sendError("Segment queue full");
+        return false;
+    }
+
+    if (newState != STATE)
+    {
+        STATE = newState;
+        seq = 1;
+    }
+
+    Segment &seg = segQueue[(segHead + segCount) % SEG_QUEUE_SIZE];
+    seg.duration = duration;
+    seg.valve = newValve;
+    for (uint8_t i = 0; i < 5; i++)
+    {
+        seg.target[i] = atof(f[i]);
+    }
+    segCount++;
+    return true;
+}
+
+void updateRamp()
+{
+    // Interpolate the active segment and apply it, then chain straight into the next one
+    if (segCount == 0 || STATE == 0)
+    {
+        return;
+    }
+    uint32_t now = millis();
+    if (!segActive)
+    {
+        for (uint8_t i = 0; i < 5; i++)
+        {
+            segFrom[i] = *mfcStores[i];
+        }
+        segStart = now;
+        segActive = true;
+        VALVE = segQueue[segHead].valve;
+    }
+    if (now - lastRamp < RAMP_PERIOD_MS)
+    {
+        return;
+    }
+    lastRamp = now;
+
+    Segment &seg = segQueue[segHead];
+    uint32_t elapsed = now - segStart;
+    float alpha = (seg.duration == 0 || elapsed >= seg.duration) ? 1.0f : (float)elapsed / seg.duration;
+    for (uint8_t i = 0; i < 5; i++)
+    {
+        *mfcStores[i] = segFrom[i] + alpha * (seg.target[i] - segFrom[i]);
+    }
+    applySetpoints();
+
+    if (alpha >= 1.0f)
+    {
+        // Next segment starts where this one was scheduled to end so timing does not drift
+        segStart += seg.duration;
+        segHead = (segHead + 1) % SEG_QUEUE_SIZE;
+        segCount--;
+        if (segCount > 0)
+        {
+            for (uint8_t i = 0; i < 5; i++)
+            {
+                segFrom[i] = *mfcStores[i];
+            }
+            VALVE = segQueue[segHead].valve;
+        }
+        else
+        {
+            segActive = false;
+        }
+    }
+}
+
 float mfcSlpmToVoltage(float slpm)
 {
     slpm = (slpm+.5855)/.9647;
@@ -255,13 +521,29 @@ void applySetpoints()
 
 void sendLine()
 {
-    readMfcResponses();
-    readSensors();
+    if (streamRate == 0)
+    {
+        sampleOnce(); // while streaming the readings are kept fresh (and averaged) by updateStream
+    }
+    sendStampedLine(readingsStamp); // replies carry the board clock too (1.5+), the host aligns it with its own
+}
 
+void sendStampedLine(uint32_t stamp)
+{
+    char tmp[16];
 
-    // Build single line of serial output and send
     outBuffer[0] = '\0';
+    strcat(outBuffer, "D,");
+    strcat(outBuffer, ultoa(stamp, tmp, 10));
+    strcat(outBuffer, ",");
+    appendFrame();
+    Serial.write(outBuffer); // blocks while the TX buffer is full, parseStream keeps a line shorter than the period
+    seq++;
+}
 
+void appendFrame()
+{
+    // Build single line of serial output
     char tmp[16];
 
     strcat(outBuffer, ultoa(seq, tmp, 10));
@@ -287,18 +569,94 @@ void sendLine()
     itoa(E_Stop, tmp, 10); strcat(outBuffer, tmp);
 
     strcat(outBuffer, "\n");
+}
 
-    Serial.write(outBuffer);
-    seq++;
+bool parseStream(const char *s)
+{
+    // "T,rate_hz,oversample" or "T,0"
+    unsigned int rate = 0;
+    unsigned int over = 1;
+    int fields = sscanf(s, "T,%u,%u", &rate, &over);
+
+    if (fields < 1)
+    {
+        sendError("Invalid stream field count (expected 1 or 2)");
+        return false;
+    }
+    if (rate == 0)
+    {
+        streamRate = 0;
+        return true;
+    }
+    if (rate > STREAM_MAX_HZ || (uint32_t)rate * STREAM_LINE_BYTES * 10 > BAUD)
+    {
+        sendError("Stream rate too high for the baud rate");
+        return false;
+    }
+    if (over < 1 || (uint32_t)rate * over * STREAM_PINS * ADC_READ_US > 500000UL)
+    {
+        sendError("Oversampling too high for the stream rate");
+        return false;
+    }
+
+    streamRate = rate;
+    oversample = over;
+    samplePeriodUs = 1000000UL / ((uint32_t)rate * over);
+    samplesTaken = 0;
+    for (uint8_t i = 0; i < STREAM_PINS; i++)
+    {
+        adcSum[i] = 0;
+    }
+    nextSampleUs = micros();
+    return true;
+}
+
+void updateStream()
+{
+    // Read every pin on schedule, send the average of each oversample reads
+    if (streamRate == 0)
+    {
+        return;
+    }
+    uint32_t now = micros();
+    if ((int32_t)(now - nextSampleUs) < 0)
+    {
+        return;
+    }
+    nextSampleUs += samplePeriodUs;
+    if ((int32_t)(now - nextSampleUs) > 0)
+    {
+        nextSampleUs = now + samplePeriodUs; // held up (e.g. a DAC write), skip rather than read in a burst
+    }
+
+    for (uint8_t i = 0; i < STREAM_PINS; i++)
+    {
+        adcSum[i] += analogRead(streamPins[i]);
+    }
+    if (++samplesTaken < oversample)
+    {
+        return;
+    }
+
+    float adc[STREAM_PINS];
+    for (uint8_t i = 0; i < STREAM_PINS; i++)
+    {
+        adc[i] = (float)adcSum[i] / samplesTaken;
+        adcSum[i] = 0;
+    }
+    samplesTaken = 0;
+    storeReadings(adc);
+    readingsStamp = now - (oversample - 1) * samplePeriodUs / 2; // the middle of the averaged reads
+    sendStampedLine(readingsStamp);
 }
 
 
-float adcToSlpm(uint16_t adc) // Convert MFC read analog value to SLPM value
+float adcToSlpm(float adc) // Convert MFC read analog value (or an average of them) to SLPM value
 {
     if (adc > 1023) adc = 1023;
     return (adc / 1023.0f) * 500.0f;
 }
-float adcToUnits(uint16_t adc, float vMin, float vMax, float fullScale, float offset = 0.0f)
+float adcToUnits(float adc, float vMin, float vMax, float fullScale, float offset = 0.0f)
 {
     const float vRef = 5.0f;
     const float vPerCount = vRef / 1023.0f;
@@ -309,7 +667,7 @@ float adcToUnits(uint16_t adc, float vMin, float vMax, float fullScale, float of
     return (((voltage - vMin) / (vMax - vMin)) * fullScale) + offset;
 }
 
-float adcToThermocouple(uint16_t adc)
+float adcToThermocouple(float adc)
 {
     const float vRef       = 5.0f;
     const float vPerCount  = vRef / 1023.0f;
@@ -320,24 +678,31 @@ float adcToThermocouple(uint16_t adc)
     return (voltage - offsetV) / mVperDegC-8;
 }
 
-void readMfcResponses()
+void sampleOnce()
 {
-    MFC1_RESPONSE = adcToSlpm(analogRead(MFC1_READ_PIN));
-    MFC2_RESPONSE = adcToSlpm(analogRead(MFC2_READ_PIN));
-    MFC3_RESPONSE = adcToSlpm(analogRead(MFC3_READ_PIN));
-    MFC4_RESPONSE = adcToSlpm(analogRead(MFC4_READ_PIN));
-    MFC5_RESPONSE = adcToSlpm(analogRead(MFC5_READ_PIN));
+    // One read of every pin, for replies when not streaming
+    float adc[STREAM_PINS];
+    uint32_t start = micros();
+    for (uint8_t i = 0; i < STREAM_PINS; i++)
+    {
+        adc[i] = analogRead(streamPins[i]);
+    }
+    readingsStamp = start + (micros() - start) / 2;
+    storeReadings(adc);
 }
-void readSensors()
+
+void storeReadings(const float *adc)
 {
-    MixingChamberPressure = adcToUnits(analogRead(MixingChamberPressure_PIN),.5,4.5,150, 14.7); // 150 psi full range
-    PipePressure = adcToUnits(analogRead(PipePressure_PIN),0.5,4.5,50,14.7); // 50 psi full range
-    GasSensor1 = adcToUnits(analogRead(GasSensor1_PIN),0,5,1); // UNKOWN FULL RANGE (REQUIRES CALIBRATION)
-    GasSensor2 = adcToUnits(analogRead(GasSensor2_PIN),0,5,1); // UNKOWN FULL RANGE (REQUIRES CALIBRATION)
-    TempSensor = adcToThermocouple(analogRead(TempSensor_PIN)); // UNKOWN FULL RANGE (REQUIRES CALIBRATION)
+    // adc: counts of each pin in streamPins order
+    MFC1_RESPONSE = adcToSlpm(adc[0]);
+    MFC2_RESPONSE = adcToSlpm(adc[1]);
+    MFC3_RESPONSE = adcToSlpm(adc[2]);
+    MFC4_RESPONSE = adcToSlpm(adc[3]);
+    MFC5_RESPONSE = adcToSlpm(adc[4]);
+    MixingChamberPressure = adcToUnits(adc[5],.5,4.5,150, 14.7); // 150 psi full range
+    PipePressure = adcToUnits(adc[6],0.5,4.5,50,14.7); // 50 psi full range
+    GasSensor1 = adcToUnits(adc[7],0,5,1); // UNKOWN FULL RANGE (REQUIRES CALIBRATION)
+    GasSensor2 = adcToUnits(adc[8],0,5,1); // UNKOWN FULL RANGE (REQUIRES CALIBRATION)
+    TempSensor = adcToThermocouple(adc[9]); // UNKOWN FULL RANGE (REQUIRES CALIBRATION)
     E_Stop = digitalRead(E_STOP_READ);
 }
-
-
-
-
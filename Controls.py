@@ -1,6 +1,9 @@
 import time
+import collections
 import numpy as np
 import threading
+import recipe_optimizer
+from run_clock import NS
 
 
 class ControlSystem:
@@ -19,29 +22,45 @@ class ControlSystem:
         # 3 = Run custom setpoints
         self.STATE = 1  # Default to Idle state 
         self.oldstate = 1 # for controls loop logic
-        self.custom_setpoints = [] # Placeholder for custom setpoints (STATE,Valve, MFC1, MFC2, MFC3, MFC4, MFC5)
+        self.custom_setpoints = [] # Placeholder for custom setpoints (STATE,Valve, MFC1, ..., MFCn)
+
+        # Segment mode: the firmware ramps between breakpoints, host streams segments ahead of time
+        self.use_segments = True
+        self.segment_firmware = (1, 2) # first sketch version with the "S" segment command
+        self.segment_lookahead = 2.0 # seconds of segments to keep queued ahead of the test clock
+        self.segment_queue_size = 12 # stay below SEG_QUEUE_SIZE in the sketch
+        self.segment_retries = 5 # loops a refused segment is resent before the test is aborted
+
+        # Loop timing: each state loop wakes on a fixed schedule, lateness of every wake-up is kept for diagnostics
+        self.next_tick = None
+        self.tick_lateness = collections.deque(maxlen=500) # seconds each tick woke up after its deadline
+        self.wake = threading.Event() # set on a state change so the loop reacts without waiting out its sleep
 
     # ---------- Core Loop ---------- #
     def _loop(self):
         while self.running:
             if not self.STATE == self.oldstate: # If state has changed
+                if self.oldstate in (2, 3): # a test or custom setpoints just ended
+                    self.dh.archive_run(self.oldstate, self.STATE)
                 self.oldstate = self.STATE
+                self.next_tick = None
                 if self.STATE == 0: # Emergency Stop
                     self.emergency_stop()
                 elif self.STATE == 1: # Idle
                     self.dh.running = False
                     self.idle()
                 elif self.STATE == 2: # Run Test
-                    self.dh.run_start = time.time()
+                    self.dh.mark_run_start()
+                    self.dh.hrr.reset() # Energy released is counted per test
                     self.dh.running = True
                     self.run_test()
                 elif self.STATE == 3: # Run custom setpoints
                     # Custom setpoints should be sent immediately when state changes, so just maintain them here
-                    self.dh.run_start = time.time()
+                    self.dh.mark_run_start()
                     self.dh.running = True
                     self.run_custom()
                 elif self.STATE == 4: # Ambient Calibration
-                    self.dh.run_start = time.time()
+                    self.dh.mark_run_start()
                     self.dh.running = True
                     self.UI.write_to_terminal("[STATE: AMBIENT CALIBRATION] Starting ambient calibration...")
                     self.ambient_calibration()
@@ -50,8 +69,16 @@ class ControlSystem:
                 else:
                     self.UI.write_to_terminal(f"[STATE: UNKNOWN] No handler for self.STATE '{self.STATE}'")
                     self.STATE = 0
+                    self.dh.send_estop()
                     self.emergency_stop()
-            time.sleep(self.resolution/10)
+            if self.dh.Arduino_connected: # between states nothing else reads the port
+                self.dh.sync_stream()
+                self.dh.sync_watchdog()
+                if self.dh.streaming:
+                    self.dh.read_stream()
+            if self.STATE == self.oldstate: # a state loop that just returned may already have a new state to run
+                self.wake.wait(self.resolution/10)
+            self.wake.clear()
 
     # Control Methods
     def start(self):
@@ -71,12 +98,37 @@ class ControlSystem:
             self.set_state(1)
             self.UI.write_to_terminal("[ControlSystem] Stopped main loop.")
 
-    def set_state(self, new_state):
-        """Changes the system self.STATE dynamically."""
-        self.UI.write_to_terminal(f"[ControlSystem] STATE changed to '{new_state}'")
+    def set_state(self, new_state, pressed=None):
+        """
+        Changes the system self.STATE dynamically.
+
+        An emergency stop goes to the Arduino straight away from the calling thread
+        (Data_Handler.send_estop), before the loop notices; pressed is the
+        time.monotonic() of the request, for the E-stop latency log.
+        """
         self.STATE = new_state
+        if new_state == 0 and self.dh is not None:
+            self.dh.send_estop(pressed)
+        self.wake.set()
+        self.UI.write_to_terminal(f"[ControlSystem] STATE changed to '{new_state}'")
         self.UI.update_indicators(name=self.UI.indicators[0])
 
+    def _tick(self):
+        """Sleep until the next loop deadline. Deadlines are resolution apart, so the period does not drift with the work done each loop."""
+        now = time.monotonic()
+        if self.next_tick is None: # first loop of this state
+            self.next_tick = now
+        self.next_tick += self.resolution
+        if now > self.next_tick: # the work overran the period
+            self.tick_lateness.append(now - self.next_tick)
+            if now - self.next_tick > self.resolution:
+                self.next_tick = now # skip the missed ticks instead of bursting to catch up
+            return
+        if self.wake.wait(self.next_tick - now): # state changed, let the caller check it now
+            self.wake.clear()
+            return
+        self.tick_lateness.append(time.monotonic() - self.next_tick)
+
     ######### State specific logic
 
     def emergency_stop(self):
@@ -84,11 +136,11 @@ class ControlSystem:
         while self.STATE == 0:
             if self.STATE != 0:
                 break
-            self.dh.update_setpoints([0,0,0,0,0,0,0]) # Send zero flow to all MFC's and close valve
-            time.sleep(self.resolution)
+            self.dh.update_setpoints(self.dh.channels.setpoint_frame(0, 0)) # Send zero flow to all MFC's and close valve
+            self._tick()
 
     def idle(self):
-        self.dh.update_setpoints([1,0,0,0,0,0,0]) # Send zero flow to all MFC's and close valve
+        self.dh.update_setpoints(self.dh.channels.setpoint_frame(1, 0)) # Send zero flow to all MFC's and close valve
         self.UI.write_to_terminal("[STATE: IDLE] System is standing by...")
             
 
@@ -97,37 +149,113 @@ class ControlSystem:
 
         # Grab interpolated schedule
         plan = self.UI.test_plan
-        t_vec = [row[0] for row in plan]   # time axis
-        data_cols = [row[1:] for row in plan]    # signals
-        if len(t_vec) == 0:
+        if len(plan) == 0:
             self.UI.write_to_terminal("ERROR: Empty test plan")
+            self.set_state(1)
             return
+
+        if self.use_segments and self.dh.connection.firmware_version() >= self.segment_firmware:
+            self.run_test_segments(plan)
+        else:
+            self.run_test_frames(plan)
+
+        if self.STATE == 2:
+            self.set_state(1) # Return to idle when done, but never override an emergency stop
+
+    def run_test_frames(self, plan):
+        """Send a setpoint frame every loop, interpolated from the test plan (firmware without segment support)."""
+        # The plan only holds breakpoints, gas column i of the plan drives MFC i, valve open
+        n_mfcs = self.dh.channels.n_mfcs
+        plan = np.asarray(plan, dtype=float)
+        t_vec = plan[:, 0]   # time axis
+        flows = plan[:, 1:-1][:, :n_mfcs] # gas columns, the last column is HRR
         test_start = time.time()
-        idx = 0                 # index into test_plan time vector
 
         # Run until stopped or end of test
-        while self.STATE == 2 and idx < len(t_vec):
+        while self.STATE == 2:
             self.dh.check_emergency_conditions()
             if self.STATE != 2:
                 break
 
             # Elapsed test time
             t_now = time.time() - test_start
-            # Advance index while current test time exceeds scheduled time
-            while idx < len(t_vec) and t_now >= t_vec[idx]:
+            if t_now > t_vec[-1]:
+                break
+            frame = self.dh.channels.setpoint_frame(2, 1, recipe_optimizer.interpolate_plan(t_vec, flows, t_now))
+            self.dh.update_setpoints(frame)
+
+            self.UI.update_graphs() # Update graphs at each loop iteration
+            self.UI.update_values_display()
+            self._tick()
+
+    def plan_segments(self, plan):
+        """
+        Compress the test plan into piecewise-linear ramp segments.
+
+        Uses the same joint Ramer-Douglas-Peucker reduction as recipe loading
+        (recipe_optimizer.reduce_plan) on the MFC columns, so an already reduced
+        plan passes through unchanged.
+
+        Returns:
+            (times, flows): breakpoint times [s] and the flows [SLPM] to reach at each
+            breakpoint, one column per MFC.
+        """
+        n_mfcs = self.dh.channels.n_mfcs
+        plan = np.asarray(plan, dtype=float)
+        rows = plan[:, :min(n_mfcs + 1, plan.shape[1] - 1)] # time and gas columns, the last column is HRR
+        tolerances = recipe_optimizer.flow_tolerances(self.dh.channels, rows.shape[1] - 1)
+        reduced = np.asarray(recipe_optimizer.reduce_plan(rows, tolerances), dtype=float)
+        flows = np.zeros((len(reduced), n_mfcs)) # MFCs without a gas column stay at 0
+        flows[:, :reduced.shape[1] - 1] = reduced[:, 1:]
+        return reduced[:, 0], flows
+
+    def run_test_segments(self, plan):
+        """
+        Run the test by streaming ramp segments ahead of time.
+
+        The firmware ramps the DACs between breakpoints on its own, so the host only
+        sends a segment every few seconds and polls for telemetry each loop.
+        """
+        times, flows = self.plan_segments(plan)
+        self.UI.write_to_terminal(f"[CONTROLS] Test plan compressed from {len(plan)} rows to {len(times)} segments")
+        test_start = time.time()
+        sent = 0 # breakpoints sent so far
+        refused = 0 # times the next breakpoint was refused in a row
+
+        # Jump to the first breakpoint, then queue the ramps as the test progresses
+        while self.STATE == 2:
+            self.dh.check_emergency_conditions()
+            if self.STATE != 2:
+                break
+
+            t_now = time.time() - test_start
+            if t_now > times[-1] and sent == len(times):
+                break
 
-                data = []
-                for col_i in range(1,len(data_cols) - 1): # Skip time column
-                    data.append(data_cols[col_i][idx])
+            # Keep the firmware queue topped up with segments starting within the lookahead window
+            done = np.searchsorted(times, t_now, side="right") # breakpoints already passed
+            while (sent < len(times) and sent - done < self.segment_queue_size
+                   and (sent == 0 or times[sent - 1] <= t_now + self.segment_lookahead)):
+                duration = times[sent] - times[sent - 1] if sent else 0.0
+                if not self.dh.send_segment(2, 1, duration, flows[sent]):
+                    # Not sent, or refused (e.g. "Segment queue full"): resend it next loop rather than skip the breakpoint.
+                    # A full queue empties as the ramps play out, a segment still refused once it is due will not be taken
+                    refused += 1
+                    if refused > self.segment_retries and (sent == 0 or times[sent - 1] < t_now) and self.STATE == 2:
+                        self.UI.write_to_terminal(f"[CONTROLS] Test segment {sent + 1} of {len(times)} was refused "
+                                                  f"{refused} times, test aborted")
+                        self.set_state(1)
+                    break
+                refused = 0
+                sent += 1
 
-                self.dh.update_setpoints(data)
-                idx += 1
+            # Record where the ramp should be now and poll telemetry
+            self.dh.record_setpoints(recipe_optimizer.interpolate_plan(times, flows, t_now))
+            self.dh.poll_telemetry()
 
             self.UI.update_graphs() # Update graphs at each loop iteration
             self.UI.update_values_display()
-            time.sleep(self.resolution)
-        
-        self.set_state(1) # Return to idle when done
+            self._tick()
 
     def run_custom(self):
         self.UI.write_to_terminal(f"[CONTROLS: RUNNING CUSTOM SETPOINTS]: {self.custom_setpoints}")
@@ -139,29 +267,34 @@ class ControlSystem:
             self.dh.update_setpoints(self.custom_setpoints)
             self.UI.update_graphs() # Update graphs at each loop iteration
             self.UI.update_values_display()
-            time.sleep(self.resolution)
+            self._tick()
 
     def ambient_calibration(self):
         self.UI.write_to_terminal("[CONTROLS: AMBIENT CALIBRATION] Starting ambient calibration procedure...")
-        self.dh.update_setpoints([1,0,0,0,0,0,0]) # Open valve and set no flow to all MFCs
+        self.dh.update_setpoints(self.dh.channels.setpoint_frame(1, 0)) # Set no flow to all MFCs
         calibration_start = time.time()
+        calibration_start_ns = self.dh.clock.now_ns() # the averages only take samples from here on
         calibration_duration = 30 # seconds to run calibration for
         while self.STATE == 4:
             if self.STATE != 4:
                 break
 
             if time.time() - calibration_start < calibration_duration: # if time within conditions recording time
-                self.dh.update_setpoints([1,0,0,0,0,0,0]) # send and recieve new data
+                self.dh.update_setpoints(self.dh.channels.setpoint_frame(1, 0)) # send and recieve new data
                 self.UI.update_graphs() # Update graphs at each loop iteration
                 self.UI.update_values_display()
                 #time.sleep(self.resolution)
             else:
-                # process and store averages for each sensor value, then return to idle
-                # self.dh.sensor_history = [[time, Mixing Chamber Pressure, Line Pressure, Methane, Gas Sensor 2,...],...]
-                mixing_chamber_pressure_avg = np.mean([entry[1] for entry in self.dh.sensor_history])
-                line_pressure_avg = np.mean([entry[2] for entry in self.dh.sensor_history])
-                gas_sensor_1_avg = np.mean([entry[3] for entry in self.dh.sensor_history])
-                gas_sensor_2_avg = np.mean([entry[4] for entry in self.dh.sensor_history])
+                # process and store averages for each sensor value over the calibration window, then return to idle
+                stats = self.dh.stats
+                window = stats.newest_time() - calibration_start_ns / NS if stats.n else -1
+                if window < 0:
+                    self.UI.write_to_terminal("[CONTROLS: AMBIENT CALIBRATION] No sensor data received, calibration not saved.")
+                    break
+                mixing_chamber_pressure_avg = stats.mean("Mixing Chamber Pressure", window)
+                line_pressure_avg = stats.mean("Line Pressure", window)
+                gas_sensor_1_avg = stats.mean("Gas Sensor 1", window)
+                gas_sensor_2_avg = stats.mean("Gas Sensor 2", window)
 
 
                 self.dh.state_saver("store", "mixing_chamber_pressure", mixing_chamber_pressure_avg)
@@ -17,33 +17,35 @@
 
 
 # Import functions or objects from other files
+import multiprocessing
+import os
+import sys
 from UI import UI_Object
-from Controls import ControlSystem
-from data_handler import Data_Handler
+from rig_manager import RigManager
 
 ### Start main code
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # needed for worker processes inside the PyInstaller exe
+    if getattr(sys, "frozen", False):
+        os.chdir(os.path.dirname(sys.executable)) # state_save.csv and the other data files sit next to the exe
 
-    # Create UI and Controls System objects, then link them
-    Gas_Mixing_UI = UI_Object()
-    cs = ControlSystem()
-    dh = Data_Handler()
-
-    Gas_Mixing_UI.cs = cs
-    Gas_Mixing_UI.dh = dh
-    dh.UI = Gas_Mixing_UI
-    cs.UI = Gas_Mixing_UI
-    dh.cs = cs
-    cs.dh = dh
+    # Create the Data Handler and Control System of each rig (one unless rigs.json lists more), then share one UI between them
+    rigs = RigManager.load()
+    Gas_Mixing_UI = UI_Object(channels=rigs.channels) # UI layout is generated from the rigs' channel map
+    rigs.attach_ui(Gas_Mixing_UI)
 
     # Start the UI main loop
     Gas_Mixing_UI.write_to_terminal("App started.")
-    Gas_Mixing_UI.write_to_terminal("Number of MFCs: " + str(dh.num_mfcs) + "\n MAKE SURE THIS IS CORRECT")
-
+    for rig in rigs.rigs:
+        rig.view.write_to_terminal("Number of MFCs: " + str(rig.dh.num_mfcs) + "\n MAKE SURE THIS IS CORRECT")
 
-    # Start the Control System main loop
-    cs.start()
+    # Start each rig's Control System main loop and telemetry server
+    rigs.start()
     Gas_Mixing_UI.update_indicators(Gas_Mixing_UI.indicators[0])  # Initialize state indicator
 
-    Gas_Mixing_UI.mainloop()
+    # Timing run from startup_benchmark.py / build_report.py: record when the window and graphs are up, then close
+    if os.environ.get("SBGC_STARTUP_REPORT"):
+        import startup_benchmark
+        startup_benchmark.report_startup(Gas_Mixing_UI, os.environ["SBGC_STARTUP_REPORT"])
 
+    Gas_Mixing_UI.mainloop()
@@ -0,0 +1,84 @@
+# -*- mode: python ; coding: utf-8 -*-
+# Onedir build profile, tuned for startup time and size.
+#   pyinstaller SyntheticBatteryGasController_onedir.spec
+#   python build_report.py dist/SyntheticBatteryGasController.exe dist/SyntheticBatteryGasController_onedir
+#
+# Compared to SyntheticBatteryGasController.spec (onefile):
+# - nothing is unpacked to a temp folder on every launch, the exe runs from its folder
+# - bytecode is compiled with optimize=1 (asserts removed). Level 2 also strips
+#   docstrings, which pandas and matplotlib use to build parts of their API
+# - unused heavy modules are excluded
+# - no UPX, decompressing the DLLs on every launch costs more startup time than it saves in size
+# - state_save.csv, Troubleshooting_Info.txt and channel_map.json are copied next to the exe
+
+# Modules the app never imports but PyInstaller's hooks pull in
+excludes = [
+    # matplotlib backends other than TkAgg (and Agg, which TkAgg and the batch compiler use)
+    'matplotlib.backends.backend_qt', 'matplotlib.backends.backend_qtagg', 'matplotlib.backends.backend_qtcairo',
+    'matplotlib.backends.backend_qt5', 'matplotlib.backends.backend_qt5agg', 'matplotlib.backends.backend_qt5cairo',
+    'matplotlib.backends.backend_gtk3', 'matplotlib.backends.backend_gtk3agg', 'matplotlib.backends.backend_gtk3cairo',
+    'matplotlib.backends.backend_gtk4', 'matplotlib.backends.backend_gtk4agg', 'matplotlib.backends.backend_gtk4cairo',
+    'matplotlib.backends.backend_wx', 'matplotlib.backends.backend_wxagg', 'matplotlib.backends.backend_wxcairo',
+    'matplotlib.backends.backend_macosx', 'matplotlib.backends.backend_webagg', 'matplotlib.backends.backend_webagg_core',
+    'matplotlib.backends.backend_nbagg', 'matplotlib.backends.backend_cairo', 'matplotlib.backends.backend_pgf',
+    'matplotlib.backends.backend_template', 'matplotlib.backends.backend_tkcairo',
+    'PyQt5', 'PyQt6', 'PySide2', 'PySide6', 'wx', 'gi', 'cairo', 'tornado',
+    # pandas IO engines and optional accelerators we do not use (openpyxl is kept for .xlsx)
+    'pyarrow', 'fastparquet', 'tables', 'sqlalchemy', 'xlsxwriter', 'xlrd', 'odf', 'pyxlsb', 'python_calamine',
+    'lxml', 'bs4', 'html5lib', 'fsspec', 's3fs', 'gcsfs', 'numba', 'numexpr', 'bottleneck', 'scipy', 'jinja2',
+    # notebooks and test packages
+    'IPython', 'jupyter', 'notebook', 'ipykernel',
+    'pytest', '_pytest', 'hypothesis', 'test', 'tkinter.test',
+    'numpy.tests', 'numpy.f2py', 'pandas.tests', 'pandas.util._tester', 'matplotlib.tests', 'matplotlib.testing',
+]
+
+datas = [
+    ('state_save.csv', '.'),
+    ('Troubleshooting_Info.txt', '.'),
+    ('channel_map.json', '.'),
+]
+
+
+a = Analysis(
+    ['SyntheticBatteryGasController.py'],
+    pathex=[],
+    binaries=[],
+    datas=datas,
+    hiddenimports=[],
+    hookspath=[],
+    hooksconfig={'matplotlib': {'backends': ['TkAgg', 'Agg']}},
+    runtime_hooks=[],
+    excludes=excludes,
+    noarchive=False,
+    optimize=1,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='SyntheticBatteryGasController',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=False,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+    contents_directory='.',
+)
+
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='SyntheticBatteryGasController_onedir',
+)
@@ -2,16 +2,22 @@ import tkinter as tk
 from tkinter import scrolledtext
 from tkinter import Tk, filedialog, simpledialog, messagebox
 import time
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.pyplot as plt
 import math
-import pandas as pd
+import bisect
+import os
+import threading
+import run_analysis
+from channel_map import ChannelMap
+from run_clock import NS
 
 class UI_Object(tk.Tk):
     ## Define all UI variables and build the layout
-    def __init__(self):
+    def __init__(self, channels=None):
         super().__init__()
 
+        # MFC and sensor layout, the graphs, live values and export columns are generated from it
+        self.channels = channels if channels is not None else ChannelMap.load()
+
         # dark mode style coloring
         self.styles = {
             "bg": "#0f1115",
@@ -33,26 +39,40 @@ class UI_Object(tk.Tk):
         # Define names for main displays and buttons
         self.main_display_names = ["Overview and Control", "Live Values","TroubleShooting and Best Practices"]
         self.main_display_titles = self.main_display_names
-        self.function_buttons = ["EMERGENCY STOP", "START TEST", "STOP TEST","TEST RECIPE LOAD", "Send Setpoints", "Ambient Calibration","Connect","Save Data","Clear Data"]
-        self.button_colors = ["#eb4034", "#098930", "#06106C","#ed7c04", "#ed7c04","#16181c","#5C707E","#257661","#257661"]
+        self.function_buttons = ["EMERGENCY STOP", "START TEST", "STOP TEST","TEST RECIPE LOAD", "Send Setpoints", "Ambient Calibration","Connect","Save Data","Clear Data","Analyze Run","Run Archive"]
+        self.button_colors = ["#eb4034", "#098930", "#06106C","#ed7c04", "#ed7c04","#16181c","#5C707E","#257661","#257661","#257661","#257661"]
         self.indicators = ["State","Valve","Arduino"]
 
         # Define graph names and variable names for overview display
-        self.mfc_graphs = ["Test Plan Preview", "MFC 1 Response", "MFC 2 Response","MFC 3 Response","MFC 4 Response","MFC 5 Response"]
-        self.sensor_graphs = ["Pressure Sensors","Gas Sensors"]
+        mfcs = self.channels.mfcs
+        self.sensor_graph_channels = self.channels.sensor_graphs() # {graph name: [channels drawn on it]}
+        self.hrr_graph = "Heat Release Rate"
+        self.mfc_graphs = ["Test Plan Preview"] + [f"{c.name} Response" for c in mfcs]
+        self.sensor_graphs = list(self.sensor_graph_channels) + [self.hrr_graph]
         self.graph_names = self.mfc_graphs+self.sensor_graphs
-        self.graph_variable_names = [["Flow Rate (SLPM)", "Heat Release Rate (kW)"],"Flow Rate (SLPM)", "Flow Rate (SLPM)","Flow Rate (SLPM)","Flow Rate (SLPM)","Flow Rate (SLPM)", "Pressure (psi)","Gas Sensor Response (PPM)"]
+        self.graph_variable_names = ([["Flow Rate (SLPM)", "Heat Release Rate (kW)"]]
+            + [f"Flow Rate ({c.units})" for c in mfcs]
+            + [self.channels.graph_labels.get(g, g) for g in self.sensor_graph_channels]
+            + ["Heat Release Rate (kW)"])
 
         # Variables to report for the Live values screen
         # Each element cooresponds to a column of values
-        self.report_variables = [["MFC 1 Setpoint: ", "MFC 2 Setpoint: ", "MFC 3 Setpoint: ", "MFC 4 Setpoint: ", "MFC 5 Setpoint: "],
-            ["MFC 1 Response: ","MFC 2 Response: ","MFC 3 Response: ","MFC 4 Response: ","MFC 5 Response: "],                  
-            ["Mixing Chamber Pressure: ","Line Pressure: "],
-            ["Gas Sensor 1: ","Gas Sensor 2: ","Line Temperature: "]]
+        shown_sensors = [f"{c.name}: " for c in self.channels.sensors if c.display]
+        self.report_variables = ([[f"{c.name} Setpoint: " for c in mfcs],
+            [f"{c.name} Response: " for c in mfcs]]
+            + [shown_sensors[i:i + 5] for i in range(0, len(shown_sensors), 5)]
+            + [["Achieved HRR: ","Energy Released: ","Chamber Fuel: ","Flammability Margin: "],
+            ["Sample Rate: ","Packet Loss: ","Link Latency: ","Seq Gaps: ","Duplicates: ","ERR Frames: "]])
 
         # Variables for loading in test data
         self.test_columns = [] # [Title1,Title2,Title3,...]
         self.test_plan = [] # [[Time1, Val1.1, Val2.1, ...], [Time2, Val1.2, Val2.2,...], ...]
+        self.recipe_heat_comb = [] # Heat of combustion per gas from the recipe header [kJ/kg]
+        self.recipe_density = [] # Density per gas at STP from the recipe header [g/L]
+        self.recipe_validation = None # RecipeValidation of the loaded recipe, START TEST needs it to pass
+        self.recipe_cache = {} # (path, mtime, resolution, MFCs in use) -> CompiledRecipe, so reloading a recipe skips the conversion
+        self.sweep = None # SweepArchive of the loaded recipe sweep
+        self.rig_manager = None # RigManager when the window is shared by several rigs, dh and cs are then the shown rig's
 
         # Start building the display
         self.window_nav_frame = tk.Frame(self, bg=self.styles["panel_bg"])
@@ -73,6 +93,9 @@ class UI_Object(tk.Tk):
 
         self.grid_rowconfigure(0, weight=1)
 
+        self.canvas = None # overview figure canvas, built after the window first appears
+        self.graphs = {}
+
         self._build_terminal()
         self._build_window_nav()
         self._build_center_displays()
@@ -100,6 +123,10 @@ class UI_Object(tk.Tk):
                 self.cs.emergency_stop()
                 self.set_state(0) # Set state to EMERGENCY STOP to signal all threads to stop
                 time.sleep(0.5)  # Give some time for threads to stop and resources to release
+            if self.rig_manager is not None:
+                self.rig_manager.shutdown() # every rig's link, telemetry server and telemetry bus
+            elif self.dh is not None and self.dh.telemetry_bus is not None:
+                self.dh.telemetry_bus.close()
         except Exception:
             pass
 
@@ -130,6 +157,37 @@ class UI_Object(tk.Tk):
             b.pack(fill="x", padx=6, pady=6)
             self.center_buttons.append(b)
 
+    def build_rig_selector(self, names):
+        # Buttons to pick which rig the window shows, added by RigManager when there is more than one
+        label = tk.Label(self.window_nav_frame, text="Rigs",
+                         fg=self.styles["text"], bg=self.styles["panel_bg"],
+                         font=("Segoe UI", 10, "bold"))
+        label.pack(pady=(18,6))
+
+        self.rig_buttons = []
+        for n in names:
+            b = tk.Button(self.window_nav_frame, text=n,
+                          command=lambda name=n: self.rig_manager.select(name),
+                          bg=self.styles["button_bg"], fg=self.styles["text"],
+                          activebackground=self.styles["button_active"],
+                          relief="flat", padx=8, pady=8)
+            b.pack(fill="x", padx=6, pady=6)
+            self.rig_buttons.append(b)
+
+    def show_rig(self, name):
+        # Called by RigManager after the window was pointed at another rig
+        if len(self.rig_manager.rigs) > 1:
+            self.title(f"Gas_Mixing_UI - {name}")
+            self.write_to_terminal(f"[INFO] Showing {name}")
+        for b in getattr(self, "rig_buttons", []):
+            b.configure(bg=self.styles["accent"] if b["text"] == name else self.styles["button_bg"])
+        ready = self.recipe_validation is not None and self.recipe_validation.ok
+        self.bottom_buttons[self.function_buttons[1]].config(state="normal" if ready else "disabled")
+        if self.cs is not None and self.dh.valve_history:
+            for indicator in self.indicators:
+                self.update_indicators(indicator)
+        self.update_graphs()
+
     def _build_center_displays(self):
         # Populate each center display with objects
 
@@ -169,14 +227,38 @@ class UI_Object(tk.Tk):
             lbl.pack(side="left", padx=10)
             self.indicator_widgets[name] = lbl
 
+        # The graphs need matplotlib, which is slow to import. Show the window and
+        # buttons first, import it in the background and build the figure once it is in.
+        self.graphs_placeholder = tk.Label(frame, text="Loading graphs...",
+                                           fg=self.styles["muted"], bg=self.styles["bg"], font=("Segoe UI", 12))
+        self.graphs_placeholder.pack(fill="both", expand=True)
+        self._graph_import = threading.Thread(target=self._import_graphing, daemon=True)
+        self._graph_import.start()
+        self.after_idle(lambda: self.after(0, self._build_overview_graphs)) # after the first frame is drawn
+
+    def _import_graphing(self):
+        """Import the matplotlib modules the overview graphs need (runs in a background thread)."""
+        import matplotlib.figure
+        import matplotlib.backends.backend_tkagg
+
+    def _build_overview_graphs(self):
+        """Build the overview figure once matplotlib has been imported."""
+        if self._graph_import.is_alive():
+            self.after(20, self._build_overview_graphs)
+            return
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        frame = self.displays[self.main_display_names[0]]
+
         num_graphs = len(self.graph_names)
         ncols = 2
         nrows = math.ceil(num_graphs / ncols)
 
-        fig, axes = plt.subplots(nrows, ncols, figsize=(8, 3 * nrows))
+        fig = Figure(figsize=(8, 3 * nrows))
+        axes = fig.subplots(nrows, ncols)
         axes = axes.flatten() if num_graphs > 1 else [axes]
         self.fig = fig
-        self.graphs = {}
+        graphs = {}
 
         for i, name in enumerate(self.graph_names):
             ax = axes[i]
@@ -187,7 +269,7 @@ class UI_Object(tk.Tk):
             # Test Plan Preview
             if name == self.graph_names[0]:
                 ax.legend([], loc="upper right", fontsize=6, frameon=False)
-                self.graphs[name] = {"ax": ax, "line": None, "lines": []}
+                graphs[name] = {"ax": ax, "line": None, "lines": []}
                 ax.set_ylabel(self.graph_variable_names[i][0])
                 continue
 
@@ -196,23 +278,22 @@ class UI_Object(tk.Tk):
                 line1, = ax.plot([], [], label="Setpoint", linestyle="-")
                 line2, = ax.plot([], [], label="Actual", linestyle="--")
                 ax.legend(fontsize=6, frameon=False, loc="upper right")
-                self.graphs[name] = {"ax": ax, "lines": [line1, line2]}
+                graphs[name] = {"ax": ax, "lines": [line1, line2]}
                 continue
 
-            # Pressure sensor graphs
-            if name == self.sensor_graphs[0]:
-                line1, = ax.plot([], [], label="150 psi sensor", linestyle="-")
-                line2, = ax.plot([], [], label="50 psi sensor", linestyle="-")
+            # Sensor graphs: one line per channel drawn on the graph
+            if name in self.sensor_graph_channels:
+                lines = [ax.plot([], [], label=c.name, linestyle="-")[0] for c in self.sensor_graph_channels[name]]
                 ax.legend(fontsize=6, frameon=False, loc="upper right")
-                self.graphs[name] = {"ax": ax, "lines": [line1, line2]}
+                graphs[name] = {"ax": ax, "lines": lines}
                 continue
 
-            # Gas sensor graphs
-            if name == self.sensor_graphs[1]:
-                line1, = ax.plot([], [], label="Gas Sensor 1", linestyle="-")
-                line2, = ax.plot([], [], label="Gas Sensor 2", linestyle="-")
+            # Heat release rate graph
+            if name == self.hrr_graph:
+                line1, = ax.plot([], [], label="Recipe", linestyle="-")
+                line2, = ax.plot([], [], label="Achieved", linestyle="--")
                 ax.legend(fontsize=6, frameon=False, loc="upper right")
-                self.graphs[name] = {"ax": ax, "lines": [line1, line2]}
+                graphs[name] = {"ax": ax, "lines": [line1, line2]}
                 continue
 
         # Hide unused subplots
@@ -222,10 +303,13 @@ class UI_Object(tk.Tk):
         fig.subplots_adjust(left=0.07, right=0.95, top=0.92, bottom=0.08,
                             wspace=0.35, hspace=0.45)
 
+        self.graphs_placeholder.destroy()
         canvas = FigureCanvasTkAgg(fig, master=frame)
-        canvas.draw()
         canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.graphs = graphs
         self.canvas = canvas
+        canvas.draw_idle()
+        self.update_graphs()
 
     def _build_values_display(self):
         """Build a matrix of blank labels for report variables.
@@ -242,6 +326,29 @@ class UI_Object(tk.Tk):
 
         self.value_labels = {}
 
+        # Getters for each reported variable, generated from the channel map
+        self.value_getters = {}
+        for c in self.channels.mfcs:
+            self.value_getters[f"{c.name} Setpoint: "] = lambda col=c.column: self.dh.setpoint_history[-1][col]
+            self.value_getters[f"{c.name} Response: "] = lambda name=f"{c.name} Response": self.smoothed_value(name)
+        for c in self.channels.sensors:
+            if c.cast is int: # states like the E-stop input are shown as read
+                self.value_getters[f"{c.name}: "] = lambda col=c.column: self.dh.sensor_history[-1][col]
+            else:
+                self.value_getters[f"{c.name}: "] = lambda name=c.name: self.smoothed_value(name)
+        self.value_getters.update({
+            "Achieved HRR: ": lambda: f"{self.dh.hrr_history[-1][1]:.2f} kW",
+            "Energy Released: ": lambda: f"{self.dh.hrr_history[-1][2]:.0f} kJ",
+            "Chamber Fuel: ": lambda: f"{self.dh.mixture_history[-1][1]:.1f} %",
+            "Flammability Margin: ": lambda: f"{self.dh.mixture_history[-1][2]:.1f} %",
+            "Sample Rate: ": lambda: f"{self.dh.link_health.sample_rate():.1f} Hz",
+            "Packet Loss: ": lambda: f"{100 * self.dh.link_health.loss_fraction():.1f} %",
+            "Link Latency: ": lambda: f"{1000 * self.dh.link_health.mean_latency():.0f} ms",
+            "Seq Gaps: ": lambda: self.dh.link_health.gaps,
+            "Duplicates: ": lambda: self.dh.link_health.duplicates,
+            "ERR Frames: ": lambda: self.dh.link_health.errors,
+        })
+
         # Determine max number of rows (longest column)
         max_rows = max(len(col) for col in self.report_variables)
 
@@ -310,6 +417,7 @@ class UI_Object(tk.Tk):
     
     def _build_bottom_buttons(self):
         # Create bottom buttons
+        self.bottom_buttons = {}
         for i, n in enumerate(self.function_buttons):
             b = tk.Button(self.bottom_frame, text=n,
                         command=lambda name=n: self.on_bottom_press(name),
@@ -317,6 +425,10 @@ class UI_Object(tk.Tk):
                         activebackground=self.styles["button_active"],
                         relief="flat", padx=12, pady=8)
             b.pack(side="left", padx=8, pady=8)
+            self.bottom_buttons[n] = b
+
+        # START TEST stays disabled until a recipe passes validation
+        self.bottom_buttons[self.function_buttons[1]].config(state="disabled")
 
     #######################
     ## Begin function handling for UI actions
@@ -331,24 +443,13 @@ class UI_Object(tk.Tk):
         # Handle bottom button presses and call or perform appropriate actions
         if name == self.function_buttons[0]: # EMERGENCY STOP button
             self.write_to_terminal(f"[ACTION] {name} pressed")
-            self.cs.set_state(0) # Set state to EMERGENCY STOP
+            self.request_estop()
         if name == self.function_buttons[1]: # Start button
             self.write_to_terminal(f"[ACTION] {name} pressed")
-            try:
-                if self.test_plan == []:
-                    self.write_to_terminal("[ERROR] No test plan loaded. Cannot start test.")
-                    return
-                self.cs.set_state(2) # Set state to RUN TEST
-                self.write_to_terminal("[INFO] Test started.")
-            except Exception as e:
-                self.write_to_terminal(f"[ERROR] Could not start test: {e}")
+            self.request_start_test()
         if name == self.function_buttons[2]: # Stop button
             self.write_to_terminal(f"[ACTION] {name} pressed")
-            try:
-                self.cs.set_state(1) # Set state to IDLE
-                self.write_to_terminal("[INFO] Test stopped.")
-            except Exception as e:
-                self.write_to_terminal(f"[ERROR] Could not stop test: {e}")
+            self.request_stop_test()
         if name == self.function_buttons[3]: # TEST RECIPE LOAD button
             self.write_to_terminal(f"[ACTION] {name} pressed")
             self.load_and_interpolate_excel()
@@ -374,13 +475,14 @@ class UI_Object(tk.Tk):
                 variable=valve_var
             ).grid(row=1, column=0, columnspan=2, sticky="w", padx=10)
 
+            n_mfcs = self.channels.n_mfcs
             last_setpoints = []
             if len(self.dh.setpoint_history) > 0:
-                last_setpoints = self.dh.setpoint_history[-1][1:6]  # Skip time (index 0), take next 5
+                last_setpoints = self.dh.setpoint_history[-1][1:n_mfcs + 1]  # Skip time (index 0), take one per MFC
 
             sp_vars = []
-            for i in range(5):
-                tk.Label(popup, text=f"MFC {i+1}:").grid(
+            for i in range(n_mfcs):
+                tk.Label(popup, text=f"{self.channels.mfcs[i].name}:").grid(
                     row=i+2, column=0, sticky="e", padx=5, pady=2
                 )
                 v = tk.StringVar()
@@ -397,14 +499,11 @@ class UI_Object(tk.Tk):
                     text = v.get().strip()
                     setpoints.append(float(text) if text else 0.0)
 
-                custom_send = [3, valve_var.get(), *setpoints] # [State (3 = custom setpoints), Valve, MFC1, MFC2, MFC3, MFC4, MFC5]
-                self.cs.custom_setpoints = custom_send
-                self.cs.set_state(3)
-                self.write_to_terminal(f"[UI] Sent custom setpoints: {custom_send}")
-                popup.destroy()
+                if self.request_custom_setpoints(valve_var.get(), setpoints)[0]:
+                    popup.destroy()
 
             tk.Button(popup, text="Enter", command=submit).grid(
-                row=7, column=0, columnspan=2, pady=10
+                row=n_mfcs + 2, column=0, columnspan=2, pady=10
             )
         if name == self.function_buttons[5]:  # Ambient Calibration button
             if self.dh.Arduino_connected:
@@ -420,15 +519,80 @@ class UI_Object(tk.Tk):
             self.save_histories_to_excel()
         if name == self.function_buttons[8]:  # Clear Data button
             self.write_to_terminal(f"[ACTION] {name} pressed")
-            self.dh.setpoint_history = [[0,0,0,0,0]]
-            self.dh.response_history = [[0,0,0,0,0]]
-            self.dh.sensor_history = [[0,0,0,0,0,0]]
+            self.dh.setpoint_history = [self.channels.zero_row("setpoint")]
+            self.dh.response_history = [self.channels.zero_row("response")]
+            self.dh.sensor_history = [self.channels.zero_row("sensor")]
+            self.dh.raw_sensor_history = [self.channels.zero_row("sensor")] if self.dh.raw_sensor_history else []
             self.dh.valve_history = [[0,0]]
+            self.dh.hrr_history = []
+            self.dh.mixture_history = []
+            self.dh.stats.reset()
+            self.dh.hrr.reset()
+            self.dh.link_health.reset()
             self.update_graphs()
             self.write_to_terminal("[INFO] All data histories cleared.")
+        if name == self.function_buttons[9]:  # Analyze Run button
+            self.write_to_terminal(f"[ACTION] {name} pressed")
+            self.analyze_run()
+        if name == self.function_buttons[10]:  # Run Archive button
+            self.write_to_terminal(f"[ACTION] {name} pressed")
+            self.open_run_archive()
 
 
     
+    ######################
+    ## Operator requests. The bottom buttons and the network command server (telemetry_server.py)
+    ## both go through these, so remote commands get the same checks. Each returns (ok, message).
+    def request_estop(self):
+        pressed = time.monotonic() # start of the E-stop latency measurement
+        if self.rig_manager is not None: # the window's E-stop stops every rig it controls
+            self.rig_manager.estop_all(pressed)
+            return True, "Emergency stop set on every rig."
+        self.cs.set_state(0, pressed) # Set state to EMERGENCY STOP
+        return True, "Emergency stop set."
+
+    def request_start_test(self):
+        try:
+            if self.test_plan == []:
+                return self._refuse("No test plan loaded. Cannot start test.")
+            if self.recipe_validation is None or not self.recipe_validation.ok:
+                return self._refuse("Test recipe failed validation. Cannot start test.")
+            self.cs.set_state(2) # Set state to RUN TEST
+            self.write_to_terminal("[INFO] Test started.")
+            return True, "Test started."
+        except Exception as e:
+            return self._refuse(f"Could not start test: {e}")
+
+    def request_stop_test(self):
+        try:
+            self.cs.set_state(1) # Set state to IDLE
+            self.write_to_terminal("[INFO] Test stopped.")
+            return True, "Test stopped."
+        except Exception as e:
+            return self._refuse(f"Could not stop test: {e}")
+
+    def request_custom_setpoints(self, valve, setpoints):
+        """Hold custom setpoints (STATE 3), MFCs without a value get 0. Refused if a value is not a number or outside its MFC's limits."""
+        n_mfcs = self.channels.n_mfcs
+        if not 0 < len(setpoints) <= n_mfcs:
+            return self._refuse(f"Expected 1 to {n_mfcs} setpoints, got {len(setpoints)}.")
+        for channel, value in zip(self.channels.mfcs, setpoints):
+            low, high = (channel.limits[0], channel.limits[3]) if channel.limits else (0, math.inf)
+            if channel.full_scale is not None:
+                high = min(high, channel.full_scale)
+            if not (low <= value <= high): # also catches NaN
+                return self._refuse(f"{channel.name} setpoint {value} is outside {low} to {high} {channel.units}.")
+        custom_send = self.channels.setpoint_frame(3, 1 if valve else 0, setpoints) # [State (3 = custom setpoints), Valve, MFC1, ..., MFCn]
+        self.cs.custom_setpoints = custom_send
+        self.cs.set_state(3)
+        self.write_to_terminal(f"[UI] Sent custom setpoints: {custom_send}")
+        return True, f"Sent custom setpoints: {custom_send}"
+
+    def _refuse(self, message):
+        self.write_to_terminal(f"[ERROR] {message}")
+        return False, message
+
+
     def show_display(self, name):
         # Handle navigation button presses to switch center display
         if name not in self.displays:
@@ -483,21 +647,22 @@ class UI_Object(tk.Tk):
 
     def update_graphs(self):
         """Update all graphs using stored data (no inputs)."""
-        now = time.time()
+        if self.canvas is None or self.dh is None:
+            return # graphs are still being built after startup
+        now = self.dh.clock.now_ns() # history times are int ns on the run clock
         window = 60*5  # 5 minutes [seconds]
 
         # [t, ...] entries exsisting within window
         def recent(data):
-            return [d for d in data if len(d) > 0 and (now - d[0]) <= window]
+            return [d for d in data if len(d) > 0 and (now - d[0]) <= window * NS]
 
         #Collect and filter histories
         setpoints = recent(self.dh.setpoint_history)
         responses = recent(self.dh.response_history)
         sensors  = recent(self.dh.sensor_history)
+        hrr = recent(self.dh.hrr_history)
 
-        # split sensors into pressure and gas sensor lists
-        pressure_sensors = [[s[0]] + s[1:3] for s in sensors if len(s) > 3] # [[time, pressure1, pressure2],...]
-        gas_sensors = [[s[0]] + s[3:5] for s in sensors if len(s) > 3]
+        sensors = [s for s in sensors if len(s) > self.channels.n_sensors] # drop cleared placeholder rows
 
         # Test Plan Preview
         if not self.dh.running == True:
@@ -510,21 +675,21 @@ class UI_Object(tk.Tk):
             else:
                 time_data = [row[0] for row in self.test_plan]
 
-                # Plot Gas SLPM columns (indices 1-6 in test_plan, columns 0-5 in test_columns)
-                for i in range(1, 6):
+                # Plot Gas SLPM columns (indices 1-n in test_plan, columns 0-(n-1) in test_columns)
+                for i in range(1, len(self.test_columns) + 1):
                     col_name = self.test_columns[i - 1]
                     y_data = [row[i] for row in self.test_plan]
                     ax.plot(time_data, y_data, label=col_name)
 
                 ax.autoscale_view()
                 ax.set_title(self.graph_names[0])
-                ax.set_xlabel(self.test_columns[0])
+                ax.set_xlabel("Time (s)")
                 ax.set_ylabel(self.graph_variable_names[0][0])
 
-                # Plot HRR on secondary axis (index 7 in test_plan, index 6 in test_columns)
+                # Plot HRR on secondary axis (last column of test_plan)
                 ax2 = ax.twinx()
-                y_data_secondary = [row[7] for row in self.test_plan]
-                ax2.plot(time_data, y_data_secondary, color="orange", label=self.test_columns[5])
+                y_data_secondary = [row[-1] for row in self.test_plan]
+                ax2.plot(time_data, y_data_secondary, color="orange", label="Heat Release Rate")
                 ax2.set_ylabel(self.graph_variable_names[0][1])
 
                 lines1, labels1 = ax.get_legend_handles_labels()
@@ -534,7 +699,7 @@ class UI_Object(tk.Tk):
                         loc="upper right", fontsize=6, frameon=False)
 
         # MFC Graphs (each has two lines)
-        for i, name in enumerate(self.mfc_graphs[1:self.dh.num_mfcs+1], start=0):  # skip test plan and only loop through MFC's in use
+        for c, name in zip(self.channels.mfcs[:self.dh.num_mfcs], self.mfc_graphs[1:]):  # skip test plan and only loop through MFC's in use
             if name not in self.graphs:
                 continue
             graph = self.graphs[name]
@@ -553,10 +718,10 @@ class UI_Object(tk.Tk):
 
             try:
                 # Extract data for this MFC index
-                times_sp = [row[0]-now for row in setpoints]
-                sp_vals  = [row[i+1] for row in setpoints]
-                times_rp = [row[0]-now for row in responses]
-                rp_vals  = [row[i+1] for row in responses]
+                times_sp = [(row[0]-now) / NS for row in setpoints]
+                sp_vals  = [row[c.column] for row in setpoints]
+                times_rp = [(row[0]-now) / NS for row in responses]
+                rp_vals  = [row[c.column] for row in responses]
 
                 lines[0].set_data(times_sp, sp_vals)
                 lines[1].set_data(times_rp, rp_vals)
@@ -565,33 +730,37 @@ class UI_Object(tk.Tk):
             except Exception as e:
                 self.write_to_terminal(f"[ERROR] Updating {name}: {e}")
 
-        # Sensor Graphs
-        if pressure_sensors:
-            times = [row[0]-now for row in pressure_sensors]
-            name = self.sensor_graphs[0] # Pressure Sensors
-            graph = self.graphs[name]
-            ax = graph["ax"]
-            lines = graph["lines"]
+        # Sensor Graphs, one line per channel in the channel map
+        if sensors:
+            times = [(row[0]-now) / NS for row in sensors]
+            for name, graph_channels in self.sensor_graph_channels.items():
+                graph = self.graphs[name]
+                ax = graph["ax"]
+                lines = graph["lines"]
 
-            try:
-                lines[0].set_data(times, [row[1] for row in pressure_sensors])
-                lines[1].set_data(times, [row[2] for row in pressure_sensors])
-                ax.relim()
-                ax.autoscale_view()
-            except Exception as e:
-                self.write_to_terminal(f"[ERROR] Updating {name}: {e}")
-                    
-        # Gas sensor Graphs
-        if gas_sensors:
-            times = [row[0]-now for row in gas_sensors]
-            name = self.sensor_graphs[1] # Gas Sensors
+                try:
+                    for line, c in zip(lines, graph_channels):
+                        line.set_data(times, [row[c.column] for row in sensors])
+                    ax.relim()
+                    ax.autoscale_view()
+                except Exception as e:
+                    self.write_to_terminal(f"[ERROR] Updating {name}: {e}")
+
+        # Heat release rate graph, recipe HRR is placed on the same clock as the achieved HRR
+        if hrr:
+            name = self.hrr_graph
             graph = self.graphs[name]
             ax = graph["ax"]
             lines = graph["lines"]
 
             try:
-                lines[0].set_data(times, [row[1] for row in gas_sensors])
-                lines[1].set_data(times, [row[2] for row in gas_sensors])
+                if self.dh.running and self.test_plan:
+                    offset = (self.dh.run_start_ns - now) / NS
+                    lines[0].set_data([row[0] + offset for row in self.test_plan if row[0] + offset >= -window],
+                                      [row[-1] for row in self.test_plan if row[0] + offset >= -window])
+                else:
+                    lines[0].set_data([], [])
+                lines[1].set_data([(row[0]-now) / NS for row in hrr], [row[1] for row in hrr])
                 ax.relim()
                 ax.autoscale_view()
             except Exception as e:
@@ -609,25 +778,16 @@ class UI_Object(tk.Tk):
         # Redraw all graphs
         self.canvas.draw_idle()
 
+    def smoothed_value(self, name):
+        """A channel's mean over the display window, so the Live Values do not flicker with every noisy sample."""
+        stats = self.dh.stats
+        if not stats.n:
+            raise IndexError("no samples yet")
+        return f"{stats.mean(name, self.channels.display_window):.3f}"
+
     def update_values_display(self):
 
-        values = {
-        "MFC 1 Setpoint: ": lambda: self.dh.setpoint_history[-1][1],
-        "MFC 2 Setpoint: ": lambda: self.dh.setpoint_history[-1][2],
-        "MFC 3 Setpoint: ": lambda: self.dh.setpoint_history[-1][3],
-        "MFC 4 Setpoint: ": lambda: self.dh.setpoint_history[-1][4],
-        "MFC 5 Setpoint: ": lambda: self.dh.setpoint_history[-1][5],
-        "MFC 1 Response: ": lambda: self.dh.response_history[-1][1],
-        "MFC 2 Response: ": lambda: self.dh.response_history[-1][2],
-        "MFC 3 Response: ": lambda: self.dh.response_history[-1][3],
-        "MFC 4 Response: ": lambda: self.dh.response_history[-1][4],
-        "MFC 5 Response: ": lambda: self.dh.response_history[-1][5],                  
-        "Mixing Chamber Pressure: ": lambda: self.dh.sensor_history[-1][1],
-        "Line Pressure: ": lambda: self.dh.sensor_history[-1][2],
-        "Gas Sensor 1: ": lambda: self.dh.sensor_history[-1][3],
-        "Gas Sensor 2: ": lambda: self.dh.sensor_history[-1][4],
-        "Line Temperature: ": lambda: self.dh.sensor_history[-1][5]
-        }
+        values = self.value_getters
 
         for var, lbl in self.value_labels.items():
             if var not in values:
@@ -651,78 +811,244 @@ class UI_Object(tk.Tk):
 
         # Open file dialog
         file_path = filedialog.askopenfilename(
-            title="Select Excel File",filetypes=[("Excel files", "*.xlsx *.xls")])
+            title="Select Excel File",filetypes=[("Excel files", "*.xlsx *.xls"), ("Recipe sweeps", "*.npz")])
 
         if not file_path:
             self.write_to_terminal("No file selected.")
             return None, None
 
-        # Load the Excel file
-        data = pd.read_excel(file_path, header=None).to_numpy()
-
-        t = [row[0] for row in data[4:]] # Time in seconds
-        HRR = [row[7] for row in data[4:]] # Heat release rate in kW
-
-        # Heat of combustion for all inputted gasses in kj/kg
-        Gas_1_Heat_Comb = data[2][1]
-        Gas_2_Heat_Comb = data[2][2]
-        Gas_3_Heat_Comb = data[2][3]
-        Gas_4_Heat_Comb = data[2][4]
-        Gas_5_Heat_Comb = data[2][5]
-        Gas_6_Heat_Comb = data[2][6]
-
-        # Fuel density for all inputted gasses at STP in g/L 
-        Gas_1_density = data[3][1]
-        Gas_2_density = data[3][2]
-        Gas_3_density = data[3][3]
-        Gas_4_density = data[3][4]
-        Gas_5_density = data[3][5]
-        Gas_6_density = data[3][6]
-
-        Gas_1_percent = [row[1] for row in data[4:]]
-        Gas_2_percent = [row[2] for row in data[4:]]
-        Gas_3_percent = [row[3] for row in data[4:]]
-        Gas_4_percent = [row[4] for row in data[4:]]
-        Gas_5_percent = [row[5] for row in data[4:]]
-        Gas_6_percent = [row[6] for row in data[4:]]
-
-        Gas_1_SLPM = [0 if heat_comb == 0 else percent * (HRR[i] / heat_comb) * 60000 / density for i, (percent, heat_comb, density) in enumerate(zip(Gas_1_percent, [Gas_1_Heat_Comb] * len(Gas_1_percent), [Gas_1_density] * len(Gas_1_percent)))]
-        Gas_2_SLPM = [0 if heat_comb == 0 else percent * (HRR[i] / heat_comb) * 60000 / density for i, (percent, heat_comb, density) in enumerate(zip(Gas_2_percent, [Gas_2_Heat_Comb] * len(Gas_2_percent), [Gas_2_density] * len(Gas_2_percent)))]
-        Gas_3_SLPM = [0 if heat_comb == 0 else percent * (HRR[i] / heat_comb) * 60000 / density for i, (percent, heat_comb, density) in enumerate(zip(Gas_3_percent, [Gas_3_Heat_Comb] * len(Gas_3_percent), [Gas_3_density] * len(Gas_3_percent)))]
-        Gas_4_SLPM = [0 if heat_comb == 0 else percent * (HRR[i] / heat_comb) * 60000 / density for i, (percent, heat_comb, density) in enumerate(zip(Gas_4_percent, [Gas_4_Heat_Comb] * len(Gas_4_percent), [Gas_4_density] * len(Gas_4_percent)))]
-        Gas_5_SLPM = [0 if heat_comb == 0 else percent * (HRR[i] / heat_comb) * 60000 / density for i, (percent, heat_comb, density) in enumerate(zip(Gas_5_percent, [Gas_5_Heat_Comb] * len(Gas_5_percent), [Gas_5_density] * len(Gas_5_percent)))]
-        Gas_6_SLPM = [0 if heat_comb == 0 else percent * (HRR[i] / heat_comb) * 60000 / density for i, (percent, heat_comb, density) in enumerate(zip(Gas_6_percent, [Gas_6_Heat_Comb] * len(Gas_6_percent), [Gas_6_density] * len(Gas_6_percent)))]
-
-
-        # convert to graphable format according to standard in rest of code
-        self.test_plan = [] # [[Time1, Val1.1, Val2.1, ...], [Time2, Val1.2, Val2.2,...], ...]
-        for i in range(len(t)):
-            self.test_plan.append([t[i], Gas_1_SLPM[i], Gas_2_SLPM[i], Gas_3_SLPM[i], Gas_4_SLPM[i], Gas_5_SLPM[i], Gas_6_SLPM[i], HRR[i]])
+        if file_path.endswith(".npz"):
+            self.load_sweep(file_path)
+            return
+
+        # Reuse the compiled plan if this exact file was already loaded
+        cache_key = (file_path, os.path.getmtime(file_path), resolution, self.dh.num_mfcs)
+        if cache_key in self.recipe_cache:
+            self.write_to_terminal("[INFO] Loaded cached recipe.")
+            self.use_compiled_recipe(self.recipe_cache[cache_key], os.path.basename(file_path))
+            return
 
-        # Interpolate the plan for smooth execution
-        if len(self.test_plan) >= 2:
-            interpolated = []
-            for i in range(len(self.test_plan) - 1):
-                t0, t1 = self.test_plan[i][0], self.test_plan[i + 1][0]
-                vals0, vals1 = self.test_plan[i][1:], self.test_plan[i + 1][1:]
+        # Load, validate and convert the Excel file (shared with the batch compiler)
+        import recipe_compiler # imports pandas, only needed once a recipe is loaded
+        compiled = recipe_compiler.load_recipe(file_path, self.channels, self.dh.num_mfcs, resolution)
+        if compiled.plan:
+            self.recipe_cache[cache_key] = compiled
+        self.use_compiled_recipe(compiled, os.path.basename(file_path))
+
+    def use_compiled_recipe(self, compiled, name="Recipe"):
+        """Make a compiled recipe (CompiledRecipe) the test plan. name is what the run archive files its tests under."""
+        self.recipe_validation = compiled.validation
+        self.test_plan = compiled.plan
+        self.test_columns = compiled.gas_names
+        self.recipe_heat_comb = compiled.heat_comb
+        self.recipe_density = compiled.density
+        if self.test_plan:
+            self.write_to_terminal(f"[INFO] Recipe reduced from {compiled.full_rows} to {len(self.test_plan)} breakpoints.")
+            self.dh.hrr.set_recipe(self.recipe_heat_comb, self.recipe_density, self.dh.num_mfcs)
+            self.dh.mixture.set_recipe(self.test_columns, self.dh.num_mfcs)
+            self.dh.set_run_recipe(name, self.test_plan, self.test_columns, self.recipe_heat_comb, self.recipe_density)
+        self.show_validation()
+        self.update_graphs()
 
-                t = t0
-                while t < t1:
-                    alpha = (t - t0) / (t1 - t0)
-                    interp_vals = [v0 + alpha * (v1 - v0) for v0, v1 in zip(vals0, vals1)]
-                    interpolated.append([t] + interp_vals)
-                    t += resolution
+    def load_sweep(self, file_path):
+        """Open a compiled recipe sweep (recipe_sweep.py) and show a list to switch between its variants."""
+        import recipe_sweep
+        try:
+            self.sweep = recipe_sweep.SweepArchive(file_path)
+        except Exception as e:
+            self.write_to_terminal(f"[ERROR] Could not load recipe sweep: {e}")
+            return
+        self.write_to_terminal(f"[INFO] Loaded sweep with {len(self.sweep)} variants, "
+                               f"{int(self.sweep.feasible.sum())} feasible.")
+        if self.sweep.n_mfcs != self.dh.num_mfcs:
+            self.write_to_terminal(f"[WARNING] Sweep was checked for {self.sweep.n_mfcs} MFCs, "
+                                   f"{self.dh.num_mfcs} are in use.")
+
+        popup = tk.Toplevel(self)
+        popup.title("Recipe Sweep")
+        popup.transient(self)
+        listbox = tk.Listbox(popup, width=60, height=min(len(self.sweep), 20), exportselection=False)
+        for i, label in enumerate(self.sweep.labels):
+            listbox.insert("end", label if self.sweep.feasible[i] else f"{label}  [FAILS VALIDATION]")
+        listbox.pack(side="left", fill="both", expand=True, padx=10, pady=10)
+        scrollbar = tk.Scrollbar(popup, command=listbox.yview)
+        scrollbar.pack(side="right", fill="y")
+        listbox.config(yscrollcommand=scrollbar.set)
+
+        def select(event=None):
+            if not listbox.curselection():
+                return
+            if self.cs is not None and self.cs.STATE == 2:
+                self.write_to_terminal("[ERROR] Cannot switch recipe while a test is running.")
+                return
+            i = listbox.curselection()[0]
+            self.write_to_terminal(f"[INFO] Sweep variant: {self.sweep.labels[i]}")
+            self.use_compiled_recipe(self.sweep.variant(i), f"{os.path.basename(file_path)} [{self.sweep.labels[i]}]")
+        listbox.bind("<<ListboxSelect>>", select)
+
+    def show_validation(self):
+        """Print the recipe validation report and only enable START TEST if it passed."""
+        report = self.recipe_validation
+        if report is None:
+            return
+        self.write_to_terminal("[VALIDATION]\n" + report.format())
+        self.bottom_buttons[self.function_buttons[1]].config(state="normal" if report.ok else "disabled")
 
-            interpolated.append(self.test_plan[-1][:])
-            self.test_plan[:] = interpolated
+    def analyze_run(self):
+        """Compute delivered gas mass, HRR tracking error and MFC step metrics in a worker process."""
+        if not self.recipe_density:
+            self.write_to_terminal("[ERROR] Load the test recipe used for this run before analyzing it.")
+            return
+        width = self.channels.n_mfcs + 1 # [time, MFC1..MFCn]
+        start = self.dh.run_start_ns # the histories carry on across runs, only analyze this one
 
+        def since(history):
+            return history[bisect.bisect_left(history, start, key=lambda row: row[0]):]
 
+        setpoints = run_analysis.history_to_array(since(self.dh.setpoint_history), width)
+        responses = run_analysis.history_to_array(since(self.dh.response_history), width)
+        if len(setpoints) < 2 or len(responses) < 2:
+            self.write_to_terminal("[ERROR] Not enough recorded data to analyze.")
+            return
+        setpoints[:, 0] /= NS # run clock [ns] to seconds
+        responses[:, 0] /= NS
 
-        self.test_columns = [data[0][1], data[0][2], data[0][3], data[0][4], data[0][5], data[0][6]]
+        future = run_analysis.submit_analysis(
+            setpoints, responses, self.test_plan, self.recipe_heat_comb, self.recipe_density,
+            run_start=self.dh.run_start_ns / NS, gas_names=self.test_columns, n_mfcs=self.dh.num_mfcs)
+        self.write_to_terminal("[INFO] Run analysis started...")
 
-        self.update_graphs()
+        def done(f):
+            try:
+                summary = run_analysis.format_summary(f.result())
+                self.after(0, lambda: self.write_to_terminal("[ANALYSIS]\n" + summary))
+            except Exception as e:
+                msg = f"[ERROR] Run analysis failed: {e}" # e is unbound once the except block ends
+                self.after(0, lambda m=msg: self.write_to_terminal(m))
+        future.add_done_callback(done)
+
+    def open_run_archive(self):
+        """Search the archived runs (run_archive.py), compare their metrics and overlay their telemetry."""
+        import run_archive
+        directory = self.dh.archive_dir()
+        if not os.path.exists(os.path.join(directory, run_archive.CATALOGUE)):
+            self.write_to_terminal(f"[ERROR] No runs archived yet in {directory}.")
+            return
+        archive = run_archive.RunArchive(directory)
+
+        popup = tk.Toplevel(self)
+        popup.title("Run Archive")
+        popup.transient(self)
+        filters = {}
+        hints = {"Recipe": "name or hash, or the start of one", "Since": "YYYY-MM-DD [HH:MM]", "Before": "YYYY-MM-DD [HH:MM]",
+                 "Where": "e.g. Max Achieved HRR (kW) > 50; Min Flammability Margin (%) < 2"}
+        for row, (label, hint) in enumerate(hints.items()):
+            tk.Label(popup, text=f"{label}:").grid(row=row, column=0, sticky="e", padx=5, pady=2)
+            filters[label] = tk.StringVar()
+            entry = tk.Entry(popup, textvariable=filters[label], width=50)
+            entry.grid(row=row, column=1, sticky="we", padx=5, pady=2)
+            entry.bind("<Return>", lambda event: search())
+            tk.Label(popup, text=hint).grid(row=row, column=2, sticky="w", padx=5)
+
+        listbox = tk.Listbox(popup, width=110, height=20, selectmode="extended", exportselection=False, font=("Consolas", 9))
+        listbox.grid(row=4, column=0, columnspan=3, sticky="nsew", padx=(10, 0), pady=5)
+        scrollbar = tk.Scrollbar(popup, command=listbox.yview)
+        scrollbar.grid(row=4, column=3, sticky="ns", pady=5)
+        listbox.config(yscrollcommand=scrollbar.set)
+        popup.grid_rowconfigure(4, weight=1)
+        popup.grid_columnconfigure(1, weight=1)
+
+        controls = tk.Frame(popup)
+        controls.grid(row=5, column=0, columnspan=3, sticky="we", padx=10, pady=(0, 10))
+        status = tk.Label(controls, text="")
+        fields = run_archive.telemetry_fields(self.channels)[1:]
+        field_var = tk.StringVar(value="Achieved HRR (kW)")
+        found = []
+
+        def search():
+            try:
+                since, before = (run_archive.parse_date(filters[k].get()) if filters[k].get().strip() else None
+                                 for k in ("Since", "Before"))
+                where = [c for c in filters["Where"].get().split(";") if c.strip()]
+                rows = archive.find(filters["Recipe"].get().strip() or None, since=since, until=before, where=where)
+            except ValueError as e:
+                self.write_to_terminal(f"[ERROR] Run archive search: {e}")
+                return
+            found[:] = rows
+            peaks = archive.metrics([r["id"] for r in rows], ["Max Achieved HRR (kW)"])
+            listbox.delete(0, "end")
+            for r in rows:
+                peak = peaks[r["id"]].get("Max Achieved HRR (kW)", math.nan)
+                listbox.insert("end", f"#{r['id']:<6}{run_archive.time_text(r['started'])}  {r['kind']:<7}"
+                                      f"{(r['recipe_name'] or '-')[:32]:<33}{r['duration']:8.1f} s  peak {peak:7.1f} kW  "
+                                      f"{r['faults']:3d} faults{'  E-STOP' if r['end_state'] == 0 else ''}")
+            status.config(text=f"{len(rows)} runs")
+
+        def selected():
+            rows = [found[i] for i in listbox.curselection()]
+            if not rows:
+                self.write_to_terminal("[ERROR] Select one or more runs in the list first.")
+            return rows
+
+        def compare():
+            rows = selected()
+            if rows:
+                names = (["Max Achieved HRR (kW)", "Max Energy Released (kJ)", "HRR RMS Error (kW)", "Min Flammability Margin (%)"]
+                         + [f"Max {self.channels.sensor(n).label}" for n in self.channels.trip_channels])
+                table = run_archive.format_runs(rows, archive.metrics([r["id"] for r in rows], names), names)
+                self.write_to_terminal("[RUN ARCHIVE]\n" + table)
+
+        def events():
+            for r in selected():
+                lines = [f"  {t:8.2f} s [{kind}] {message}" for t, kind, message in archive.events(r["id"])]
+                self.write_to_terminal(f"[RUN ARCHIVE] Run #{r['id']} events:\n" + ("\n".join(lines) or "  none"))
+
+        def overlay():
+            rows = selected()
+            if rows:
+                self.show_run_overlay(archive, rows, field_var.get())
+
+        tk.Button(controls, text="Search", command=search).pack(side="left", padx=(0, 5))
+        tk.OptionMenu(controls, field_var, *fields).pack(side="left", padx=5)
+        tk.Button(controls, text="Overlay", command=overlay).pack(side="left", padx=5)
+        tk.Button(controls, text="Compare", command=compare).pack(side="left", padx=5)
+        tk.Button(controls, text="Events", command=events).pack(side="left", padx=5)
+        status.pack(side="right")
+        search()
+
+    def show_run_overlay(self, archive, rows, field):
+        """Plot one telemetry field of many archived runs on one axis, from their memory mapped files."""
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+        from matplotlib.collections import LineCollection
+        from matplotlib import cm
+        import numpy as np
+
+        traces = archive.overlay(rows, field)
+        if not traces:
+            self.write_to_terminal(f"[ERROR] None of the selected runs recorded {field}.")
+            return
+        window = tk.Toplevel(self)
+        window.title(f"{field}, {len(traces)} runs")
+        fig = Figure(figsize=(9, 5), dpi=100)
+        ax = fig.add_subplot(111)
+        colors = cm.viridis(np.linspace(0, 1, len(traces)))
+        ax.add_collection(LineCollection([np.column_stack([t, y]) for _, t, y in traces], colors=colors, linewidths=0.8))
+        ax.autoscale()
+        if len(traces) <= 10: # a legend of hundreds of runs says nothing
+            for (run_id, _, _), color in zip(traces, colors):
+                ax.plot([], [], color=color, label=f"#{run_id}")
+            ax.legend(fontsize=8)
+        ax.set_xlabel("Time from run start (s)")
+        ax.set_ylabel(field)
+        ax.grid(True, alpha=0.3)
+        canvas = FigureCanvasTkAgg(fig, master=window)
+        NavigationToolbar2Tk(canvas, window) # zoom and pan
+        canvas.get_tk_widget().pack(fill="both", expand=True)
+        canvas.draw()
 
     def save_histories_to_excel(self):
+        import pandas as pd # imported on first export to keep startup fast
 
         if (self.dh.setpoint_history == [] and self.dh.response_history == []
                 and self.dh.sensor_history == [] and self.dh.valve_history == []):
@@ -792,30 +1118,31 @@ class UI_Object(tk.Tk):
         # --- Build time axis from whichever history is longest ---
         anchor = max(all_histories, key=lambda h: len(h) if h else 0)
         time = [
-            (row[0] - self.dh.run_start) if row and len(row) > 0 else None
+            (row[0] - self.dh.run_start_ns) / NS if row and len(row) > 0 else None
             for row in anchor
         ]
         time = extract_col([[v] for v in time], 0, target_len, fallback=0.0)
 
-        n_mfc_set  = min(5, self.dh.num_mfcs)
-        n_mfc_resp = min(5, self.dh.num_mfcs)
-        n_sensors  = 5
-
         data = {"Time (s)": time}
 
-        for i in range(n_mfc_set):
-            col = extract_col(self.dh.setpoint_history, i + 1, target_len)
-            data[f"MFC {i+1} Setpoint (SLPM)"] = col
+        mfcs = self.channels.mfcs[:self.dh.num_mfcs]
+        for c in mfcs:
+            data[f"{c.name} Setpoint ({c.units})"] = extract_col(self.dh.setpoint_history, c.column, target_len)
+
+        for c in mfcs:
+            data[f"{c.name} Response ({c.units})"] = extract_col(self.dh.response_history, c.column, target_len)
 
-        for i in range(n_mfc_resp):
-            col = extract_col(self.dh.response_history, i + 1, target_len)
-            data[f"MFC {i+1} Response (SLPM)"] = col
+        for c in self.channels.sensors:
+            data[c.label] = extract_col(self.dh.sensor_history, c.column, target_len)
+        if self.dh.raw_sensor_history: # filtered sensors also get their readings as the Arduino sent them
+            for c in self.channels.sensors:
+                if c.extra.get("filters"):
+                    data[f"{c.name} Raw"] = extract_col(self.dh.raw_sensor_history, c.column, target_len)
 
-        sensor_names = ["MC Pressure", "Line Pressure", "Gas 1", "Gas 2", "Line Temperature"]
-        for i in range(n_sensors):
-            name = sensor_names[i] if i < len(sensor_names) else f"Sensor {i+1}"
-            col = extract_col(self.dh.sensor_history, i + 1, target_len)
-            data[name] = col
+        data["Achieved HRR (kW)"] = extract_col(self.dh.hrr_history, 1, target_len)
+        data["Energy Released (kJ)"] = extract_col(self.dh.hrr_history, 2, target_len)
+        data["Chamber Fuel (%)"] = extract_col(self.dh.mixture_history, 1, target_len)
+        data["Flammability Margin (%)"] = extract_col(self.dh.mixture_history, 2, target_len)
 
         valve_col = extract_col(self.dh.valve_history, 1, target_len, fallback=0)
         data["Valve State"] = [int(v) for v in valve_col]
@@ -0,0 +1,108 @@
+"""
+Size and startup-time report for PyInstaller builds, to compare build profiles.
+
+    pyinstaller SyntheticBatteryGasController.spec
+    pyinstaller SyntheticBatteryGasController_onedir.spec
+    python build_report.py dist/SyntheticBatteryGasController.exe dist/SyntheticBatteryGasController_onedir -o build_report.json
+
+Each build is either a onefile exe or a onedir folder. The report lists the
+total size, file count and largest entries of each build and the median
+startup phases from startup_benchmark.py, together with the Python, package
+and git versions the builds were made from so runs can be compared later.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from importlib import metadata
+
+import startup_benchmark
+
+APP_NAME = "SyntheticBatteryGasController"
+PACKAGES = ("pyinstaller", "numpy", "pandas", "matplotlib", "openpyxl", "pyserial")
+
+
+def find_exe(build):
+    """The exe of a onefile build (the path itself) or of a onedir build folder."""
+    if os.path.isfile(build):
+        return build
+    for name in (APP_NAME + ".exe", APP_NAME):
+        path = os.path.join(build, name)
+        if os.path.isfile(path):
+            return path
+    raise FileNotFoundError(f"No {APP_NAME} executable in {build}")
+
+
+def build_size(build):
+    """(total bytes, file count, [(entry, bytes)] largest top-level entries first)."""
+    if os.path.isfile(build):
+        size = os.path.getsize(build)
+        return size, 1, [(os.path.basename(build), size)]
+    entries = {}
+    count = 0
+    for root, _, files in os.walk(build):
+        for name in files:
+            path = os.path.join(root, name)
+            top = os.path.relpath(path, build).split(os.sep)[0]
+            entries[top] = entries.get(top, 0) + os.path.getsize(path)
+            count += 1
+    return sum(entries.values()), count, sorted(entries.items(), key=lambda e: -e[1])
+
+
+def environment():
+    """Versions the builds were made from."""
+    versions = {}
+    for pkg in PACKAGES:
+        try:
+            versions[pkg] = metadata.version(pkg)
+        except metadata.PackageNotFoundError:
+            versions[pkg] = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"platform": platform.platform(), "python": sys.version.split()[0], "packages": versions, "commit": commit}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare PyInstaller build profiles by size and startup time.")
+    parser.add_argument("builds", nargs="+", help="onefile exe paths or onedir build folders")
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per build (default: 5)")
+    parser.add_argument("--top", type=int, default=10, help="largest entries to list per build (default: 10)")
+    parser.add_argument("-o", "--output", default=None, help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = {"environment": environment(), "builds": []}
+    for build in args.builds:
+        size, count, entries = build_size(build)
+        startup = startup_benchmark.benchmark(args.runs, find_exe(build))
+        report["builds"].append({"build": build, "bytes": size, "files": count,
+                                 "largest": entries[:args.top], "startup": startup})
+
+    env = report["environment"]
+    print(f"{env['platform']}, Python {env['python']}, commit {env['commit']}")
+    print(", ".join(f"{k} {v}" for k, v in env["packages"].items() if v))
+    print()
+    print(f"| Build | Size (MB) | Files | {' | '.join(p.title() + ' (ms)' for p in startup_benchmark.PHASES[2:])} |")
+    print("|---|---|---|" + "---|" * len(startup_benchmark.PHASES[2:]))
+    for b in report["builds"]:
+        times = [f"{1000 * b['startup'][p][0]:.0f}" if p in b["startup"] else "-" for p in startup_benchmark.PHASES[2:]]
+        print(f"| {b['build']} | {b['bytes'] / 1e6:.1f} | {b['files']} | {' | '.join(times)} |")
+    for b in report["builds"]:
+        if "error" in b["startup"]:
+            print(f"\n{b['build']}: startup did not complete ({b['startup']['error']})")
+        print(f"\nLargest entries in {b['build']}:")
+        for name, n in b["largest"]:
+            print(f"  {n / 1e6:8.1f} MB  {name}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import json
+import os
+from operator import itemgetter
+
+CHANNEL_MAP_PATH = "channel_map.json"
+
+# Layout of the current 5 MFC rig, used when channel_map.json is missing
+DEFAULT_CHANNEL_MAP = {
+    "frame": {"seq": 0, "state": 1, "valve": 2, "length": 14},
+    "response_limits": {"warn_ratio": 1.1, "max_ratio": 1.5},
+    "stats": {"rate_window": 1.0, "display_window": 1.0},
+    "pressure_trip": {"channels": ["Mixing Chamber Pressure", "Line Pressure"], "window": 1.0, "margin": 0.2, "throttle": 0.5, "hold": 2.0},
+    "mixture": {"volume": 20.0, "temperature_channel": "Line Temperature", "limits": [0, 2, 100, 100]},
+    "graphs": {"Pressure Sensors": "Pressure (psi)", "Gas Sensors": "Gas Sensor Response (PPM)"},
+    "mfcs": [
+        {"name": f"MFC {i+1}", "index": 3 + i, "units": "SLPM", "full_scale": 500, "accuracy": 0.01, "max_rate": 250, "limits": [0, 0, 450, 500]}
+        for i in range(5)
+    ],
+    "sensors": [
+        {"name": "Mixing Chamber Pressure", "index": 8, "units": "psi", "full_scale": 150, "graph": "Pressure Sensors", "limits": [0, 0, 23, 25]},
+        {"name": "Line Pressure", "index": 9, "units": "psi", "full_scale": 50, "graph": "Pressure Sensors", "limits": [0, 0, 23, 25]},
+        {"name": "Gas Sensor 1", "index": 10, "units": "PPM", "full_scale": 1, "graph": "Gas Sensors", "limits": None, "filters": [{"type": "median", "n": 5}, {"type": "ema", "tau": 0.5}]},
+        {"name": "Gas Sensor 2", "index": 11, "units": "PPM", "full_scale": 1, "graph": "Gas Sensors", "limits": None, "filters": [{"type": "median", "n": 5}, {"type": "ema", "tau": 0.5}]},
+        {"name": "Line Temperature", "index": 12, "units": "C", "full_scale": None, "graph": None, "limits": None},
+        {"name": "E-Stop", "index": 13, "units": "", "full_scale": 1, "graph": None, "limits": None, "type": "int", "display": False},
+    ],
+}
+
+
+class Channel:
+    """One MFC or sensor channel of the telemetry frame."""
+
+    def __init__(self, kind, column, name, index, units="", full_scale=None, limits=None,
+                 graph=None, type="float", display=True, **extra):
+        self.kind = kind  # "mfc" or "sensor"
+        self.column = column  # column in the history rows, 0 is time
+        self.name = name
+        self.index = index  # field index in the telemetry line from the Arduino
+        self.units = units
+        self.full_scale = full_scale
+        self.limits = limits  # [min, warning min, warning max, max] or None
+        self.graph = graph  # overview graph this channel is drawn on
+        self.cast = int if type == "int" else float
+        self.display = display  # show on the Live Values display
+        self.extra = extra  # any other per-channel settings from the config
+
+    @property
+    def label(self):
+        return f"{self.name} ({self.units})" if self.units else self.name
+
+
+class ChannelMap:
+    """
+    Registry of the MFC and sensor channels of one rig, loaded from channel_map.json.
+
+    Parsing, history layout, graphs, the Live Values display, Excel export and
+    the safety checks are all generated from this map, so adding MFCs or sensors
+    is a config change. History rows keep the usual [time, ch1, ch2, ...] layout,
+    with channel.column giving the position of each channel. The field index
+    lists are turned into itemgetters once so parsing a packet does no list
+    building.
+    """
+
+    def __init__(self, config):
+        frame = config["frame"]
+        self.seq_index = frame["seq"]
+        self.state_index = frame["state"]
+        self.valve_index = frame["valve"]
+        self.frame_length = frame["length"]
+        self.response_warn_ratio = config.get("response_limits", {}).get("warn_ratio", 1.1)
+        self.response_max_ratio = config.get("response_limits", {}).get("max_ratio", 1.5)
+        self.rate_window = config.get("stats", {}).get("rate_window", 1.0) # seconds the safety rate rules fit over
+        self.display_window = config.get("stats", {}).get("display_window", 1.0) # seconds the Live Values average over
+        trip = config.get("pressure_trip", {}) # predictive over-pressure trip, see Data_Handler.predict_pressures
+        self.trip_channels = trip.get("channels", []) # sensors whose max limit it guards
+        self.trip_window = trip.get("window", 1.0) # time constant of the trend fit [s]
+        self.trip_margin = trip.get("margin", 0.2) # seconds added to the measured actuation latency, for the valve and MFCs to act
+        self.trip_throttle = trip.get("throttle", 0.5) # flow fraction sent while a warning crossing is predicted
+        self.trip_hold = trip.get("hold", 2.0) # seconds a throttle holds after the last such prediction
+        mixture = config.get("mixture", {}) # mixing chamber composition estimate, see mixture_model.py
+        self.mixture_volume = mixture.get("volume", 20.0) # chamber volume [L]
+        self.mixture_temperature = mixture.get("temperature_channel") # sensor reading the gas temperature [C], 20 C if None
+        self.mixture_limits = mixture.get("limits") # [min, warning min, warning max, max] of the flammability margin, None for no rule
+        self.graph_labels = config.get("graphs", {})
+
+        self.mfcs = [Channel("mfc", i + 1, **c) for i, c in enumerate(config["mfcs"])]
+        self.sensors = [Channel("sensor", i + 1, **c) for i, c in enumerate(config["sensors"])]
+        self.n_mfcs = len(self.mfcs)
+        self.n_sensors = len(self.sensors)
+
+        # Precomputed field getters for parsing
+        self._response_getter = itemgetter(*[c.index for c in self.mfcs])
+        self._sensor_getter = itemgetter(*[c.index for c in self.sensors])
+        self._sensor_casts = tuple(c.cast for c in self.sensors)
+        if self.n_mfcs == 1:
+            self._response_getter = lambda parts, g=self._response_getter: (g(parts),)
+        if self.n_sensors == 1:
+            self._sensor_getter = lambda parts, g=self._sensor_getter: (g(parts),)
+
+    @classmethod
+    def load(cls, path=CHANNEL_MAP_PATH):
+        """Load the channel map from file, falling back to the built-in 5 MFC layout if it is missing."""
+        if not os.path.exists(path):
+            return cls(DEFAULT_CHANNEL_MAP)
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    # ---------- Lookups ---------- #
+    def sensor(self, name):
+        """Return the sensor channel with the given name."""
+        for c in self.sensors:
+            if c.name == name:
+                return c
+        raise KeyError(f"Sensor '{name}' not in channel map.")
+
+    def sensor_graphs(self):
+        """Graph names in display order with the sensor channels drawn on each."""
+        graphs = {}
+        for c in self.sensors:
+            if c.graph:
+                graphs.setdefault(c.graph, []).append(c)
+        return graphs
+
+    # ---------- Frames ---------- #
+    def parse(self, parts, t):
+        """
+        Split one telemetry line (already split on commas) into history rows.
+
+        Returns:
+            (response_row, valve_row, sensor_row), each starting with time t.
+        """
+        response = [t, *map(float, self._response_getter(parts))]
+        valve = [t, int(parts[self.valve_index])]
+        sensor = [t, *[cast(v) for cast, v in zip(self._sensor_casts, self._sensor_getter(parts))]]
+        return response, valve, sensor
+
+    def setpoint_frame(self, state, valve, flows=()):
+        """Build a [state, valve, MFC1..MFCn] command frame, padding missing flows with 0."""
+        flows = list(flows)[:self.n_mfcs]
+        return [state, valve, *flows, *[0] * (self.n_mfcs - len(flows))]
+
+    def zero_row(self, kind):
+        """An all-zero history row for the given history ("setpoint", "response", "sensor")."""
+        width = self.n_sensors if kind == "sensor" else self.n_mfcs
+        return [0] * (width + 1)
@@ -0,0 +1,283 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import serial
+import serial.tools.list_ports
+
+
+class ConnectionManager:
+    """
+    Finds, opens and supervises the serial link to the Arduino.
+
+    Candidate ports are probed in parallel and the sketch is identified by its
+    "ID" handshake reply instead of by USB description keywords. The last good
+    port and its VID/PID are cached in state_save.csv so the next start only has
+    to confirm one port. A watchdog thread notices when telemetry stops coming
+    back (missing seq heartbeats) and reconnects with backoff while the control
+    system is held in emergency stop.
+    """
+
+    HANDSHAKE_QUERY = "ID\n"
+    HANDSHAKE_PREFIX = "ID,SBGC"
+
+    def __init__(self, dh):
+        self.dh = dh  # Data_Handler that owns the serial object
+
+        # Probe settings
+        self.probe_timeout = 0.25  # seconds to wait for one handshake reply
+        self.reset_window = 2.5  # seconds to keep retrying if opening the port reset the board
+        self.max_probe_workers = 8
+
+        # Link supervision settings
+        self.link_timeout = 1.5  # seconds a write can go unanswered before the link is lost
+        self.backoff_start = 0.5  # seconds before the first reconnect attempt
+        self.backoff_max = 8.0  # longest wait between reconnect attempts
+        self.watchdog_period = 0.1
+
+        self.firmware_id = None  # handshake reply of the connected sketch, e.g. "ID,SBGC,1.1"
+        self.excluded_ports = lambda: ()  # ports held by other rigs, never probed (set by rig_manager.py)
+        self.reconnecting = False
+        self.watchdog_running = False
+        self.watchdog_thread = None
+        self.lock = threading.Lock()
+
+    def firmware_version(self):
+        """Sketch version from the handshake as a tuple, e.g. (1, 2), or (0,) if unknown."""
+        try:
+            return tuple(int(v) for v in self.firmware_id.split(",")[2].split("."))
+        except (AttributeError, IndexError, ValueError):
+            return (0,)
+
+    # ---------- Port discovery ---------- #
+    def load_cached_port(self):
+        """Return (port, vid, pid) from the last good connection, or Nones if not cached."""
+        try:
+            port = self.dh.state_saver("load", "last_port", None, cast=str)
+            vid = int(self.dh.state_saver("load", "last_vid", None))
+            pid = int(self.dh.state_saver("load", "last_pid", None))
+            return port, vid, pid
+        except (KeyError, ValueError, FileNotFoundError):
+            return None, None, None
+
+    def store_cached_port(self, port_info):
+        """Remember the port, VID and PID of a confirmed Arduino for the next startup."""
+        try:
+            self.dh.state_saver("store", "last_port", port_info.device)
+            if port_info.vid is not None and port_info.pid is not None:
+                self.dh.state_saver("store", "last_vid", port_info.vid)
+                self.dh.state_saver("store", "last_pid", port_info.pid)
+        except Exception as e:
+            self.dh.UI.write_to_terminal(f"[ConnectionManager] Could not cache port: {e}")
+
+    def candidate_ports(self):
+        """
+        List serial ports to probe, most likely first.
+
+        The cached port comes first, then any port with the cached VID/PID
+        (the COM number can change between USB sockets), then everything else.
+        """
+        excluded = set(self.excluded_ports())
+        ports = [p for p in serial.tools.list_ports.comports() if p.device not in excluded]
+        cached_port, cached_vid, cached_pid = self.load_cached_port()
+
+        def rank(p):
+            if p.device == cached_port:
+                return 0
+            if cached_vid is not None and p.vid == cached_vid and p.pid == cached_pid:
+                return 1
+            return 2
+
+        return sorted(ports, key=rank), cached_port
+
+    def open_port(self, device, timeout):
+        """Open a port without toggling DTR so boards that reset on DTR are not rebooted."""
+        ser = serial.Serial()
+        ser.port = device
+        ser.baudrate = self.dh.baudrate
+        ser.timeout = timeout
+        ser.write_timeout = timeout
+        ser.dtr = False
+        ser.open()
+        return ser
+
+    def handshake(self, ser):
+        """
+        Ask the sketch to identify itself.
+
+        Returns the ID reply, or None if the device never answered with the
+        expected prefix. If opening the port reset the board the bootloader
+        swallows the first queries, so keep asking for up to reset_window.
+        """
+        deadline = time.monotonic() + self.reset_window
+        while time.monotonic() < deadline:
+            ser.reset_input_buffer()
+            ser.write(self.HANDSHAKE_QUERY.encode("utf-8"))
+            reply_deadline = time.monotonic() + self.probe_timeout
+            while time.monotonic() < reply_deadline:
+                line = ser.readline().decode("utf-8", errors="ignore").strip()
+                if line.startswith(self.HANDSHAKE_PREFIX):
+                    return line
+                if not line:
+                    break
+        return None
+
+    def probe(self, port_info):
+        """Open one port and confirm it is running our sketch. Returns (port_info, id) or None."""
+        try:
+            ser = self.open_port(port_info.device, self.probe_timeout)
+        except (OSError, serial.SerialException):
+            return None
+        try:
+            reply = self.handshake(ser)
+        except (OSError, serial.SerialException):
+            reply = None
+        finally:
+            ser.close()
+        if reply is None:
+            return None
+        return port_info, reply
+
+    def discover(self):
+        """
+        Find the Arduino running this sketch.
+
+        Tries the cached port on its own first (the fast path on a normal
+        startup), then probes every remaining port in parallel.
+
+        Returns:
+            (port_info, id_reply) or (None, None) if nothing answered.
+        """
+        ports, cached_port = self.candidate_ports()
+        if not ports:
+            self.dh.UI.write_to_terminal("No serial ports found.")
+            return None, None
+
+        if ports[0].device == cached_port:
+            result = self.probe(ports[0])
+            if result is not None:
+                return result
+            ports = ports[1:]
+
+        if not ports:
+            return None, None
+
+        # Don't wait for the slower probes once one port has answered, they close their own ports
+        pool = ThreadPoolExecutor(max_workers=min(self.max_probe_workers, len(ports)))
+        try:
+            futures = [pool.submit(self.probe, p) for p in ports]
+            for future in as_completed(futures):
+                result = future.result()
+                if result is not None:
+                    return result
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return None, None
+
+    # ---------- Connect / disconnect ---------- #
+    def connect(self, quiet=False):
+        """Discover the Arduino and open the working serial connection. Returns True on success."""
+        with self.lock:
+            start = time.monotonic()
+            port_info, reply = self.discover()
+            if port_info is None:
+                if not quiet:
+                    self.dh.UI.write_to_terminal("No Arduino detected on available ports.")
+                return False
+            try:
+                ser = self.open_port(port_info.device, self.dh.timeout)
+            except (OSError, serial.SerialException) as e:
+                if not quiet:
+                    self.dh.UI.write_to_terminal(f"Error connecting to Arduino: {e}")
+                self.dh.serial = None
+                return False
+
+            self._use_link(ser, port_info.device, reply)
+            self.store_cached_port(port_info)
+            self.dh.UI.write_to_terminal(
+                f"Connected to Arduino on {port_info.device} ({reply}) in {time.monotonic() - start:.2f} s")
+        self.start_watchdog()
+        return True
+
+    def attach(self, transport, device, reply):
+        """Use an already open transport with the serial interface (e.g. a simulated Arduino) as the link."""
+        with self.lock:
+            self._use_link(transport, device, reply)
+            self.dh.UI.write_to_terminal(f"Connected to {device} ({reply})")
+        self.start_watchdog()
+
+    def _use_link(self, ser, device, reply):
+        self.dh.serial = ser
+        self.dh.port = device
+        self.firmware_id = reply
+        self.dh.last_packet_time = time.monotonic()
+        self.dh.last_write_time = self.dh.last_packet_time
+        self.dh.last_valid_time = self.dh.last_packet_time
+        self.dh.link_health.reset()
+        self.dh.pending_replies = 0
+        self.dh.streaming = 0 # a new link starts on one reply per command, the control thread restarts the stream
+        self.dh.last_frame = None # the board may have rebooted, send the setpoints in full
+        self.dh.watchdog_set = None
+        self.dh.reset_board_clock()
+        self.dh.Arduino_connected = True
+
+    def drop_link(self, reason):
+        """Mark the link as lost, close the port and hold the plant in emergency stop."""
+        if not self.dh.Arduino_connected:
+            return
+        self.dh.Arduino_connected = False
+        self.dh.log_event("Link Lost", reason)
+        try:
+            if self.dh.serial is not None:
+                self.dh.serial.close()
+        except (OSError, serial.SerialException):
+            pass
+        self.dh.serial = None
+        self.dh.UI.write_to_terminal(f"[ConnectionManager] Arduino link lost: {reason}")
+        self.dh.UI.update_indicators(name=self.dh.UI.indicators[2])
+        if self.dh.cs is not None and self.dh.cs.STATE != 0:
+            self.dh.cs.set_state(0)  # Hold the plant in emergency stop until the link is back
+
+    # ---------- Link supervision ---------- #
+    def start_watchdog(self):
+        if not self.watchdog_running:
+            self.watchdog_running = True
+            self.watchdog_thread = threading.Thread(target=self._watchdog_loop, daemon=True)
+            self.watchdog_thread.start()
+
+    def stop_watchdog(self):
+        self.watchdog_running = False
+        if self.watchdog_thread:
+            self.watchdog_thread.join(timeout=1)
+
+    def link_stale(self):
+        """
+        True if a command has gone unanswered (no seq heartbeat), or a telemetry
+        stream went quiet, for longer than link_timeout. Malformed lines and
+        repeated (stale seq) frames do not count as answers.
+        """
+        waiting = self.dh.last_write_time - self.dh.last_valid_time
+        return (waiting > 0 or self.dh.streaming) and time.monotonic() - self.dh.last_valid_time > self.link_timeout
+
+    def _watchdog_loop(self):
+        while self.watchdog_running:
+            if self.dh.Arduino_connected and self.link_stale():
+                self.drop_link(f"no telemetry for {self.link_timeout:.1f} s")
+            if not self.dh.Arduino_connected and self.dh.auto_reconnect:
+                self.reconnect()
+            time.sleep(self.watchdog_period)
+
+    def reconnect(self):
+        """Retry the connection with exponential backoff until it succeeds or the watchdog stops."""
+        self.reconnecting = True
+        delay = self.backoff_start
+        attempt = 1
+        while self.watchdog_running and not self.dh.Arduino_connected:
+            self.dh.UI.write_to_terminal(f"[ConnectionManager] Reconnect attempt {attempt}...")
+            if self.connect(quiet=True):
+                self.dh.UI.update_indicators(name=self.dh.UI.indicators[2])
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, self.backoff_max)
+            attempt += 1
+        self.reconnecting = False
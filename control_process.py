@@ -0,0 +1,589 @@
+"""
+Control loop in its own process, away from the GUI.
+
+In this mode a rig's ControlSystem, Data_Handler (serial link) and safety
+checks run in a child process with its own interpreter, so Tk and matplotlib
+work in the window can never hold the GIL while a setpoint is due. The two
+processes talk over:
+
+    shared memory   the child's telemetry bus (telemetry_bus.py); the window
+                    rebuilds its histories from it for the graphs, values,
+                    export and telemetry server
+    command pipe    window -> child: state changes, setpoints, test plan,
+                    connect, heartbeats. child -> window: terminal messages
+                    and a status snapshot (state, link, tick timing)
+
+The window sends a heartbeat every HEARTBEAT_PERIOD ms from the Tk thread. If
+none arrives for heartbeat_timeout seconds (the window froze) the child puts
+the rig in emergency stop and keeps it there; if the pipe closes (the window
+died) it also sends zero flow before exiting.
+
+Enable it per rig with "control_process": true in rigs.json (see
+rig_manager.py). Headless check of the tick timing while the parent process
+hammers the GIL, and of the frozen window heartbeat:
+
+    python control_process.py --seconds 5
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from channel_map import ChannelMap, CHANNEL_MAP_PATH
+from Controls import ControlSystem
+from data_handler import Data_Handler, STATE_FILE
+from rolling_stats import RollingStats
+from run_clock import RunClock, NS
+from telemetry_bus import BUS_NAME, TelemetryReader
+
+HEARTBEAT_PERIOD = 200 # ms between heartbeats from the window
+HEARTBEAT_TIMEOUT = 2.0 # s without a heartbeat before the child stops the rig
+STATUS_PERIOD = 0.2 # s between status snapshots from the child
+START_TIMEOUT = 20.0 # s to wait for the child to build its rig
+
+
+# ---------- Child process ---------- #
+class _ChildUI:
+    """The window as the child's ControlSystem and Data_Handler see it: messages go back over the pipe."""
+
+    indicators = ["State", "Valve", "Arduino"]
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.test_plan = []
+        self.status_due = False # send a status snapshot at the next chance
+        self.lock = threading.Lock() # the control, watchdog and main threads all send
+
+    def send(self, *msg):
+        with self.lock:
+            try:
+                self.conn.send(msg)
+            except (OSError, EOFError, BrokenPipeError):
+                pass # the window is gone, the heartbeat check stops the rig
+
+    def write_to_terminal(self, text, timestamp=True):
+        self.send("log", text, timestamp)
+
+    def update_indicators(self, name):
+        self.status_due = True
+
+    def update_graphs(self):
+        pass # the window redraws from the telemetry bus on its own
+
+    def update_values_display(self):
+        pass
+
+
+def _status(dh, cs):
+    lh = dh.link_health
+    return {"state": cs.STATE, "connected": dh.Arduino_connected, "port": dh.port, "run_start": dh.run_start,
+            "running": dh.running, "firmware_id": dh.connection.firmware_id,
+            "sample_rate": lh.sample_rate(), "loss_fraction": lh.loss_fraction(), "mean_latency": lh.mean_latency(),
+            "gaps": lh.gaps, "duplicates": lh.duplicates, "errors": lh.errors,
+            "tick_lateness": list(cs.tick_lateness)[-50:]}
+
+
+def run_child(conn, config, initial_state=1, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+    """Entry point of the control process: build the rig, then serve commands until shut down or orphaned."""
+    ui = _ChildUI(conn)
+    try:
+        dh = Data_Handler(config.get("channel_map", CHANNEL_MAP_PATH), config.get("state_file", STATE_FILE),
+                          config.get("telemetry_bus", BUS_NAME))
+    except Exception as e:
+        ui.send("ready", None, str(e))
+        return
+    dh.rig_name = config.get("name", dh.rig_name)
+    cs = ControlSystem()
+    dh.UI = cs.UI = ui
+    dh.cs, cs.dh = cs, dh
+    ui.send("ready", dh.telemetry_bus.name if dh.telemetry_bus else None, dh.telemetry_bus_error)
+    if dh.telemetry_bus is None:
+        return
+    cs.STATE = initial_state
+    cs.start()
+
+    last_beat = time.monotonic()
+    beat_lost = False
+    next_status = 0.0
+    try:
+        while True:
+            try:
+                msg = conn.recv() if conn.poll(0.02) else None
+            except (EOFError, OSError):
+                ui.write_to_terminal("[ControlProcess] Window closed, stopping the rig.")
+                cs.set_state(0)
+                time.sleep(4 * cs.resolution) # a few zero flow frames before exiting
+                break
+            now = time.monotonic()
+            if msg is not None:
+                last_beat = now
+                if beat_lost:
+                    beat_lost = False
+                    ui.write_to_terminal("[ControlProcess] Window heartbeat is back. The rig stays in EMERGENCY STOP.")
+                if msg[0] == "shutdown":
+                    break
+                _handle(msg, dh, cs, ui)
+            elif not beat_lost and now - last_beat > heartbeat_timeout:
+                beat_lost = True
+                ui.write_to_terminal(f"[ControlProcess] No heartbeat from the window for {heartbeat_timeout:.1f} s, EMERGENCY STOP.")
+                cs.set_state(0)
+            if ui.status_due or now >= next_status:
+                ui.status_due = False
+                next_status = now + STATUS_PERIOD
+                ui.send("status", _status(dh, cs))
+    finally:
+        cs.running = False
+        dh.connection.stop_watchdog()
+        if cs.thread is not None:
+            cs.thread.join(timeout=1)
+        dh.telemetry_bus.close()
+
+
+def _handle(msg, dh, cs, ui):
+    kind, args = msg[0], msg[1:]
+    if kind == "heartbeat":
+        pass
+    elif kind == "state":
+        cs.set_state(*args)
+    elif kind == "custom_setpoints":
+        cs.custom_setpoints = list(args[0])
+    elif kind == "test_plan":
+        ui.test_plan = args[0]
+    elif kind == "connect":
+        ports = set(args[0])
+        dh.connection.excluded_ports = lambda: ports
+        threading.Thread(target=dh.connect_to_arduino, daemon=True).start() # discovery can take seconds
+    elif kind == "simulate":
+        from simulated_arduino import SimulatedArduino, FIRMWARE_ID
+        dh.auto_reconnect = False
+        dh.connection.attach(SimulatedArduino(dh.channels, **args[0]), "SIM", FIRMWARE_ID)
+    elif kind == "hrr_reset":
+        dh.hrr.reset()
+    elif kind == "hrr_recipe":
+        dh.hrr.set_recipe(*args)
+    elif kind == "mixture_recipe":
+        dh.mixture.set_recipe(*args)
+    elif kind == "run_recipe":
+        dh.set_run_recipe(*args)
+    elif kind == "link_health_reset":
+        dh.link_health.reset()
+    else:
+        ui.write_to_terminal(f"[ControlProcess] Unknown command '{kind}'")
+    ui.status_due = True
+
+
+# ---------- Window side ---------- #
+class _RemoteHRR:
+    def __init__(self, process):
+        self.process = process
+
+    def reset(self):
+        self.process.send("hrr_reset")
+
+    def set_recipe(self, heat_comb, density, n_mfcs):
+        self.process.send("hrr_recipe", list(heat_comb), list(density), n_mfcs)
+
+
+class _RemoteMixture:
+    def __init__(self, process):
+        self.process = process
+
+    def set_recipe(self, gas_names, n_mfcs):
+        self.process.send("mixture_recipe", list(gas_names), n_mfcs)
+
+
+class _RemoteLinkHealth:
+    """Link statistics from the child's last status snapshot."""
+
+    def __init__(self, process):
+        self.process = process
+
+    def reset(self):
+        self.process.send("link_health_reset")
+
+    def sample_rate(self):
+        return self.process.status.get("sample_rate", 0.0)
+
+    def loss_fraction(self):
+        return self.process.status.get("loss_fraction", 0.0)
+
+    def mean_latency(self):
+        return self.process.status.get("mean_latency", 0.0)
+
+    @property
+    def gaps(self):
+        return self.process.status.get("gaps", 0)
+
+    @property
+    def duplicates(self):
+        return self.process.status.get("duplicates", 0)
+
+    @property
+    def errors(self):
+        return self.process.status.get("errors", 0)
+
+
+class _RemoteConnection:
+    def __init__(self, process):
+        self.process = process
+        self.excluded_ports = lambda: ()
+
+    @property
+    def firmware_id(self):
+        return self.process.status.get("firmware_id")
+
+    def stop_watchdog(self):
+        pass # the child stops its own watchdog on shutdown
+
+
+class RemoteDataHandler:
+    """
+    Stands in for Data_Handler in the window. Histories are rebuilt from the
+    child's telemetry bus by a reader thread; link state comes from the status
+    snapshots.
+    """
+
+    state_saver = Data_Handler.state_saver
+    archive_dir = Data_Handler.archive_dir # the child writes the runs, the window browses them
+
+    def __init__(self, process, config):
+        self.process = process
+        self.state_file = config.get("state_file", STATE_FILE)
+        self.channels = ChannelMap.load(config.get("channel_map", CHANNEL_MAP_PATH))
+        self.num_mfcs = int(self.state_saver("load", "num_mfcs", None))
+        self.setpoint_history = []
+        self.response_history = []
+        self.sensor_history = []
+        self.raw_sensor_history = [] # the bus carries filtered readings, the raw ones stay in the child
+        self.valve_history = []
+        self.hrr_history = []
+        self.mixture_history = []
+        self.clock = RunClock() # the child's bus carries time.time(), put back on a run clock of this process
+        self.stats = RollingStats.for_channels(self.channels)
+        self.hrr = _RemoteHRR(process)
+        self.mixture = _RemoteMixture(process)
+        self.link_health = _RemoteLinkHealth(process)
+        self.connection = _RemoteConnection(process)
+        self.telemetry_bus = None # owned by the child
+        self.telemetry_bus_error = None
+        self.telemetry_listeners = []
+        self.auto_reconnect = True
+        self.UI = None
+        self.cs = None
+
+    @property
+    def Arduino_connected(self):
+        return self.process.status.get("connected", False)
+
+    @property
+    def port(self):
+        return self.process.status.get("port")
+
+    @property
+    def run_start(self):
+        return self.process.status.get("run_start", 0)
+
+    @property
+    def run_start_ns(self):
+        return self.clock.from_wall(self.run_start)
+
+    @property
+    def running(self):
+        return self.process.status.get("running", False)
+
+    def connect_to_arduino(self):
+        self.process.send("connect", sorted(self.connection.excluded_ports()))
+
+    def set_run_recipe(self, name, plan, gas_names, heat_comb, density):
+        self.process.send("run_recipe", name, [list(row) for row in plan], list(gas_names), list(heat_comb), list(density))
+
+    def add_records(self, records):
+        """Append bus records (rows of telemetry_bus.telemetry_fields) to the histories."""
+        n_mfcs, n_sensors = self.channels.n_mfcs, self.channels.n_sensors
+        s0 = 4 + n_mfcs
+        p0 = s0 + n_sensors
+        for row in records.tolist():
+            t = self.clock.from_wall(row[0])
+            self.response_history.append([t, *row[4:s0]])
+            self.sensor_history.append([t, *row[s0:p0]])
+            self.setpoint_history.append([t, *row[p0:p0 + n_mfcs]])
+            self.valve_history.append([t, int(row[3])])
+            self.hrr_history.append([t, *row[p0 + n_mfcs:p0 + n_mfcs + 2]])
+            self.mixture_history.append([t, *row[p0 + n_mfcs + 2:]])
+            self.stats.append(t / NS, row[4:p0])
+            for listener in self.telemetry_listeners:
+                listener(row)
+
+
+class RemoteControlSystem:
+    """Stands in for ControlSystem in the window: state changes and setpoints go down the pipe."""
+
+    def __init__(self, process):
+        self.process = process
+        self.UI = None
+        self.dh = None
+        self.STATE = 1
+        self.oldstate = 1
+        self.running = False
+        self._custom_setpoints = []
+
+    @property
+    def thread(self):
+        return self.process.child # is_alive() like a thread, for RigManager.supervise
+
+    @property
+    def tick_lateness(self):
+        return self.process.status.get("tick_lateness", [])
+
+    @property
+    def custom_setpoints(self):
+        return self._custom_setpoints
+
+    @custom_setpoints.setter
+    def custom_setpoints(self, frame):
+        self._custom_setpoints = list(frame)
+        self.process.send("custom_setpoints", self._custom_setpoints)
+
+    def set_state(self, new_state, pressed=None):
+        if new_state == 2:
+            self.process.send("test_plan", [list(map(float, row)) for row in self.UI.test_plan])
+        self.STATE = new_state # shown straight away, the child's status confirms it
+        self.process.send("state", new_state, pressed) # time.monotonic() is system wide, the child can use it
+
+    def emergency_stop(self):
+        self.set_state(0)
+
+    def start(self):
+        if not self.running:
+            self.process.start(initial_state=self.STATE)
+            self.running = True
+
+    def stop(self):
+        self.running = False
+        self.process.stop()
+
+
+class ControlProcess:
+    """Owns the child process, its pipe and the telemetry reader thread, and hands out the dh and cs stand-ins."""
+
+    def __init__(self, config, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        self.config = config
+        self.heartbeat_timeout = heartbeat_timeout
+        self.status = {}
+        self.child = None
+        self.conn = None
+        self.reader = None
+        self.send_lock = threading.Lock()
+        self.alive = False
+        self.heartbeats = True # turned off to test the child's frozen window handling
+        self.dh = RemoteDataHandler(self, config)
+        self.cs = RemoteControlSystem(self)
+        self.dh.cs, self.cs.dh = self.cs, self.dh
+
+    def log(self, text, timestamp=True):
+        if self.cs.UI is not None:
+            self.cs.UI.write_to_terminal(text, timestamp)
+
+    def send(self, *msg):
+        with self.send_lock:
+            if self.conn is None:
+                return
+            try:
+                self.conn.send(msg)
+            except (OSError, BrokenPipeError):
+                pass
+
+    def start(self, initial_state=1):
+        """Spawn the child and wait until its rig and telemetry bus are up."""
+        ctx = multiprocessing.get_context("spawn") # never fork a process running Tk
+        self.conn, child_conn = ctx.Pipe()
+        self.child = ctx.Process(target=run_child, args=(child_conn, self.config, initial_state, self.heartbeat_timeout),
+                                 name=f"control-{self.config.get('name', 'rig')}", daemon=True)
+        self.child.start()
+        child_conn.close()
+        if not self.conn.poll(START_TIMEOUT):
+            raise RuntimeError("Control process did not start.")
+        _, bus_name, error = self.conn.recv()
+        if bus_name is None:
+            raise RuntimeError(f"Control process could not build the rig: {error}")
+        self.reader = TelemetryReader(bus_name, untrack=False) # the child's bus, registered with our shared resource tracker
+        self.alive = True
+        threading.Thread(target=self._receive, daemon=True).start()
+        threading.Thread(target=self._pump, daemon=True).start()
+        self._beat()
+
+    def stop(self):
+        self.send("shutdown")
+        self.alive = False
+        if self.child is not None:
+            self.child.join(timeout=3)
+            if self.child.is_alive():
+                self.child.terminate()
+
+    def _beat(self):
+        if not self.alive:
+            return
+        if self.heartbeats:
+            self.send("heartbeat")
+        self.cs.UI.after(HEARTBEAT_PERIOD, self._beat)
+
+    def _receive(self):
+        """Messages from the child: terminal lines and status snapshots."""
+        while self.alive:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                if self.alive:
+                    self.alive = False
+                    self.log("[ERROR] Control process exited.")
+                    self.status = dict(self.status, connected=False, state=0)
+                    self.cs.STATE = 0
+                return
+            if msg[0] == "log":
+                self.log(msg[1], msg[2])
+            elif msg[0] == "status":
+                changed = msg[1]["state"] != self.status.get("state") or msg[1]["connected"] != self.status.get("connected")
+                self.status = msg[1]
+                self.cs.STATE = msg[1]["state"]
+                if changed and self.cs.UI is not None:
+                    for name in self.cs.UI.indicators:
+                        if name != "Valve" or self.dh.valve_history:
+                            self.cs.UI.update_indicators(name)
+
+    def _pump(self):
+        """Copy new telemetry from the bus into the histories."""
+        reader = self.reader
+        while self.alive:
+            if reader.wait(timeout=0.2, poll=0.005):
+                self.dh.add_records(reader.read())
+        reader.close()
+
+
+# ---------- Headless check ---------- #
+class _DemoUI:
+    indicators = ["State", "Valve", "Arduino"]
+    test_plan = []
+
+    def __init__(self):
+        self.lines = []
+
+    def write_to_terminal(self, text, timestamp=True):
+        self.lines.append(text)
+
+    def after(self, ms, fn):
+        timer = threading.Timer(ms / 1000, fn)
+        timer.daemon = True
+        timer.start()
+
+    def update_indicators(self, name):
+        pass
+
+    def update_graphs(self):
+        pass
+
+    def update_values_display(self):
+        pass
+
+
+def _hog(stop):
+    """Pure Python busy work that holds the GIL in bursts, like a big redraw or export."""
+    while not stop.is_set():
+        sum(i * i for i in range(200000))
+
+
+def _p99(values):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(0.99 * len(values)))] if values else float("nan")
+
+
+def demo(seconds=5.0, hogs=3):
+    """Tick lateness in-process vs in a child process while GIL hogs run here, then the frozen window check."""
+    tmp = tempfile.mkdtemp()
+    state_file = os.path.join(tmp, "state.csv")
+    with open(state_file, "w") as f:
+        f.write("line_pressure,15.0\nmixing_chamber_pressure,14.7\nMethane_Sensor,0.3\ngas_sensor_2,0.2\nnum_mfcs,2\n")
+    config = {"name": "demo", "state_file": state_file, "channel_map": CHANNEL_MAP_PATH,
+              "telemetry_bus": f"sbgc_demo_{os.getpid()}"}
+    frame = ChannelMap.load(CHANNEL_MAP_PATH).setpoint_frame(3, 1, [10.0, 5.0])
+    results = {}
+    ok = True
+    try:
+        # Same loop in this process
+        from simulated_arduino import SimulatedArduino, FIRMWARE_ID
+        ui = _DemoUI()
+        dh = Data_Handler(config["channel_map"], state_file, config["telemetry_bus"] + "_thread")
+        cs = ControlSystem()
+        dh.UI = cs.UI = ui
+        dh.cs, cs.dh = cs, dh
+        dh.auto_reconnect = False
+        dh.connection.attach(SimulatedArduino(dh.channels), "SIM", FIRMWARE_ID)
+        cs.start()
+        cs.custom_setpoints = frame
+        cs.set_state(3)
+        results["thread"] = _measure(lambda: list(cs.tick_lateness), seconds, hogs)
+        cs.running = False
+        dh.connection.stop_watchdog()
+        cs.thread.join(timeout=1)
+        dh.telemetry_bus.close()
+
+        # Child process
+        process = ControlProcess(config)
+        process.cs.UI = process.dh.UI = _DemoUI()
+        process.cs.start()
+        process.send("simulate", {})
+        process.cs.custom_setpoints = frame
+        process.cs.set_state(3)
+        results["process"] = _measure(lambda: list(process.cs.tick_lateness), seconds, hogs)
+        samples = len(process.dh.response_history)
+
+        # Stop the heartbeats as if the window froze
+        process.heartbeats = False
+        deadline = time.monotonic() + HEARTBEAT_TIMEOUT + 2
+        while process.cs.STATE != 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        stopped = process.cs.STATE == 0
+        process.stop()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"tick lateness with {hogs} GIL-heavy threads in the window process, {seconds:.0f} s each:")
+    for mode, late in results.items():
+        print(f"  {mode:>8}: {len(late):4d} ticks  median {1000 * statistics.median(late):6.2f} ms  "
+              f"p99 {1000 * _p99(late):7.2f} ms  max {1000 * max(late):7.2f} ms")
+    print(f"  window rebuilt {samples} samples from the child's telemetry bus")
+    print(f"frozen window -> EMERGENCY STOP: {'yes' if stopped else 'NO'}")
+    ok = stopped and samples > 0 and _p99(results["process"]) < 0.02
+    print("[PASS]" if ok else "[FAIL]")
+    return 0 if ok else 1
+
+
+def _measure(lateness, seconds, hogs):
+    """Lateness of the ticks during seconds of GIL hogging."""
+    time.sleep(1.0) # settle into the state loop
+    stop = threading.Event()
+    threads = [threading.Thread(target=_hog, args=(stop,), daemon=True) for _ in range(hogs)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    late = lateness()[-int(seconds / ControlSystem().resolution):]
+    stop.set()
+    for t in threads:
+        t.join()
+    return late
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare control loop tick timing in-process and in a child process.")
+    parser.add_argument("--seconds", type=float, default=5.0, help="measurement time per mode (default: 5)")
+    parser.add_argument("--hogs", type=int, default=3, help="GIL-heavy threads to run in this process (default: 3)")
+    args = parser.parse_args(argv)
+    return demo(args.seconds, args.hogs)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
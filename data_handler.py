@@ -2,26 +2,80 @@ import serial
 import serial.tools.list_ports
 import time
 import time
+import numpy as np
 import os
 import csv
+import bisect
+import collections
+import itertools
+import sqlite3
+import threading
+from connection_manager import ConnectionManager
+from link_health import LinkHealth
+from hrr_estimator import AchievedHRR
+from channel_map import ChannelMap, CHANNEL_MAP_PATH
+from telemetry_bus import TelemetryBus, BUS_NAME
+from telemetry_stream import StreamParser
+from run_clock import RunClock, ClockSync, NS
+from rolling_stats import RollingStats
+from signal_conditioning import SignalConditioner
+from pressure_trend import QuadraticTrend, time_to_limit
+from mixture_model import ChamberMixture
+import run_archive
 #from MFC_Sim_Object import MFC_Simulator
 
+STATE_FILE = "state_save.csv"
+WATCHDOG_ERROR = "Command watchdog expired" # ERR message of the sketch's command watchdog (1.6+)
+
 class Data_Handler:
     """
     Handles serial communication with an Arduino and data saving
     """
 
-    def __init__(self):
+    def __init__(self, channel_map_path=CHANNEL_MAP_PATH, state_file=STATE_FILE, bus_name=BUS_NAME):
         """
         Initialize serial connection and start communication thread.
+
+        The defaults are the single rig layout; rig_manager.py gives every rig
+        its own channel map, state save file and telemetry bus name.
         """
+        self.state_file = state_file # calibration values, cached port and settings of this rig
+
+        # MFC and sensor layout of the rig, sets the columns of the histories below
+        self.channels = ChannelMap.load(channel_map_path)
+        self.mixing_chamber_col = self.channels.sensor("Mixing Chamber Pressure").column
+        self.line_pressure_col = self.channels.sensor("Line Pressure").column
 
         # data saving parameters 
         # mfc_history = [ [time1,mfc1_response,mfc2_response,..] , [time2,mfc1_response,mfc2_response,...] , ...]
+        # times are int nanoseconds on the run clock (see run_clock.py), a test starts at run_start_ns
+        self.clock = RunClock()
         self.setpoint_history = []
         self.response_history = [] 
-        self.sensor_history = [] # [[time, Mixing Chamber Pressure, Line Pressure, Gas Sensor 1, Gas Sensor 2, Temp Sensor],...]
+        self.sensor_history = [] # [[time, sensor1, sensor2, ...],...] in channel map order, after the channel map's filters
+        self.raw_sensor_history = [] # the same rows as they came from the Arduino, kept while any sensor is filtered
         self.valve_history = [] # [[time, valve_state],...]
+        self.hrr_history = [] # [[time, achieved HRR (kW), energy released (kJ)],...]
+        self.hrr = AchievedHRR() # back-calculates delivered HRR from the MFC responses
+        self.mixture_history = [] # [[time, chamber fuel (vol %), flammability margin (vol %)],...]
+        self.mixture = ChamberMixture(self.channels.mixture_volume) # mixing chamber composition from the MFC responses
+        temperature = self.channels.mixture_temperature
+        self.mixture_temperature_col = self.channels.sensor(temperature).column if temperature else None
+        self.stats = RollingStats.for_channels(self.channels) # windowed mean, std, slope of every response and sensor
+        self.conditioner = SignalConditioner(self.channels) # per-sensor filter and calibration chains (signal_conditioning.py)
+
+        # Predictive over-pressure trip, see predict_pressures
+        self.trip_sensors = [self.channels.sensor(name) for name in self.channels.trip_channels]
+        self.trip_sensors = [c for c in self.trip_sensors if c.limits]
+        self.pressure_trend = QuadraticTrend(len(self.trip_sensors), self.channels.trip_window)
+        self.throttle_until = 0.0 # time.monotonic() until which flows sent as frames are throttled
+
+        # Run archive (run_archive.py): each test and custom setpoint run is catalogued when it ends, see archive_run
+        self.rig_name = "Rig 1" # set by rig_manager.py
+        self.archive = None # RunArchive, opened at the end of the first run
+        self.run_recipe = None # the loaded recipe's name, hash and header, see set_run_recipe
+        self.events = collections.deque(maxlen=1000) # (run clock ns, kind, message) fault events, filed with their run
+        self.active_violations = set() # emergency check violations already logged as events
 
         # Arduino Serial Communication Parameters
         self.Arduino_connected = False
@@ -30,10 +84,51 @@ class Data_Handler:
         self.timeout = 1  # seconds
         self.delimiter = ","
         self.running = False
-        self.run_start = 0
+        self.run_start = 0 # time.time() the current test started
+        self.run_start_ns = 0 # the same on the run clock
         self.thread = None
         self.serial = None
         self.num_mfcs = 0
+        self.auto_reconnect = True # reconnect automatically if the link drops mid-test
+        self.last_packet_time = 0 # time.monotonic() of the last telemetry line received
+        self.last_valid_time = 0 # time.monotonic() of the last new (not repeated) frame or ERR reply, for the link staleness check
+        self.replies = 0 # command replies received (telemetry frames answering a command), to wait for one while streaming
+        self.last_write_time = 0 # time.monotonic() of the last command written
+        self.connection = ConnectionManager(self)
+        self.write_lock = threading.Lock() # serial writes come from the control thread and the E-stop fast path
+        self.pending_replies = 0 # replies to out of band writes (E-stop) not read yet
+
+        # E-stop fast path timing, time.monotonic() of the request, the stop command leaving the host and the Arduino's reply
+        self.estop_firmware = (1, 3) # first sketch version with the one byte "!" E-stop
+        self.estop_timing = None # {"pressed": ..., "written": ..., "acked": ...} of the latest E-stop
+        self.estop_history = collections.deque(maxlen=100) # acknowledged E-stops
+
+        # Continuous telemetry from the Arduino (sketch 1.4+, see telemetry_stream.py), stream_rate 0 keeps one reply per command
+        self.stream_firmware = (1, 4)
+        self.stream = StreamParser(self.channels.frame_length)
+        self.streaming = 0 # rate the Arduino is streaming at [Hz], 0 when not streaming
+        # Board clock of "D," telemetry lines (sketch 1.5 stamps every line) mapped onto the run clock
+        self.clock_sync = ClockSync()
+        self.last_board_time = float("-inf") # newest board time stored [s]
+        self.link_health = LinkHealth() # seq gap, duplicate and loss statistics for the serial link
+
+        # Change-only setpoints: a frame the Arduino already holds is not sent again. Instead the host polls with "P"
+        # (sketch 1.2+) for the reply, or while streaming sends a "K" heartbeat every keepalive_interval (sketch 1.6+)
+        # to feed the sketch's command watchdog, which stops the flows if the host goes quiet (see sync_watchdog)
+        self.poll_firmware = (1, 2)
+        self.watchdog_firmware = (1, 6)
+        self.last_frame = None # setpoint frame the Arduino holds, None when unknown (new link, E-stop, segments, ERR)
+        self.last_keepalive = 0 # time.monotonic() of the last heartbeat written
+        self.watchdog_set = None # command watchdog [ms] given to the Arduino on this link
+
+        # Shared-memory telemetry bus for other local programs (see telemetry_bus.py)
+        self.telemetry_bus_error = None # reported by the main script once the UI is up
+        try:
+            self.telemetry_bus = TelemetryBus.for_channels(self.channels, name=bus_name)
+        except OSError as e:
+            self.telemetry_bus = None
+            self.telemetry_bus_error = str(e)
+        self.telemetry_listeners = [] # callables given each bus record, must not block (e.g. TelemetryServer.publish)
 
     
         # simulation variables as needed
@@ -47,23 +142,25 @@ class Data_Handler:
         # Load in values from state save
         self.methane_ambient = self.state_saver("load", "Methane_Sensor",None) # for ambient conditions testing
         self.num_mfcs = int(self.state_saver("load", "num_mfcs",None)) # to limit emergency conditions checks
+        try:
+            self.stream_rate = int(self.state_saver("load", "stream_rate", None)) # [Hz]
+            self.stream_oversample = int(self.state_saver("load", "stream_oversample", None))
+        except KeyError:
+            self.stream_rate, self.stream_oversample = 0, 1
+        try:
+            self.command_watchdog = int(self.state_saver("load", "command_watchdog", None)) # [ms], 0 = off
+        except KeyError:
+            self.command_watchdog = 1000
+        try:
+            self.keepalive_interval = self.state_saver("load", "keepalive_interval", None) # [s]
+        except KeyError:
+            self.keepalive_interval = 0.25
 
     def connect_to_arduino(self):
+        """Establish serial connection to Arduino."""
         if not self.Arduino_connected:
-            """Establish serial connection to Arduino."""
             self.UI.write_to_terminal("Attempting to connect to Arduino...")
-            self.port = self.find_arduino_port()
-            try:
-                if self.port == None:
-                    self.UI.write_to_terminal("No Arduino found. Cannot connect.")
-                    return
-                self.serial = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
-                time.sleep(2)  # allow Arduino to reset
-                self.UI.write_to_terminal(f"Connected to Arduino on {self.port}")
-                self.Arduino_connected = True
-            except serial.SerialException as e:
-                self.UI.write_to_terminal(f"Error connecting to Arduino: {e}")
-                self.serial = None
+            self.connection.connect()
             self.UI.update_indicators(name=self.UI.indicators[2])
         else:
             self.UI.write_to_terminal("Already connected to Arduino.")
@@ -71,43 +168,20 @@ class Data_Handler:
     def find_arduino_port(self):
         """
         Automatically detect which COM port an Arduino is connected to.
-        Tries to open each available serial port and look for Arduino-like identifiers.
+        Probes the candidate ports in parallel and confirms the sketch with an ID handshake.
 
         Returns:
             str: The detected port name (e.g. "COM3") or None if not found.
         """
-        # List all available ports
-        ports = list(serial.tools.list_ports.comports())
-        if not ports:
-            self.UI.write_to_terminal("No serial ports found.")
+        port_info, reply = self.connection.discover()
+        if port_info is None:
+            self.UI.write_to_terminal("No Arduino detected on available ports.")
             return None
+        self.UI.write_to_terminal(f"Detected {reply} on {port_info.device} ({port_info.description})")
+        return port_info.device
 
-        for port in ports:
-            # Common Arduino identifiers (can be extended)
-            arduino_keywords = ["arduino", "ch340", "usb serial", "mega", "uno", "nano", "leonardo"]
-
-            desc = f"{port.description}".lower()
-            hwid = f"{port.hwid}".lower()
-
-            if any(keyword in desc or keyword in hwid for keyword in arduino_keywords):
-                self.UI.write_to_terminal(f"Detected Arduino-like device on {port.device} ({port.description})")
-                # Verify communication
-                try:
-                    with serial.Serial(
-                            port=port.device,
-                            baudrate=self.baudrate,
-                            timeout=self.timeout
-                        ) as ser:
-                        self.UI.write_to_terminal(f"Opened {port.device}")
-                        return port.device
-                except (OSError, serial.SerialException):
-                    continue
-
-        self.UI.write_to_terminal("No Arduino detected on available ports.")
-        return None
-
-    def state_saver(self,action, var_name, value):
-        FILE_PATH = "state_save.csv"
+    def state_saver(self,action, var_name, value, cast=float):
+        FILE_PATH = self.state_file
 
         # Ensure file exists
         if not os.path.exists(FILE_PATH):
@@ -140,7 +214,7 @@ class Data_Handler:
         elif action == "load":
             if var_name not in data:
                 raise KeyError(f"Variable '{var_name}' not found in data store.")
-            return float(data[var_name])
+            return cast(data[var_name])
 
         else:
             raise ValueError("Action must be 'store' or 'load'.")
@@ -150,46 +224,342 @@ class Data_Handler:
         # if not self.serial or not self.serial.in_waiting:
         #     self.UI.write_to_terminal("No data available to read.")
         #     return
+        if self.streaming:
+            return self.read_stream() # the reply is somewhere in the stream, take whatever has arrived
 
         try:
-            line = self.serial.readline().decode("utf-8", errors="ignore").strip()
+            line = self.serial.readline()
             # Should recieve:
-            # Seq, State, Valve state, MFC1 Response, MFC2 Response, MFC3 Response,
+            # [D, micros,] Seq, State, Valve state, MFC1 Response, MFC2 Response, MFC3 Response,
             #  MFC4 Response, MFC5 Response, Mixing Chamber Pressure, Pipe Pressure, Gas Sensor 1, Gas Sensor 2, Temp Sensor
-            if not line:
+            if not line.strip():
                 self.UI.write_to_terminal("Received empty line from Arduino.")
                 return
+            self.last_packet_time = time.monotonic()
+            self.ingest([line])
 
-            parts = line.split(",")
-            if len(parts) != 14: # Should recieve the number of elements as descirbed above
-                self.UI.write_to_terminal(f"Malformed data packet: {line}")
-                return  # hard drop malformed packets
+        except (OSError, serial.SerialException) as e:
+            self.connection.drop_link(f"read failed ({e})")
+        except Exception as e:
+            self.UI.write_to_terminal(f"[Data_Handler] Error reading arduino data: {e}")
 
-            seq = int(parts[0])
+    def read_stream(self):
+        """
+        Continuous telemetry mode: take every byte that has arrived, without blocking.
 
-            # initialize on first run
-            if not hasattr(self, "last_seq"):
-                self.last_seq = seq
-                self.heartbeat = 0
+        Stream frames, command replies and ERR frames in between are all
+        handled by ingest().
+        """
+        try:
+            waiting = self.serial.in_waiting
+            lines = self.stream.feed(self.serial.read(waiting) if waiting else b"")
+            if not lines:
+                return
+            self.last_packet_time = time.monotonic()
+            self.ingest(lines)
 
-            # heartbeat logic
-            if seq == self.last_seq:
-                self.heartbeat += 1
+        except (OSError, serial.SerialException) as e:
+            self.connection.drop_link(f"read failed ({e})")
+        except Exception as e:
+            self.UI.write_to_terminal(f"[Data_Handler] Error reading arduino stream: {e}")
 
-            # seq changed → accept data
-            self.last_seq = seq
-            self.heartbeat = 0
-            t = time.time()
+    def ingest(self, lines):
+        """
+        Handle lines read from the Arduino, in arrival order so the seq checks see the Arduino's order.
 
-            # parse values and store histories
-            self.response_history.append([t, float(parts[3]),float(parts[4]),float(parts[5]),float(parts[6]),float(parts[7])]) # Save mfc responses
-            self.valve_history.append([t, int(parts[2])])
-            self.sensor_history.append([t, float(parts[8]),float(parts[9]),float(parts[10]),float(parts[11]),float(parts[12]),int(parts[13])]) #[time, pressure1, sensor2, Gas Sensor 1, Gas Sensor 2, Temp Sensor, Estop]
+        "D," frames (every telemetry line from sketch 1.5, stream frames from
+        1.4) are converted to numbers in one go (telemetry_stream.py) and stamped
+        with the board's clock mapped onto the run clock (run_clock.py). Other
+        lines go to handle_line. The frames to be stored are filtered as one block.
+        """
+        frames, order, malformed = self.stream.split(lines)
+        for _ in range(malformed):
+            self.link_health.on_malformed()
+        rows = iter(())
+        if frames:
+            board, values, ok = self.stream.parse(frames)
+            times = [0] * len(frames)
+            if ok.any():
+                # The newest frame waited the least, and left the board a line's transmission time before it was read
+                newest = np.flatnonzero(ok)[np.argmax(board[ok])]
+                sent = self.last_packet_time - (len(frames[newest]) + 3) * 10 / self.baudrate
+                self.clock_sync.observe(board[newest], sent)
+                times = np.zeros(len(frames), dtype=np.int64)
+                times[ok] = self.clock.from_monotonic(self.clock_sync.to_host(board[ok]))
+                times = times.tolist()
+            # Only frames newer than every stored one are stored, a reply while streaming repeats the latest stream sample
+            seen = np.maximum.accumulate(np.concatenate([[self.last_board_time], np.where(ok, board, -np.inf)]))
+            newer = ok & (board > seen[:-1])
+            self.last_board_time = float(seen[-1])
+            rows = zip(newer.tolist(), times, values.tolist(), ok.tolist())
+        accepted = [] # (time, fields) of the frames that passed the checks, to store
+        for line in order:
+            if line is not None:
+                self.handle_line(line)
+                continue
+            newer, t, parts, valid = next(rows)
+            if not valid:
+                self.link_health.on_malformed()
+                continue
+            # A reply while streaming only counts for the checks and the latency
+            latency = None if self.streaming and newer else self.last_packet_time - self.last_write_time
+            if self.check_frame(parts, latency) and newer:
+                accepted.append((t, parts))
+        if not accepted:
+            return
+        # Only stored frames go through the filters, a dropped duplicate must not move their state
+        block = raw = [parts for _, parts in accepted]
+        if self.conditioner.active:
+            block = self.condition(np.array(raw, dtype=float)).tolist()
+        else:
+            raw = itertools.repeat(None)
+        for (t, _), parts, unfiltered in zip(accepted, block, raw):
+            self.store_frame(parts, t, raw=unfiltered)
+
+    def condition(self, values):
+        """Telemetry rows (frames x fields) with the sensors put through the channel map's filters."""
+        out = values.copy()
+        columns = self.conditioner.indices
+        out[:, columns] = self.conditioner.process(values[:, columns], self.sample_rate())
+        return out
+
+    def sample_rate(self):
+        """Telemetry samples a second the filters are designed for: the stream rate, or one reply per control loop."""
+        if self.streaming:
+            return self.streaming
+        return 1 / self.cs.resolution if self.cs is not None else 5.0
+
+    def reset_board_clock(self):
+        """Forget the Arduino's clock, e.g. after a reconnect (the board may have rebooted)."""
+        self.stream.reset_clock()
+        self.clock_sync.reset()
+        self.last_board_time = float("-inf")
+        self.conditioner.reset()
+
+    def mark_run_start(self):
+        """Start a test's time axis now. The histories carry on across tests, their times are on the run clock."""
+        self.run_start_ns = self.clock.now_ns()
+        self.run_start = self.clock.to_wall(self.run_start_ns)
+
+    def handle_line(self, line):
+        """One line from the Arduino that is not a "D," frame: ERR frame or a sketch 1.4 and older telemetry line."""
+        if line.startswith("ERR,"): # Error frame from sendError: ERR,seq,message
+            err_parts = line.split(",", 2)
+            message = err_parts[2].strip() if len(err_parts) > 2 else ""
+            self.link_health.on_error(int(err_parts[1]), message)
+            self.last_valid_time = self.last_packet_time # a refusal is still an answer
+            self.UI.write_to_terminal(f"[Arduino] {line}")
+            self.log_event("Arduino Error", message)
+            self.last_frame = None # the frame may have been refused, send the next one in full
+            if message == WATCHDOG_ERROR and self.cs is not None and self.cs.STATE != 0:
+                # The Arduino has already stopped the flows, hold the plant stopped instead of resuming them
+                self.UI.write_to_terminal(f"[COMMAND WATCHDOG] No command reached the Arduino for "
+                                          f"{self.command_watchdog} ms, it stopped the flows")
+                self.cs.set_state(0)
+                self.estop_timing = None # stopped before it was asked to, not an E-stop latency
+            return
 
-        except Exception as e:
-            self.UI.write_to_terminal(f"[Data_Handler] Error reading arduino data: {e}")
+        parts = line.split(",")
+        if len(parts) != self.channels.frame_length: # Should recieve the number of elements as described in the channel map
+            self.link_health.on_malformed()
+            self.UI.write_to_terminal(f"Malformed data packet: {line}")
+            return  # hard drop malformed packets
+        # While streaming the stream carries the samples, a command reply only counts for the seq and E-stop checks
+        if not self.check_frame(parts, self.last_packet_time - self.last_write_time) or self.streaming:
+            return
+        raw = None
+        if self.conditioner.active:
+            raw, parts = parts, self.condition(np.array([parts], dtype=float))[0].tolist()
+        # No board clock, the sample is stamped when it was read
+        self.store_frame(parts, self.clock.from_monotonic(self.last_packet_time), raw=raw)
+
+    def check_frame(self, parts, latency=None):
+        """
+        E-stop acknowledgement and seq heartbeat checks of one telemetry frame, in arrival order.
+
+        Args:
+            parts: the frame's fields, as str from a line or numbers from a stream burst
+            latency: command to reply time [s], None for stream frames
+
+        Returns:
+            False for a duplicated or stale frame, which must not be stored.
+        """
+        state = int(parts[self.channels.state_index])
+        timing = self.estop_timing
+        if timing is not None and timing["written"] is not None and timing["acked"] is None and state == 0:
+            self.estop_acked(timing)
+
+        # seq heartbeat check, drop duplicated or stale packets
+        seq = int(parts[self.channels.seq_index])
+        if latency is not None: # stream frames have no command to answer
+            self.replies += 1
+        if not self.link_health.on_packet(seq, state, self.last_packet_time, latency):
+            return False
+        self.last_valid_time = self.last_packet_time # garbage or repeated frames must not keep a dead link looking alive
+        return True
+
+    def store_frame(self, parts, t, raw=None):
+        """
+        Store one telemetry frame that passed check_frame.
+
+        Args:
+            parts: the frame's fields, sensors already filtered
+            t: run clock time of the sample [ns]
+            raw: the frame's fields before filtering, for raw_sensor_history
+        """
+        seq = int(parts[self.channels.seq_index])
+        state = int(parts[self.channels.state_index])
+
+        # parse values and store histories
+        response, valve, sensors = self.channels.parse(parts, t)
+        self.response_history.append(response) # Save mfc responses
+        self.hrr_history.append([t, *self.hrr.update(t / NS, response)])
+        temperature = sensors[self.mixture_temperature_col] if self.mixture_temperature_col else 20.0
+        self.mixture_history.append([t, *self.mixture.update(t / NS, response, sensors[self.mixing_chamber_col], temperature)])
+        self.valve_history.append(valve)
+        self.sensor_history.append(sensors)
+        if raw is not None:
+            self.raw_sensor_history.append(self.channels.parse(raw, t)[2])
+        self.stats.append(t / NS, [*response[1:], *sensors[1:]])
+        if self.trip_sensors:
+            self.predict_pressures(t, sensors)
+        if self.telemetry_bus is not None or self.telemetry_listeners:
+            setpoints = self.setpoint_history[-1][1:] if self.setpoint_history else ()
+            if len(setpoints) != self.channels.n_mfcs:
+                setpoints = self.channels.zero_row("setpoint")[1:]
+            record = [self.clock.to_wall(t), seq, state, valve[1],
+                      *response[1:], *sensors[1:], *setpoints, *self.hrr_history[-1][1:], *self.mixture_history[-1][1:]]
+            if self.telemetry_bus is not None:
+                self.telemetry_bus.publish(record)
+            for listener in self.telemetry_listeners:
+                listener(record)
+
+    def predict_pressures(self, t, sensors):
+        """
+        Predictive over-pressure trip, run on every stored sample.
+
+        Each guarded pressure's trend (value, slope and curvature, see
+        pressure_trend.py) is extrapolated to when it would reach its limits. If
+        that comes before the rig could act on a command sent now (the measured
+        actuation latency, the wait for the next sample and the channel map's
+        margin), reaching the max limit trips the emergency stop and reaching
+        the warning limit throttles the flows for a while.
+        """
+        trend = self.pressure_trend
+        trend.update(t / NS, [sensors[c.column] for c in self.trip_sensors])
+        if self.cs is None or self.cs.STATE not in (2, 3): # only while flows are commanded
+            return
+        age = (self.clock.now_ns() - t) / NS # time already gone since the sample was taken
+        value, slope, curvature = trend.value(), trend.slope(), trend.curvature()
+        horizon = None
+        for i, c in enumerate(self.trip_sensors):
+            to_warn = time_to_limit(value[i], slope[i], curvature[i], c.limits[2]) - age
+            to_max = time_to_limit(value[i], slope[i], curvature[i], c.limits[3]) - age
+            if min(to_warn, to_max) > 5: # nowhere near, skip the latency lookup
+                continue
+            if horizon is None:
+                horizon = self.actuation_latency() + 1 / self.sample_rate() + self.channels.trip_margin
+            trend_text = f"{c.name} at {value[i]:.2f} {c.units} rising {slope[i]:.2f} {c.units}/s"
+            if to_max < horizon:
+                text = (f"{trend_text}, projected to reach {c.limits[3]} {c.units} "
+                        f"in {max(to_max, 0):.2f} s, within the {horizon:.2f} s the rig needs to act")
+                self.UI.write_to_terminal(f"[PRESSURE TRIP] {text}")
+                self.log_event("Pressure Trip", text)
+                self.cs.set_state(0)
+                return
+            if to_warn < horizon:
+                if time.monotonic() >= self.throttle_until:
+                    text = (f"{trend_text}, projected to reach {c.limits[2]} {c.units} in {max(to_warn, 0):.2f} s, "
+                            f"flows throttled to {100 * self.channels.trip_throttle:.0f}% for {self.channels.trip_hold:.0f} s")
+                    self.UI.write_to_terminal(f"[PRESSURE TRIP] {text}")
+                    self.log_event("Pressure Throttle", text)
+                self.throttle_until = time.monotonic() + self.channels.trip_hold
+
+    def actuation_latency(self):
+        """Seconds from deciding to stop to the Arduino acting on it: the median confirmed E-stop, else the mean command to reply time."""
+        confirmed = [e["acked"] - e["pressed"] for e in self.estop_history]
+        return float(np.median(confirmed)) if confirmed else self.link_health.mean_latency()
+
+    # ---------- Continuous telemetry ---------- #
+    def sync_stream(self):
+        """
+        Start or stop the Arduino's continuous telemetry to match stream_rate.
+
+        Called by the control thread before each command, so the stream is
+        switched from the thread that reads the port. Sketches before 1.4 have
+        no stream mode and stay on one reply per command.
+        """
+        wanted = self.stream_rate if self.connection.firmware_version() >= self.stream_firmware else 0
+        if wanted == self.streaming or not self.Arduino_connected:
+            return
+        try:
+            errors = self.link_health.errors
+            with self.write_lock:
+                self.serial.write(f"T,{wanted},{self.stream_oversample}\n".encode("utf-8"))
+                self.last_write_time = time.monotonic()
+            if wanted:
+                self.read_data() # plain reply (or ERR) before the stream starts
+                if self.link_health.errors == errors:
+                    self.streaming = wanted
+                    self.UI.write_to_terminal(f"[Data_Handler] Arduino streaming telemetry at {wanted} Hz, "
+                                              f"{self.stream_oversample}x oversampled")
+                else:
+                    self.stream_rate = 0 # refused (e.g. rate too high for the baud rate), stay on replies
+                    self.UI.write_to_terminal("[Data_Handler] Continuous telemetry refused, reading one reply per command")
+            else:
+                time.sleep(0.05) # let the frames already on their way arrive
+                self.read_stream()
+                self.streaming = 0
+                self.UI.write_to_terminal("[Data_Handler] Arduino telemetry stream stopped")
+        except (OSError, serial.SerialException) as e:
+            self.connection.drop_link(f"write failed ({e})")
+
+    def sync_watchdog(self):
+        """
+        Give the Arduino's command watchdog its timeout, once per link.
 
+        Sketch 1.6+ stops the flows like an E-stop when no command line (frame,
+        segment, poll or "K" heartbeat) has arrived for command_watchdog ms during
+        a test or custom setpoints. Called with sync_stream, older sketches have no
+        watchdog.
+        """
+        if (self.watchdog_set == self.command_watchdog or not self.Arduino_connected
+                or self.connection.firmware_version() < self.watchdog_firmware):
+            return
+        try:
+            errors = self.link_health.errors
+            with self.write_lock:
+                self.serial.write(f"W,{self.command_watchdog}\n".encode("utf-8"))
+                self.last_write_time = time.monotonic()
+            self.read_data() # streaming: the reply is read with the stream
+            self.watchdog_set = self.command_watchdog # a refusal is reported once, not on every command
+            if self.link_health.errors == errors and self.command_watchdog:
+                self.UI.write_to_terminal(f"[Data_Handler] Arduino command watchdog set to {self.command_watchdog} ms")
+        except (OSError, serial.SerialException) as e:
+            self.connection.drop_link(f"write failed ({e})")
+
+    def keep_alive(self):
+        """
+        Stand-in for a frame the Arduino already holds.
 
+        Without the stream a "P" poll fetches the telemetry reply the frame would
+        have got. While streaming the stream brings the telemetry, so only a "K"
+        heartbeat goes out, when nothing else has been written for
+        keepalive_interval (sketch 1.6+, older sketches have no watchdog to feed).
+        """
+        if not self.streaming:
+            with self.write_lock:
+                self.serial.write(b"P\n")
+                self.last_write_time = time.monotonic()
+            self.read_data()
+            return
+        now = time.monotonic()
+        if (self.connection.firmware_version() >= self.watchdog_firmware
+                and now - max(self.last_write_time, self.last_keepalive) >= self.keepalive_interval):
+            with self.write_lock:
+                self.serial.write(b"K\n") # no reply, last_write_time stays on the last command that gets one
+                self.last_keepalive = now
+        self.read_stream()
 
     def update_setpoints(self, new_setpoints):
         """Update the data_out list with new setpoints."""
@@ -206,25 +576,225 @@ class Data_Handler:
         #     self.mfc_response_history.append([time.time(),[self.sim_mfcs[i].get_value() for i in range(len(self.sim_mfcs))]])
 
         if self.Arduino_connected == False: # check if arduino connected
-            self.UI.write_to_terminal("[Data_Handler] Cannot send data, Arduino not connected.")
+            if not self.connection.reconnecting: # reconnect attempts are already reported
+                self.UI.write_to_terminal("[Data_Handler] Cannot send data, Arduino not connected.")
             return
 
         try:
-            # new_setpoints = [State (3 = custom setpoints), Valve, MFC1, MFC2, MFC3, MFC4, MFC5]
+            self.read_pending()
+            self.sync_stream()
+            self.sync_watchdog()
+            # new_setpoints = [State (3 = custom setpoints), Valve, MFC1, ..., MFCn], see ChannelMap.setpoint_frame
             # Convert list to string for sending
             # Example: "1.0,0,23.4\n"
+            if new_setpoints[0] in (2, 3) and time.monotonic() < self.throttle_until: # a pressure warning is predicted
+                new_setpoints = [*new_setpoints[:2], *(f * self.channels.trip_throttle for f in new_setpoints[2:])]
+            if new_setpoints == self.last_frame and self.connection.firmware_version() >= self.poll_firmware:
+                self.keep_alive() # nothing new for the Arduino, and no blocking write and read of a whole frame
+                self.setpoint_history.append([self.clock.now_ns(), *new_setpoints[2:]])
+                return
             out_string = self.delimiter.join(map(str, new_setpoints)) + "\n"
-            self.serial.write(out_string.encode("utf-8")) # Send the data
-            self.setpoint_history.append([time.time(), new_setpoints[2],new_setpoints[3],new_setpoints[4],new_setpoints[5],new_setpoints[6]]) # Save mfc setpoints
+            with self.write_lock:
+                if new_setpoints[0] != 0 and self.estop_active():
+                    return # an E-stop went out ahead of this frame
+                self.serial.write(out_string.encode("utf-8")) # Send the data
+                self.last_write_time = time.monotonic()
+                self.last_frame = list(new_setpoints)
+            self.setpoint_history.append([self.clock.now_ns(), *new_setpoints[2:]]) # Save mfc setpoints
 
             self.read_data() # Immediately read response after sending setpoints
 
+        except (OSError, serial.SerialException) as e:
+            self.connection.drop_link(f"write failed ({e})")
+        except Exception as e:
+            self.UI.write_to_terminal(f"Error sending data: {e}")
+
+    def send_command(self, fields, confirm=False):
+        """
+        Write one protocol line (e.g. a segment or poll) and read the Arduino's reply.
 
+        Returns True if sent and not refused with an ERR frame (as sync_stream
+        checks the T command). While streaming the reply comes among the stream
+        frames, confirm waits up to timeout for it so a refusal is seen here.
+        """
+        if self.Arduino_connected == False:
+            if not self.connection.reconnecting:
+                self.UI.write_to_terminal("[Data_Handler] Cannot send data, Arduino not connected.")
+            return False
+        try:
+            self.read_pending()
+            self.sync_stream()
+            self.sync_watchdog()
+            with self.write_lock:
+                if fields[0] == "S" and self.estop_active():
+                    return False # no ramp segments after an E-stop
+                errors, replies = self.link_health.errors, self.replies
+                self.serial.write((self.delimiter.join(map(str, fields)) + "\n").encode("utf-8"))
+                self.last_write_time = time.monotonic()
+            self.read_data()
+            deadline = self.last_write_time + self.timeout
+            while (confirm and self.streaming and self.replies == replies and self.link_health.errors == errors
+                   and time.monotonic() < deadline):
+                time.sleep(0.002)
+                self.read_stream()
+            return self.link_health.errors == errors
+        except (OSError, serial.SerialException) as e:
+            self.connection.drop_link(f"write failed ({e})")
         except Exception as e:
             self.UI.write_to_terminal(f"Error sending data: {e}")
+        return False
 
+    def send_segment(self, state, valve, duration, flows):
+        """Queue a ramp segment on the Arduino: reach flows [SLPM] after duration [s]."""
+        self.last_frame = None # the ramp moves the setpoints away from the last frame
+        return self.send_command(["S", state, valve, int(round(duration * 1000)), *flows], confirm=True)
+
+    def poll_telemetry(self):
+        """Ask for one telemetry line without changing any setpoints (streaming: take the frames that arrived)."""
+        if self.streaming and self.Arduino_connected:
+            try:
+                self.keep_alive() # segment mode sends nothing else for a while, keep the command watchdog fed
+            except (OSError, serial.SerialException) as e:
+                self.connection.drop_link(f"write failed ({e})")
+            return True
+        return self.send_command(["P"])
+
+    def record_setpoints(self, flows):
+        """Save the setpoints the Arduino is ramping through (segment mode sends them ahead of time)."""
+        self.setpoint_history.append([self.clock.now_ns(), *flows])
+
+    # ---------- E-stop fast path ---------- #
+    def send_estop(self, pressed=None):
+        """
+        Write the stop command to the Arduino now, from the calling thread.
+
+        Does not wait for the control thread, for a reply it is reading or for
+        the reply to the stop itself. Sketch 1.3+ gets the one byte "!" command,
+        older sketches a zero flow, valve closed frame. Frames the control thread
+        queues after this are dropped while STATE is 0, and its next read picks up
+        the Arduino's reply as the acknowledgement (see estop_acked).
+
+        Args:
+            pressed: time.monotonic() of the operator's request, defaults to now
+        Returns:
+            True if the command was written.
+        """
+        timing = {"pressed": time.monotonic() if pressed is None else pressed, "written": None, "acked": None}
+        self.estop_timing = timing
+        self.last_frame = None # the Arduino now holds zeros, the control thread's next frame goes out in full
+        if not self.Arduino_connected:
+            return False
+        if self.connection.firmware_version() >= self.estop_firmware:
+            out = b"!"
+        else:
+            out = (self.delimiter.join(map(str, self.channels.setpoint_frame(0, 0))) + "\n").encode("utf-8")
+        try:
+            with self.write_lock:
+                self.serial.write(out)
+                self.serial.flush() # returns once the bytes have left the host
+                self.last_write_time = time.monotonic()
+                self.pending_replies += 1
+        except (OSError, serial.SerialException, AttributeError): # AttributeError: the link dropped under us
+            return False # the control thread's next write reports the dead link
+        timing["written"] = self.last_write_time
+        self.record_setpoints(self.channels.zero_row("setpoint")[1:])
+        self.log_event("E-Stop", "Stop command sent to the Arduino")
+        return True
+
+    def estop_active(self):
+        return self.cs is not None and self.cs.STATE == 0
+
+    def read_pending(self):
+        """Read the replies to out of band writes first, so every command still reads its own reply."""
+        if self.streaming: # replies come with the stream, only wait for an E-stop to be confirmed
+            deadline = time.monotonic() + self.timeout
+            while self.pending_replies > 0 and self.Arduino_connected and time.monotonic() < deadline:
+                self.read_stream()
+                if self.estop_timing is None or self.estop_timing["acked"] is not None:
+                    break
+                time.sleep(0.001)
+            self.pending_replies = 0
+            return
+        while self.pending_replies > 0 and self.Arduino_connected:
+            self.pending_replies -= 1
+            self.read_data()
+
+    def estop_acked(self, timing):
+        """The Arduino reported STATE 0 after an E-stop was written: log how long each stage took."""
+        timing["acked"] = self.last_packet_time
+        self.estop_history.append(timing)
+        self.UI.write_to_terminal(f"[E-STOP] Stop command sent {1000 * (timing['written'] - timing['pressed']):.1f} ms "
+                                  f"after the request, Arduino confirmed after {1000 * (timing['acked'] - timing['pressed']):.1f} ms")
+
+
+    # ---------- Run archive ---------- #
+    def log_event(self, kind, message):
+        """Note a fault event (limit, trip, E-stop, lost link...), the run archive files it with the run it falls in."""
+        self.events.append((self.clock.now_ns(), kind, message))
+
+    def set_run_recipe(self, name, plan, gas_names, heat_comb, density):
+        """The recipe tests now run (CompiledRecipe fields), catalogued with each test by its name and hash."""
+        self.run_recipe = {"name": name, "hash": run_archive.recipe_hash(plan, gas_names, heat_comb, density),
+                           "plan": plan, "gas_names": list(gas_names), "heat_comb": list(heat_comb),
+                           "density": list(density)}
+
+    def archive_dir(self):
+        """Directory of this rig's run archive: run_archive in state_save.csv ("off" for none), else next to the state file."""
+        try:
+            return self.state_saver("load", "run_archive", None, cast=str)
+        except KeyError:
+            return os.path.join(os.path.dirname(os.path.abspath(self.state_file)), "run_archive")
+
+    def archive_run(self, state, end_state):
+        """
+        Hand the test (state 2) or custom setpoint run (state 3) that just ended to the run archive.
+
+        Called by the control thread on the state change, so it only takes the
+        rows since the run started (list slices). Arrays, metrics and files are
+        made on the archive's writer thread.
+        """
+        try:
+            directory = self.archive_dir()
+            if directory.strip().lower() == "off":
+                return
+            if self.archive is None or self.archive.directory != directory:
+                self.archive = run_archive.RunArchive(directory)
+            start = self.run_start_ns
+
+            def since(history):
+                return history[bisect.bisect_left(history, start, key=lambda row: row[0]):]
+
+            telemetry = [since(h) for h in (self.response_history, self.sensor_history, self.valve_history,
+                                            self.hrr_history, self.mixture_history)]
+            raw = since(self.raw_sensor_history)
+            raw_sensors = [c for c in self.channels.sensors if c.extra.get("filters")]
+            if raw and len(raw) == len(telemetry[0]): # one raw row per sample, the filtered sensors' columns
+                telemetry.append([[row[0], *(row[c.column] for c in raw_sensors)] for row in raw])
+            else:
+                raw_sensors = []
+            with open(self.state_file, newline="") as f:
+                calibration = {row[0]: row[1] for row in csv.reader(f) if len(row) == 2}
+            future = self.archive.submit({
+                "rig": self.rig_name, "kind": "test" if state == 2 else "custom", "started": self.run_start,
+                "ended": self.clock.to_wall(self.clock.now_ns()), "end_state": end_state, "start_ns": start,
+                "recipe": self.run_recipe if state == 2 else None, "calibration": calibration,
+                "events": [e for e in self.events if e[0] >= start], "n_mfcs": self.num_mfcs,
+                "fields": run_archive.telemetry_fields(self.channels, raw_sensors), "telemetry": telemetry,
+                "setpoint_fields": ["Time (s)"] + [f"{c.name} Setpoint ({c.units})" for c in self.channels.mfcs],
+                "setpoints": since(self.setpoint_history),
+            })
+            future.add_done_callback(self._run_archived)
+        except (OSError, sqlite3.Error) as e:
+            self.UI.write_to_terminal(f"[Run Archive] Could not archive the run: {e}")
+
+    def _run_archived(self, future):
+        try:
+            run_id = future.result()
+        except Exception as e:
+            self.UI.write_to_terminal(f"[Run Archive] Could not archive the run: {e}")
+            return
+        self.UI.write_to_terminal(f"[Run Archive] Run saved as #{run_id} in {self.archive.directory}")
 
-        
 
     # ### # Define similair functions for simulation instead of arduino communication
     # def start_sim(self,number_of_mfcs=5):
@@ -252,55 +822,74 @@ class Data_Handler:
         # Emergency condition test frames
         # Name, Test type, Value, Min, warning min, warning max, max 
         # If test is binary (T/F) then use 0,0,0,1 where last value is desired state, first is opposite, middle ignored
-        MFC_setpoint_tests = [
-            [f"MFC {i} Setpoint",
-             "All",
-               self.setpoint_history[-1][i], 0, 0, 450, 500]
-            for i in range(1,min(len(self.setpoint_history[-1]),self.num_mfcs))
-        ]
+        channels = self.channels
+        active = channels.mfcs[:min(self.num_mfcs, channels.n_mfcs)] # only check MFC's in use
+        if self.setpoint_history == []:
+            MFC_setpoint_tests = []
+        else:
+            setpoint = self.setpoint_history[-1]
+            MFC_setpoint_tests = [
+                [f"{c.name} Setpoint", "All", setpoint[c.column], *c.limits]
+                for c in active if c.limits and c.column < len(setpoint)
+            ]
 
-        if not len(self.response_history) == 0 or len(self.setpoint_history) == 0:
+        if not len(self.response_history) == 0 and not len(self.setpoint_history) == 0:
+            setpoint = self.setpoint_history[-1]
+            response = self.response_history[-1]
+            dt = (setpoint[0] - self.setpoint_history[-2][0]) / NS if len(self.setpoint_history) > 1 else 1
 
             MFC_response_tests = [
                 [
-                    f"MFC {i} Response",
+                    f"{c.name} Response",
                     "All",
-                    self.response_history[-1][i],
+                    response[c.column],
                     0, 0,
-                    1.1 * self.setpoint_history[-1][i], # Warning at over 110% of setpoint, max at 120%
-                    1.5 * self.setpoint_history[-1][i],
+                    channels.response_warn_ratio * setpoint[c.column], # Warning over 110% of setpoint, max at 150%
+                    channels.response_max_ratio * setpoint[c.column],
                 ]
-                for i in range(1,min(len(self.setpoint_history[-1]),self.num_mfcs))
+                for c in active if c.column < len(setpoint) and c.column < len(response)
             ]
         
             # Response delta is less than zero (Controls response to large step initially slightly oposite, have positive max)
             MFC_response_Error_delta_tests = [
                 [
-                    f"MFC {i+1} Response Error Delta",
+                    f"{c.name} Response Error Delta",
                     "All",
-                    (self.response_history[-1][i]- self.setpoint_history[-1][i])/(self.setpoint_history[-1][0]-self.setpoint_history[-2][0] if len(self.setpoint_history) > 1 else 1), # d(SLPM)/dt
+                    (response[c.column] - setpoint[c.column]) / (dt if dt else 1), # d(SLPM)/dt
                     -100, -100, 0, 5,
                 ]
-                for i in range(1,min(len(self.setpoint_history[-1]),self.num_mfcs))
+                for c in active if c.column < len(setpoint) and c.column < len(response)
             ]
         else:
             MFC_response_tests = []
             MFC_response_Error_delta_tests = []
-        
 
-        # self.sensor_history = [[time, pressure1, sensor2, Gas Sensor 1, Gas Sensor 2,Temp Sensor, Estop,...],...]
+        # Sensor limits from the channel map, self.sensor_history = [[time, sensor1, sensor2, ...],...]
+        sensor_tests = []
+        if self.sensor_history != [] and len(self.sensor_history[-1]) > channels.n_sensors:
+            sensors = self.sensor_history[-1]
+            sensor_tests = [[c.name, "All", sensors[c.column], *c.limits] for c in channels.sensors if c.limits]
+            # d(chamber - line pressure)/dt from line fits over the rate window rather than the last two samples
+            slopes = self.stats.slopes(channels.rate_window)
+            delta = slopes[self.stats.field("Mixing Chamber Pressure")] - slopes[self.stats.field("Line Pressure")]
+            if not np.isnan(delta): # until the window holds two samples
+                sensor_tests.append(["Pressure Delta - Loss of Pressure", "All", delta, -10, -10, 40, 50])
+
+        # Estimated chamber mixture vs its flammable range (mixture_model.py), no fuel gives nan
+        if self.mixture_history and channels.mixture_limits and not np.isnan(self.mixture_history[-1][2]):
+            sensor_tests.append(["Chamber Flammability Margin", "All", self.mixture_history[-1][2], *channels.mixture_limits])
+
         emergency_tests = (
             MFC_setpoint_tests
             + MFC_response_tests
             + MFC_response_Error_delta_tests
+            + sensor_tests
             + [
-                [] if self.sensor_history == [] else ["Mixing Chamber Pressure", "All", self.sensor_history[-1][1], 0, 0, 23, 25],
-                [] if self.sensor_history == [] else ["Line Pressure", "All", self.sensor_history[-1][2], 0, 0, 23, 25],
-                [] if self.sensor_history == [] else ["Pressure Delta - Loss of Pressure", "All", (self.sensor_history[-1][1] - self.sensor_history[-1][2])/(self.sensor_history[-1][0] - self.sensor_history[-2][0] if len(self.sensor_history) > 1 else 1), -10, -10, 40, 50],
                 #[] if self.sensor_history == [] else ["Methane Sensor Absolute", "All", self.sensor_history[-1][3], 0, 0, .4, .6],
-                #[] if self.sensor_history == [] else ["Gas Sensor 2", "All", self.sensor_history[-1][4], 0, 0, 40, 50],
                 #[] if self.valve_history == [] else ["Valve State", "Binary", self.valve_history[-1][1], 0, 0, 1, self.setpoint_history[-1][-1]],
                 ["Arduino Connected", "Binary", self.Arduino_connected, 0, 0, 1, 1],
+                ["Link Packet Loss", "All", self.link_health.loss_fraction(), 0, 0, 0.05, self.link_health.loss_limit],
+                ["Link Heartbeat", "Binary", not self.link_health.link_lost(), 0, 0, 1, 1],
                 #[] if self.sensor_history == [] else ["Methane Sensor Relative to Ambient", "All", self.sensor_history[-1][3], 0, 0, self.methane_ambient * 1.1, self.methane_ambient * 1.2],
                 #[] if self.sensor_history == [] else ["E-Stop", "Binary", self.sensor_history[-1][6], 0, 0, 1, 1] # 1 = not engaged, 0 = engaged, emergency
             ]
@@ -327,7 +916,16 @@ class Data_Handler:
                     violations.append(f"{test[0]} not in desired state")
             else:
                 self.UI.write_to_terminal(f"Unknown test type '{test[1]}' for {test[0]}")
+        for violation in set(violations) - self.active_violations: # logged when they start, not every loop
+            self.log_event("Limit", violation)
+        self.active_violations = set(violations)
         if violations != []:
             joined = ',\n'.join(violations)
             self.UI.write_to_terminal(f"Warning: {joined}")
             #self.cs.set_state(0) # Set state to emergency stop
+
+        # A frozen or lossy link can not be trusted with the next command or E-stop, trip on it instead of only warning.
+        # drop_link holds the plant in emergency stop, the watchdog reconnects and starts the seq tracking over.
+        if self.Arduino_connected and self.link_health.link_lost():
+            self.log_event("Link Lost", self.link_health.summary())
+            self.connection.drop_link(f"seq heartbeat lost ({self.link_health.summary()})")
@@ -0,0 +1,137 @@
+"""
+E-stop latency benchmark.
+
+Runs one rig on a simulated Arduino (simulated_arduino.py), holding custom
+setpoints or running a test, and presses EMERGENCY STOP at random moments,
+including while the control thread is waiting for a reply. Every press is
+timed from the request to:
+    sent       stop command written and flushed to the port
+    confirmed  Arduino telemetry reporting STATE 0 read back
+
+and the Arduino must have zero flow and the valve closed as soon as the
+request returns, with no setpoint frame overriding the stop afterwards.
+
+    python estop_benchmark.py --presses 40
+    python estop_benchmark.py --budget-sent 5 --budget-confirmed 50   # exit 1 if a p99 is over budget [ms]
+    python estop_benchmark.py --legacy   # sketch older than 1.3: zero flow frame instead of "!"
+    python estop_benchmark.py --stream-rate 50   # with the Arduino streaming telemetry
+
+The simulated reply delay stands in for the ~6 ms a telemetry line takes at
+115200 baud.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from channel_map import CHANNEL_MAP_PATH
+from rig_manager import RigManager, _HeadlessUI
+
+REPLY_DELAY = 0.006 # s, one telemetry line at 115200 baud
+TEST_PLAN = [[0, 0, 0, 0], [30, 60, 20, 100], [60, 0, 0, 0]] # time, MFC 1, MFC 2, HRR
+
+
+def _p99(values):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+
+
+def _wait(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def press(rig, state, rng):
+    """Put the rig in state (3 custom setpoints, 2 test), press E-stop at a random moment. Returns (sent, confirmed, safe)."""
+    sim = rig.dh.serial
+    if state == 3:
+        rig.view.request_custom_setpoints(1, [20.0, 5.0])
+    else:
+        rig.cs.set_state(2)
+    time.sleep(0.4 + rng.uniform(0, rig.cs.resolution)) # land anywhere in the loop period
+
+    rig.view.request_estop()
+    safe = sim.state == 0 and sim.valve == 0 and not any(sim.setpoints) # acted on before the request returned
+    timing = rig.dh.estop_timing
+    _wait(lambda: timing["acked"] is not None, 1.0)
+    time.sleep(3 * rig.cs.resolution) # the control thread must not send anything that undoes the stop
+    safe &= sim.state == 0 and sim.valve == 0 and not any(sim.setpoints)
+
+    rig.cs.set_state(1)
+    time.sleep(0.1)
+    if timing["written"] is None or timing["acked"] is None:
+        return None, None, safe
+    return timing["written"] - timing["pressed"], timing["acked"] - timing["pressed"], safe
+
+
+def benchmark(presses=40, legacy=False, seed=0, verbose=False, stream_rate=0):
+    tmp = tempfile.mkdtemp()
+    state_file = os.path.join(tmp, "state.csv")
+    with open(state_file, "w") as f:
+        f.write("line_pressure,15.0\nmixing_chamber_pressure,14.7\nMethane_Sensor,0.3\ngas_sensor_2,0.2\nnum_mfcs,2\n"
+                f"stream_rate,{stream_rate}\nstream_oversample,4\n")
+    manager = RigManager([{"name": "Rig 1", "state_file": state_file, "channel_map": CHANNEL_MAP_PATH,
+                           "telemetry_bus": f"sbgc_estop_{os.getpid()}"}])
+    ui = _HeadlessUI(verbose)
+    manager.attach_ui(ui)
+    ui.test_plan = TEST_PLAN
+    manager.start()
+    rig = manager.rigs[0]
+    manager.connect_simulated(rig, reply_delay=REPLY_DELAY, seed=seed)
+    if legacy:
+        rig.dh.connection.firmware_id = "ID,SBGC,1.2"
+
+    rng = random.Random(seed)
+    results = []
+    try:
+        for i in range(presses):
+            results.append(press(rig, 3 if i % 2 == 0 else 2, rng))
+    finally:
+        manager.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the E-stop path from the request to the Arduino's confirmation.")
+    parser.add_argument("--presses", type=int, default=40, help="E-stop presses, alternating custom setpoints and a test (default: 40)")
+    parser.add_argument("--budget-sent", type=float, default=5.0, help="p99 request to command sent allowed [ms] (default: 5)")
+    parser.add_argument("--budget-confirmed", type=float, default=50.0, help="p99 request to Arduino confirmation allowed [ms] (default: 50)")
+    parser.add_argument("--legacy", action="store_true", help="firmware without the one byte E-stop")
+    parser.add_argument("--stream-rate", type=int, default=0, help="Arduino telemetry stream rate [Hz], 0 for replies only (default: 0)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the terminal messages")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.presses, args.legacy, args.seed, args.verbose, args.stream_rate)
+    sent = [1000 * r[0] for r in results if r[0] is not None]
+    confirmed = [1000 * r[1] for r in results if r[1] is not None]
+    unconfirmed = sum(r[1] is None for r in results)
+    unsafe = sum(not r[2] for r in results)
+
+    print(f"{'stage':>10} {'median':>9} {'p99':>9} {'max':>9}")
+    for name, values in (("sent", sent), ("confirmed", confirmed)):
+        if values:
+            print(f"{name:>10} {sorted(values)[len(values) // 2]:>7.2f}ms {_p99(values):>7.2f}ms {max(values):>7.2f}ms")
+    print(f"{len(results)} presses, {unconfirmed} not confirmed, {unsafe} where the rig was not held safe")
+
+    ok = not unconfirmed and not unsafe and bool(sent)
+    if ok and _p99(sent) > args.budget_sent:
+        print(f"[FAIL] sent p99 {_p99(sent):.2f} ms is over the {args.budget_sent:.2f} ms budget")
+        ok = False
+    if ok and _p99(confirmed) > args.budget_confirmed:
+        print(f"[FAIL] confirmed p99 {_p99(confirmed):.2f} ms is over the {args.budget_confirmed:.2f} ms budget")
+        ok = False
+    print("[PASS]" if ok else "[FAIL]")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
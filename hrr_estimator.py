@@ -0,0 +1,50 @@
+import numpy as np
+
+from run_analysis import hrr_coefficients
+
+
+class AchievedHRR:
+    """
+    Streaming back-calculation of the heat release rate actually being delivered.
+
+    Each MFC response sample is turned into HRR with the inverse of the recipe
+    conversion (see run_analysis.hrr_coefficients), using a coefficient vector
+    computed once when the recipe is loaded. Total energy released is kept as a
+    running trapezoidal integral, so one update is a dot product and a few
+    floating point operations.
+    """
+
+    def __init__(self):
+        self.coef = np.zeros(0)  # kW per SLPM for each MFC, set from the recipe header
+        self.n_mfcs = 0
+        self.reset()
+
+    def set_recipe(self, heat_comb, density, n_mfcs):
+        """Precompute the per-MFC coefficients from the recipe header rows (MFC i carries gas i)."""
+        n = min(n_mfcs, len(heat_comb), len(density))
+        self.coef = hrr_coefficients(heat_comb[:n], density[:n])
+        self.n_mfcs = n
+
+    def reset(self):
+        """Start a new energy integral, e.g. at the start of a test."""
+        self.energy = 0.0  # kJ released since reset
+        self.last_t = None
+        self.last_hrr = 0.0
+
+    def update(self, t, response_row):
+        """
+        Add one response sample.
+
+        Args:
+            t: sample time [s]
+            response_row: [time, MFC1, MFC2, ...] row as stored in Data_Handler.response_history
+
+        Returns:
+            (hrr [kW], energy released so far [kJ])
+        """
+        hrr = float(np.dot(self.coef, response_row[1:self.n_mfcs + 1])) if self.n_mfcs else 0.0
+        if self.last_t is not None and t > self.last_t:
+            self.energy += 0.5 * (hrr + self.last_hrr) * (t - self.last_t)
+        self.last_t = t
+        self.last_hrr = hrr
+        return hrr, self.energy
@@ -0,0 +1,147 @@
+import time
+
+
+class LinkHealth:
+    """
+    Tracks the health of the Arduino serial link from the seq counter in each packet.
+
+    The firmware sends a uint32 seq with every telemetry line and every ERR frame,
+    and restarts it at 1 whenever STATE changes. From that this object counts
+    duplicates, gaps (lost packets), malformed lines, ERR frames and deliberate
+    resets (a new STATE, or seq 1), and keeps rolling packet-loss, latency and sample-rate statistics.
+    Every update and query is O(1): the rolling window is a fixed-size ring with
+    running sums, so it is cheap enough to call on every packet.
+    """
+
+    SEQ_MODULUS = 2 ** 32  # seq is a uint32_t on the Arduino
+
+    def __init__(self, window=200, loss_limit=0.2, stale_limit=5):
+        self.window = window  # number of received packets in the rolling statistics
+        self.loss_limit = loss_limit  # rolling loss fraction that counts as link loss
+        self.stale_limit = stale_limit  # repeated seqs in a row that count as a frozen link
+        self.reset()
+
+    def reset(self):
+        """Clear all counters, e.g. after a reconnect or a Clear Data press."""
+        # Lifetime counters
+        self.received = 0
+        self.lost = 0  # packets missing from seq gaps
+        self.gaps = 0  # number of gap events
+        self.duplicates = 0
+        self.malformed = 0
+        self.errors = 0  # ERR frames from sendError
+        self.resets = 0  # seq restarts (state change or board reboot)
+        self.last_error = ""
+
+        # Sequence tracking
+        self.expected_seq = None
+        self.last_state = None
+        self.stale_count = 0  # consecutive duplicates
+
+        # Rolling window ring buffers with running sums
+        self._lost_ring = [0] * self.window
+        self._latency_ring = [0.0] * self.window
+        self._timed_ring = [0] * self.window  # 1 if the packet was a command reply with a latency
+        self._time_ring = [0.0] * self.window
+        self._pos = 0
+        self._filled = 0
+        self._lost_sum = 0
+        self._latency_sum = 0.0
+        self._timed_sum = 0
+        self.latency_max = 0.0
+
+    # ---------- Packet events ---------- #
+    def on_packet(self, seq, state=None, t=None, latency=None):
+        """
+        Register one telemetry packet.
+
+        Returns:
+            bool: True if the packet is new and should be stored, False if it is a duplicate or stale.
+        """
+        t = time.monotonic() if t is None else t
+        lost = 0
+
+        if self.expected_seq is None:
+            pass  # first packet, nothing to compare with
+        elif state != self.last_state or (seq == 1 and self.expected_seq != 2):
+            # firmware restarted seq on a state change or reboot. A state change is a reset
+            # at any seq, so losing the seq 1 frame does not make the new state look stale.
+            self.resets += 1
+        else:
+            diff = (seq - self.expected_seq) % self.SEQ_MODULUS
+            if diff >= self.SEQ_MODULUS // 2:
+                # seq went backwards (already seen), a stale or repeated packet
+                self.duplicates += 1
+                self.stale_count += 1
+                return False
+            if diff > 0:
+                lost = diff
+                self.lost += diff
+                self.gaps += 1
+
+        self.stale_count = 0
+        self.expected_seq = (seq + 1) % self.SEQ_MODULUS
+        self.last_state = state
+        self.received += 1
+        self._push(lost, latency, t)
+        return True
+
+    def on_error(self, seq, msg):
+        """Register an ERR frame. The firmware increments seq for these too."""
+        self.errors += 1
+        self.last_error = msg
+        if self.expected_seq is not None:
+            self.expected_seq = (seq + 1) % self.SEQ_MODULUS
+
+    def on_malformed(self):
+        """Register a line that could not be parsed."""
+        self.malformed += 1
+
+    def _push(self, lost, latency, t):
+        i = self._pos
+        if self._filled == self.window:
+            self._lost_sum -= self._lost_ring[i]
+            self._latency_sum -= self._latency_ring[i]
+            self._timed_sum -= self._timed_ring[i]
+        else:
+            self._filled += 1
+        timed = latency is not None  # streamed frames answer no command
+        latency = latency if timed else 0.0
+        self._lost_ring[i] = lost
+        self._latency_ring[i] = latency
+        self._timed_ring[i] = int(timed)
+        self._time_ring[i] = t
+        self._lost_sum += lost
+        self._latency_sum += latency
+        self._timed_sum += timed
+        self.latency_max = max(self.latency_max, latency)
+        self._pos = (i + 1) % self.window
+
+    # ---------- Statistics ---------- #
+    def loss_fraction(self):
+        """Fraction of packets lost over the rolling window."""
+        total = self._filled + self._lost_sum
+        return self._lost_sum / total if total else 0.0
+
+    def mean_latency(self):
+        """Mean command-to-reply latency over the rolling window [s]."""
+        return self._latency_sum / self._timed_sum if self._timed_sum else 0.0
+
+    def sample_rate(self):
+        """Measured packet rate over the rolling window [Hz]."""
+        if self._filled < 2:
+            return 0.0
+        newest = self._time_ring[(self._pos - 1) % self.window]
+        oldest = self._time_ring[self._pos % self.window] if self._filled == self.window else self._time_ring[0]
+        span = newest - oldest
+        return (self._filled - 1) / span if span > 0 else 0.0
+
+    def link_lost(self):
+        """True if the link is frozen (repeating seqs) or losing too many packets."""
+        return self.stale_count >= self.stale_limit or self.loss_fraction() > self.loss_limit
+
+    def summary(self):
+        return (f"rx {self.received}, lost {self.lost} in {self.gaps} gaps, dup {self.duplicates}, "
+                f"malformed {self.malformed}, ERR {self.errors}, resets {self.resets}, "
+                f"loss {100 * self.loss_fraction():.1f}%, latency {1000 * self.mean_latency():.1f} ms, "
+                f"rate {self.sample_rate():.1f} Hz")
@@ -0,0 +1,134 @@
+"""
+Live estimate of the gas mixture in the mixing chamber and its flammability margin.
+
+The chamber is modelled as one well-mixed volume, filled with air at the start,
+fed by the MFCs (MFC i carries recipe gas i, as for the HRR) and vented at the
+chamber composition. With n the moles in the chamber (from the chamber pressure,
+the gas temperature and the volume), n_in the molar inflow and y_in its
+composition, the mole fractions x follow
+
+    dx/dt = n_in / n * (y_in - x)
+
+Flows are held between samples, so each sample advances x with the exact
+solution of that step, x = y_in + (x - y_in) * exp(-n_in * dt / n), which stays
+stable for any sample spacing. The MFC to species matrix and the flammability
+weights are built once when a recipe is loaded, so an update is a few numpy
+operations on one short vector.
+
+The mixture's flammability limits in air come from Le Chatelier's rule on the
+fuel species. The margin is how far the chamber's fuel fraction is outside the
+flammable range [vol %]: LFL - fuel below it, fuel - UFL above it, negative
+inside it.
+"""
+import math
+import numpy as np
+
+# Flammability limits in air [vol %] and minimum oxygen concentration [vol % O2] of recipe gases
+FUEL_PROPERTIES = {
+    "H2":   {"LFL": 4.0,  "UFL": 75.0, "MOC": 5.0},
+    "CH4":  {"LFL": 5.0,  "UFL": 15.0, "MOC": 12.0},
+    "CO":   {"LFL": 12.5, "UFL": 74.0, "MOC": 5.5},
+    "C2H4": {"LFL": 2.7,  "UFL": 36.0, "MOC": 10.0},
+    "C2H6": {"LFL": 3.0,  "UFL": 12.4, "MOC": 11.0},
+    "C3H8": {"LFL": 2.1,  "UFL": 9.5,  "MOC": 11.5},
+}
+OXIDIZERS = ("O2",)
+
+SPECIES = ("H2", "CO", "CO2", "CH4", "O2", "N2") # always tracked, recipe gases not listed are added
+AIR = {"O2": 0.2095, "N2": 0.7905}
+MOLAR_VOLUME = 22.414 # L/mol at the MFCs' standard conditions (0 C, 1 atm)
+GAS_CONSTANT = 8.314 # J/(mol K)
+PA_PER_PSI = 6894.757
+AMBIENT_PSI = 14.696
+
+
+def le_chatelier(fractions, limits):
+    """
+    Mixture flammability limit from Le Chatelier's rule.
+
+    Args:
+        fractions: (... x fuels) array of fuel fractions, any scale (normalised per row here)
+        limits: per-fuel limit [vol %]
+
+    Returns:
+        mixture limit [vol %] per row, NaN for rows without fuel.
+    """
+    total = fractions.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return total / (fractions / np.asarray(limits, dtype=float)).sum(axis=-1)
+
+
+class ChamberMixture:
+    """
+    Streaming composition of the mixing chamber.
+
+    Args:
+        volume: chamber volume [L]
+    """
+
+    def __init__(self, volume=20.0):
+        self.volume = volume
+        self.species, self.x = [], np.zeros(0)
+        self.set_recipe([], 0)
+
+    def set_recipe(self, gas_names, n_mfcs):
+        """Precompute the MFC to species matrix and the fuel weights for the recipe's gas columns (MFC i carries gas i)."""
+        names = [str(n).strip().upper() for n in gas_names][:n_mfcs]
+        old = dict(zip(self.species, self.x)) if self.species else AIR # the chamber keeps what it holds
+        self.species = list(dict.fromkeys([*SPECIES, *names]))
+        self.n_mfcs = len(names)
+        self.inflow = np.zeros((self.n_mfcs, len(self.species))) # mol/s of each species per SLPM of each MFC
+        for i, name in enumerate(names):
+            self.inflow[i, self.species.index(name)] = 1 / (60 * MOLAR_VOLUME)
+        fuel = [FUEL_PROPERTIES.get(s) for s in self.species]
+        self.is_fuel = np.array([p is not None for p in fuel], dtype=float)
+        self.inv_lfl = np.array([1 / p["LFL"] if p else 0.0 for p in fuel])
+        self.inv_ufl = np.array([1 / p["UFL"] if p else 0.0 for p in fuel])
+        self.x = np.array([old.get(s, 0.0) for s in self.species])
+        self.last_t = None
+
+    def reset(self):
+        """Chamber full of air."""
+        self.x = np.array([AIR.get(s, 0.0) for s in self.species])
+        self.last_t = None
+
+    def update(self, t, response_row, pressure=AMBIENT_PSI, temperature=20.0):
+        """
+        Advance the chamber to one response sample.
+
+        Args:
+            t: sample time [s]
+            response_row: [time, MFC1, MFC2, ...] row as stored in Data_Handler.response_history [SLPM]
+            pressure: chamber pressure [psi absolute]
+            temperature: gas temperature [C]
+
+        Returns:
+            (chamber fuel [vol %], flammability margin [vol %], nan without fuel)
+        """
+        if self.last_t is not None and t > self.last_t and self.n_mfcs:
+            inflow = np.maximum(response_row[1:self.n_mfcs + 1], 0.0) @ self.inflow
+            total = inflow.sum()
+            if total > 0:
+                if not pressure > 0: # no reading yet
+                    pressure = AMBIENT_PSI
+                if not math.isfinite(temperature):
+                    temperature = 20.0
+                moles = pressure * PA_PER_PSI * self.volume * 1e-3 / (GAS_CONSTANT * (temperature + 273.15))
+                feed = inflow / total
+                self.x = feed + (self.x - feed) * math.exp(-total * (t - self.last_t) / moles)
+        self.last_t = t
+        return self.margin()
+
+    def margin(self):
+        """(chamber fuel [vol %], flammability margin [vol %]) of the current composition."""
+        fuel = float(self.x @ self.is_fuel)
+        if not fuel > 0:
+            return 0.0, math.nan
+        lfl = fuel / float(self.x @ self.inv_lfl) # Le Chatelier, the fuel fractions need no normalising
+        ufl = fuel / float(self.x @ self.inv_ufl)
+        fuel *= 100
+        if fuel < lfl:
+            return fuel, lfl - fuel
+        if fuel > ufl:
+            return fuel, fuel - ufl
+        return fuel, -min(fuel - lfl, ufl - fuel) # inside, how far in
@@ -0,0 +1,99 @@
+"""
+Short horizon extrapolation of the pressures, for the predictive over-pressure trip.
+
+Each watched channel gets a quadratic fitted by exponentially weighted least
+squares to its recent samples (time constant window seconds), giving the value,
+slope and curvature at the newest sample. The weighted sums of u^0..u^4 and
+x * u^0..u^2, u being time relative to the newest sample, are updated in
+constant time per sample: decayed, moved to the new sample's time with a
+binomial shift and the sample added at u = 0. Nothing is kept per sample and
+the sums stay centered on the present, so they keep their precision over a
+long session. The channels share the time sums and are fitted with one 3x3
+solve. Until its samples span one window the fit reports nan: a quadratic
+through the first few samples, two of them maybe milliseconds apart, would
+extrapolate the noise.
+"""
+import math
+import numpy as np
+
+_CHOOSE = np.array([[math.comb(k, j) for j in range(5)] for k in range(5)], dtype=float) # 0 above the diagonal
+_STEPS = np.maximum(np.arange(5)[:, None] - np.arange(5), 0)
+
+
+def time_to_limit(value, slope, curvature, limit):
+    """
+    Seconds until value + slope * t + curvature * t^2 / 2 reaches limit.
+
+    0 if it is already there, inf if the trend does not reach it (falling, or
+    turning back first) or is unknown (nan).
+    """
+    gap = limit - value
+    if not gap > 0:
+        return 0.0 if gap <= 0 else math.inf
+    a, b = curvature / 2, slope
+    if not abs(a) > 1e-12: # straight line, or no curvature known
+        return gap / b if b > 0 else math.inf
+    disc = b * b + 4 * a * gap
+    if disc < 0:
+        return math.inf
+    roots = ((-b + math.sqrt(disc)) / (2 * a), (-b - math.sqrt(disc)) / (2 * a))
+    return min((r for r in roots if r > 0), default=math.inf)
+
+
+class QuadraticTrend:
+    """
+    Running quadratic fit of a few channels sampled together.
+
+    Args:
+        channels: number of values in each sample
+        window: time constant of the weights [s]
+    """
+
+    def __init__(self, channels, window=1.0):
+        self.channels = channels
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.t = None # newest sample time [s]
+        self.first = None # time of the first sample since the fit (re)started [s]
+        self.s = np.zeros(5) # sum of w * u^k
+        self.y = np.zeros((3, self.channels)) # sum of w * x * u^k
+        self.coef = np.full((3, self.channels), np.nan) # x = c0 + c1 * u + c2 * u^2 around the newest sample
+
+    def update(self, t, values):
+        """Add one sample [s]. Samples older than the newest are ignored."""
+        if self.t is not None:
+            dt = t - self.t
+            if dt <= 0:
+                return
+            if dt > 5 * self.window: # nothing left of the old samples' weight
+                self.reset()
+        if self.t is not None:
+            # The old sums re-centered on the new sample: sum w * (u - dt)^k from the sums of w * u^j
+            shift = _CHOOSE * (-dt) ** _STEPS
+            decay = math.exp(-dt / self.window)
+            self.s = decay * (shift @ self.s)
+            self.y = decay * (shift[:3, :3] @ self.y)
+        if self.first is None:
+            self.first = t
+        self.t = t
+        self.s[0] += 1
+        self.y[0] += values
+        if t - self.first >= self.window:
+            s = self.s
+            try:
+                self.coef = np.linalg.solve([[s[0], s[1], s[2]], [s[1], s[2], s[3]], [s[2], s[3], s[4]]], self.y)
+            except np.linalg.LinAlgError: # a single sample so far
+                pass
+
+    def value(self):
+        return self.coef[0]
+
+    def slope(self):
+        """dX/dt at the newest sample [units/s]."""
+        return self.coef[1]
+
+    def curvature(self):
+        """d2X/dt2 at the newest sample [units/s^2]."""
+        return 2 * self.coef[2]
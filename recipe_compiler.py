@@ -0,0 +1,239 @@
+"""
+Test recipe conversion shared by the GUI and the batch compiler.
+
+Run from the command line to compile a folder of recipes without the GUI:
+
+    python recipe_compiler.py Recipes/ -o Compiled/
+    python recipe_compiler.py "Campaign_*/*.xlsx" --workers 8
+
+Each recipe gets a compiled plan (.csv), a validation report (.txt) and a
+summary plot (.png) in the output folder. The exit code is 1 if any recipe
+failed to compile or failed validation.
+"""
+import argparse
+import glob
+import os
+import sys
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import recipe_optimizer
+import recipe_validation
+from channel_map import ChannelMap, CHANNEL_MAP_PATH
+
+HEADER_ROWS = 4 # titles, gas names, heat of combustion, density
+RECIPE_PATTERNS = ("*.xlsx", "*.xls")
+
+
+class CompiledRecipe:
+    """A converted recipe: plan rows [time, gas1..gasN SLPM, HRR] plus the header data and its validation."""
+
+    def __init__(self, plan, gas_names, heat_comb, density, validation, full_rows=0):
+        self.plan = plan # list of rows, reduced to breakpoints
+        self.gas_names = gas_names
+        self.heat_comb = heat_comb # kJ/kg per gas
+        self.density = density # g/L at STP per gas
+        self.validation = validation # RecipeValidation
+        self.full_rows = full_rows # rows before reduction
+
+
+def locate_columns(titles):
+    """
+    Find the gas and HRR columns from the title row.
+
+    Gas columns run from column 1 up to the "Heat Release Rate (kW)" column, anything
+    after it (e.g. precomputed SLPM columns) is ignored. Falls back to the original
+    6 gas layout with HRR in column 7 if the HRR title is missing.
+    """
+    for c, title in enumerate(titles):
+        if c > 1 and str(title).strip() == recipe_validation.HRR_TITLE:
+            return list(range(1, c)), c
+    return list(range(1, 7)), 7
+
+
+def densify(t, values, resolution):
+    """Linearly interpolate plan rows onto a resolution step inside every recipe interval (the original rows are kept)."""
+    if len(t) < 2:
+        return t, values
+    grid = np.concatenate([np.arange(t0, t1, resolution) for t0, t1 in zip(t[:-1], t[1:])] + [t[-1:]])
+    return grid, np.column_stack([np.interp(grid, t, v) for v in values.T])
+
+
+def parse_sheet(data):
+    """
+    Check a raw recipe sheet and pull out its arrays.
+
+    Returns:
+        (report, recipe) where recipe is a dict with "t", "fractions" (rows x gases), "hrr",
+        "heat_comb", "density" and "gas_names", or only "gas_names" if the sheet failed its checks.
+    """
+    gas_columns, hrr_column = locate_columns(data[0]) if len(data) else (list(range(1, 7)), 7)
+    report = recipe_validation.check_sheet(data, gas_columns=gas_columns, hrr_column=hrr_column)
+    if not report.ok:
+        return report, {"gas_names": [data[0][c] for c in gas_columns] if len(data) else []}
+    rows = data[HEADER_ROWS:]
+    return report, {
+        "t": rows[:, 0].astype(float),
+        "fractions": rows[:, gas_columns].astype(float),
+        "hrr": rows[:, hrr_column].astype(float),
+        "heat_comb": data[2, gas_columns].astype(float),
+        "density": data[3, gas_columns].astype(float),
+        "gas_names": [data[0][c] for c in gas_columns],
+    }
+
+
+def fractions_to_flows(fractions, hrr, heat_comb, density):
+    """
+    Gas flows [SLPM] from HRR fractions: SLPM = fraction * HRR / heat_comb * 60000 / density.
+
+    Broadcasts over any leading dimensions, with gases on the last axis and hrr
+    shaped like fractions without it. Gases with no heat of combustion get 0.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(heat_comb == 0, 0.0, fractions * (hrr[..., None] / heat_comb) * 60000 / density)
+
+
+def compile_sheet(data, channels, n_mfcs=None, resolution=0.1, reduce=True):
+    """
+    Convert a raw recipe sheet into a test plan, validating it on the way.
+
+    The plan is densified to the given resolution, checked against the MFCs,
+    then reduced to breakpoints.
+
+    Args:
+        data: pd.read_excel(path, header=None).to_numpy()
+        channels: ChannelMap of the rig
+        n_mfcs: MFCs in use, defaults to all of them
+    """
+    report, recipe = parse_sheet(data)
+    gas_names = recipe["gas_names"]
+    if not report.ok:
+        return CompiledRecipe([], gas_names, [], [], report)
+
+    hrr = recipe["hrr"]
+    flows = fractions_to_flows(recipe["fractions"], hrr, recipe["heat_comb"], recipe["density"])
+    t, values = densify(recipe["t"], np.column_stack([flows, hrr]), resolution)
+    plan = np.column_stack([t, values])
+    recipe_validation.check_plan(plan, channels, gas_names, n_mfcs=n_mfcs, report=report)
+
+    full_rows = len(plan)
+    if reduce:
+        plan = reduce_compiled(plan, channels)
+    else:
+        plan = plan.tolist()
+    return CompiledRecipe(plan, gas_names, recipe["heat_comb"].tolist(), recipe["density"].tolist(), report, full_rows)
+
+
+def reduce_compiled(plan, channels):
+    """Reduce a dense [time, gas1..gasN, HRR] plan to breakpoints within MFC accuracy (and 0.5 % of peak HRR)."""
+    tolerances = recipe_optimizer.flow_tolerances(channels, plan.shape[1] - 2)
+    hrr_tolerance = 0.005 * np.abs(plan[:, -1]).max() or 1.0
+    return recipe_optimizer.reduce_plan(plan, [*tolerances, hrr_tolerance])
+
+
+def load_recipe(path, channels, n_mfcs=None, resolution=0.1, reduce=True):
+    """Read and compile one recipe file."""
+    data = pd.read_excel(path, header=None).to_numpy()
+    return compile_sheet(data, channels, n_mfcs, resolution, reduce)
+
+
+# ---------- Batch compiler ---------- #
+def find_recipes(inputs):
+    """Expand folders and glob patterns into a sorted list of recipe files."""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for pattern in RECIPE_PATTERNS:
+                paths.update(glob.glob(os.path.join(item, pattern)))
+        else:
+            paths.update(p for p in glob.glob(item) if os.path.isfile(p))
+    # Skip Excel lock files
+    return sorted(p for p in paths if not os.path.basename(p).startswith("~$"))
+
+
+def plot_recipe(compiled, title, path):
+    """Save the flows and HRR of a compiled recipe as a PNG (Agg canvas, no window)."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(8, 4))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    plan = np.asarray(compiled.plan, dtype=float)
+    for i, name in enumerate(compiled.gas_names, start=1):
+        ax.plot(plan[:, 0], plan[:, i], label=str(name))
+    ax.set_title(title)
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel("Flow Rate (SLPM)")
+    ax2 = ax.twinx()
+    ax2.plot(plan[:, 0], plan[:, -1], color="orange", label="Heat Release Rate")
+    ax2.set_ylabel("Heat Release Rate (kW)")
+    for a, b, _, _ in compiled.validation.flammable_windows:
+        ax.axvspan(a, b, color="red", alpha=0.1)
+    lines1, labels1 = ax.get_legend_handles_labels()
+    lines2, labels2 = ax2.get_legend_handles_labels()
+    ax2.legend(lines1 + lines2, labels1 + labels2, loc="upper right", fontsize=6, frameon=False)
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+
+
+def compile_file(path, out_dir, resolution=0.1, n_mfcs=None, channel_map_path=CHANNEL_MAP_PATH, plot=True):
+    """
+    Worker for one recipe: compile it and write the plan, validation report and plot.
+
+    Returns:
+        (path, passed, one line summary)
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    compiled = load_recipe(path, ChannelMap.load(channel_map_path), n_mfcs, resolution)
+    report = compiled.validation
+
+    with open(os.path.join(out_dir, f"{name}_validation.txt"), "w", encoding="utf-8") as f:
+        f.write(f"Recipe: {path}\n{report.format()}\n")
+    if compiled.plan:
+        columns = ["Time (s)", *[f"{g} (SLPM)" for g in compiled.gas_names], recipe_validation.HRR_TITLE]
+        pd.DataFrame(compiled.plan, columns=columns).to_csv(os.path.join(out_dir, f"{name}_plan.csv"), index=False)
+        if plot:
+            plot_recipe(compiled, name, os.path.join(out_dir, f"{name}.png"))
+
+    summary = (f"{len(compiled.plan)} breakpoints from {compiled.full_rows} rows, "
+               f"{len(report.errors)} error(s), {len(report.warnings)} warning(s)")
+    return path, report.ok, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile test recipes into MFC test plans without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="recipe files, folders or glob patterns")
+    parser.add_argument("-o", "--output", default="Compiled_Recipes", help="output folder (default: Compiled_Recipes)")
+    parser.add_argument("-r", "--resolution", type=float, default=0.1, help="interpolation step in seconds (default: 0.1)")
+    parser.add_argument("-n", "--num-mfcs", type=int, default=None, help="MFCs in use (default: all in the channel map)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--channel-map", default=CHANNEL_MAP_PATH, help="channel map of the rig")
+    parser.add_argument("--no-plots", action="store_true", help="skip the summary PNGs")
+    args = parser.parse_args(argv)
+
+    paths = find_recipes(args.inputs)
+    if not paths:
+        print("[ERROR] No recipe files found.", file=sys.stderr)
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(compile_file, p, args.output, args.resolution, args.num_mfcs,
+                               args.channel_map, not args.no_plots): p for p in paths}
+        for future in as_completed(futures):
+            try:
+                path, passed, summary = future.result()
+            except Exception as e:
+                path, passed, summary = futures[future], False, f"could not compile: {e}"
+            failures += not passed
+            print(f"[{'PASS' if passed else 'FAIL'}] {path}: {summary}")
+
+    print(f"{len(paths) - failures}/{len(paths)} recipes passed, output in {args.output}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import numpy as np
+
+EXACT_TOLERANCE = 1e-9 # stands in for a tolerance of 0, float round-off of the interpolation
+
+
+def flow_tolerances(channels, n_columns):
+    """
+    Per-column SLPM tolerance for plan reduction, from MFC accuracy in the channel map.
+
+    Half the MFC's accuracy band (accuracy is a fraction of full scale), so the
+    reduced plan is indistinguishable from the full one at the MFC. An MFC with
+    no full_scale uses its max limit instead. Gas columns without an MFC, or
+    with neither, use the tightest tolerance of the rig.
+    """
+    tols = []
+    for c in channels.mfcs:
+        span = c.full_scale if c.full_scale is not None else (c.limits[3] if c.limits else None)
+        tols.append(None if span is None else 0.5 * c.extra.get("accuracy", 0.01) * span)
+    known = [tol for tol in tols if tol is not None]
+    tightest = min(known) if known else 1.0
+    return np.array([tols[i] if i < len(tols) and tols[i] is not None else tightest for i in range(n_columns)])
+
+
+def reduce_plan(plan, tolerances, columns=None):
+    """
+    Ramer-Douglas-Peucker reduction of a test plan, run jointly across columns.
+
+    A row is kept only if dropping it would move some column further than its
+    tolerance from the straight line between the neighbouring kept rows. The
+    deviation of every row in a span is computed in one vectorised pass, scaled
+    by each column's tolerance so all columns are judged together.
+
+    Args:
+        plan: rows of [time, col1, col2, ...] (UI.test_plan layout)
+        tolerances: max deviation allowed for each checked column, same units as the plan.
+            A tolerance of 0 keeps every row that column needs to be reproduced exactly
+            (e.g. an MFC with accuracy 0 in the channel map), the other columns are still reduced
+        columns: plan columns to check, defaults to 1..len(tolerances)
+
+    Returns:
+        list of the kept rows, first and last row always included.
+
+    Raises:
+        ValueError: for a negative or NaN tolerance.
+    """
+    tolerances = np.asarray(tolerances, dtype=float)
+    if not (tolerances >= 0).all():
+        raise ValueError(f"Plan reduction tolerances must be 0 or more, got {tolerances.tolist()}")
+    rows = np.asarray(plan, dtype=float)
+    if len(rows) < 3:
+        return rows.tolist()
+    if columns is None:
+        columns = list(range(1, len(tolerances) + 1))
+    t = rows[:, 0]
+    y = rows[:, columns] / np.where(tolerances > 0, tolerances, EXACT_TOLERANCE)  # in units of tolerance
+
+    keep = np.zeros(len(rows), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(rows) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        alpha = ((t[i + 1:j] - t[i]) / (t[j] - t[i]))[:, None]
+        line = y[i] + alpha * (y[j] - y[i])
+        dev = np.abs(y[i + 1:j] - line).max(axis=1)
+        k = int(np.argmax(dev))
+        if dev[k] > 1.0:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+
+    return rows[keep].tolist()
+
+
+def interpolate_plan(plan_t, plan_values, t):
+    """Values of a reduced plan at time t, one per column of plan_values."""
+    return [float(np.interp(t, plan_t, plan_values[:, i])) for i in range(plan_values.shape[1])]
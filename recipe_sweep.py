@@ -0,0 +1,212 @@
+"""
+Parameter sweeps of a base test recipe, compiled in bulk into one archive.
+
+Every combination of HRR scale factor, per-gas HRR fraction override and time
+stretch becomes one variant. Load the .npz archive with TEST RECIPE LOAD to
+pick between the variants without recompiling:
+
+    python recipe_sweep.py Example_Test_Recipe.xlsx --hrr-scale 0.5 1 1.5 --gas H2=0.2,0.3 --time-stretch 1 2 -o sweep.npz
+"""
+import argparse
+import itertools
+import json
+import sys
+import numpy as np
+import pandas as pd
+
+import recipe_compiler
+import recipe_validation
+from channel_map import ChannelMap, CHANNEL_MAP_PATH
+
+
+def variant_grid(hrr_scales=(1.0,), gas_overrides=None, time_stretches=(1.0,)):
+    """
+    Cartesian product of the sweep parameters.
+
+    Args:
+        hrr_scales: factors applied to the recipe HRR curve
+        gas_overrides: {gas name: [HRR fractions]}, each fraction replaces that gas's
+            fraction at every time step (None in the list keeps the recipe value)
+        time_stretches: factors applied to the recipe time axis
+
+    Returns:
+        (names, params): parameter names and a (variants x parameters) float array,
+        NaN where a gas keeps its recipe fraction.
+    """
+    gas_overrides = gas_overrides or {}
+    names = ["HRR Scale", *gas_overrides, "Time Stretch"]
+    axes = [list(hrr_scales), *[list(v) for v in gas_overrides.values()], list(time_stretches)]
+    params = np.array([[np.nan if v is None else v for v in combo] for combo in itertools.product(*axes)], dtype=float)
+    return names, params.reshape(-1, len(names))
+
+
+def variant_label(names, row):
+    """Short operator-facing name of one variant, e.g. 'HRR x1.5, H2=0.30, time x2'."""
+    parts = [f"HRR x{row[0]:g}"]
+    parts += [f"{n}={v:.2f}" for n, v in zip(names[1:-1], row[1:-1]) if not np.isnan(v)]
+    parts.append(f"time x{row[-1]:g}")
+    return ", ".join(parts)
+
+
+def build_sweep(recipe, channels, names, params, n_mfcs=None, resolution=0.1):
+    """
+    Compile every variant of a parsed recipe (recipe_compiler.parse_sheet) in one broadcast.
+
+    Fractions, HRR and flows are built as (variant x time x gas) arrays and the
+    feasibility rules of recipe_validation run over the whole block at once, one
+    block per time stretch (the stretched time axis is densified, so each stretch
+    has its own). Each variant is then reduced to breakpoints and given its own
+    validation report, which includes the duration cap on its stretched times.
+
+    Returns:
+        list of CompiledRecipe, one per row of params.
+    """
+    n_mfcs = channels.n_mfcs if n_mfcs is None else min(n_mfcs, channels.n_mfcs)
+    gas_names = recipe["gas_names"]
+    t, base_fractions, base_hrr = recipe["t"], recipe["fractions"], recipe["hrr"]
+    scale, stretch = params[:, 0], params[:, -1]
+    overrides = np.full((len(params), len(gas_names)), np.nan)
+    for j, gas in enumerate(names[1:-1]):
+        overrides[:, gas_names.index(gas)] = params[:, 1 + j]
+
+    # Fractions: overridden gases fixed, the others rescaled to fill what is left (variant x row x gas)
+    fixed = ~np.isnan(overrides)
+    remaining = 1.0 - np.where(fixed, overrides, 0.0).sum(axis=1)
+    free_total = base_fractions @ (~fixed).T # row x variant
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor = np.where(free_total > 0, remaining / free_total, 0.0).T
+    fractions = np.where(fixed[:, None, :], overrides[:, None, :], base_fractions[None] * factor[..., None])
+    hrr = scale[:, None] * base_hrr[None]
+    rows = np.concatenate([recipe_compiler.fractions_to_flows(fractions, hrr, recipe["heat_comb"], recipe["density"]),
+                           hrr[..., None]], axis=-1)
+
+    off_total = np.abs(fractions.sum(axis=-1) - 1.0) > 0.01 # (variant x recipe row), same rule as check_sheet
+    compiled = [None] * len(params)
+    for time_factor in np.unique(stretch):
+        # Stretch first, then densify, so a stretched plan keeps the resolution step. Variants with the same
+        # stretch share the time axis and the interpolation weights
+        group = np.flatnonzero(stretch == time_factor)
+        t_stretched = time_factor * t
+        grid, _ = recipe_compiler.densify(t_stretched, t_stretched[:, None], resolution)
+        idx = np.clip(np.searchsorted(t_stretched, grid, side="right") - 1, 0, max(len(t) - 2, 0))
+        if len(t) > 1:
+            alpha = ((grid - t_stretched[idx]) / (t_stretched[idx + 1] - t_stretched[idx]))[None, :, None]
+            dense = rows[group][:, idx] * (1 - alpha) + rows[group][:, idx + 1] * alpha
+        else:
+            dense = rows[group]
+        flows = dense[..., :-1]
+        masks = recipe_validation.plan_violations(grid, flows, channels, n_mfcs)
+        flammable, lfl, ufl = recipe_validation.flammability(flows, gas_names)
+
+        for g, v in enumerate(group):
+            report = recipe_validation.RecipeValidation()
+            if grid[-1] > recipe_validation.MAX_TEST_DURATION: # check_sheet only saw the unstretched times
+                report.add("error", "Time", f"Stretched recipe runs to {grid[-1]:.0f} s, longer than the "
+                                            f"{recipe_validation.MAX_TEST_DURATION} s limit.")
+            if remaining[v] < 0:
+                report.add("error", "Composition", "Gas overrides add up to more than 1.")
+            elif off_total[v].any():
+                report.add("warning", "Composition", "Gas fractions do not add up to 1.", t_stretched, off_total[v])
+            one = {k: m[g] for k, m in masks.items()}
+            one["flammable"], one["lfl"], one["ufl"] = (None, None, None) if flammable is None else (flammable[g], lfl[g], ufl[g])
+            recipe_validation.report_violations(report, grid, flows[g], one, channels, gas_names, n_mfcs)
+            plan = np.column_stack([grid, dense[g]])
+            compiled[v] = recipe_compiler.CompiledRecipe(
+                recipe_compiler.reduce_compiled(plan, channels), gas_names,
+                recipe["heat_comb"].tolist(), recipe["density"].tolist(), report, len(plan))
+    return compiled
+
+
+def save_sweep(path, compiled, names, params, n_mfcs):
+    """Store a compiled sweep as one indexed .npz archive: all plans stacked, with row offsets per variant."""
+    plans = [np.asarray(c.plan, dtype=float) for c in compiled]
+    offsets = np.cumsum([0] + [len(p) for p in plans])
+    first = compiled[0]
+    np.savez_compressed(
+        path,
+        plans=np.concatenate(plans),
+        offsets=offsets,
+        params=params,
+        param_names=np.array(names),
+        labels=np.array([variant_label(names, row) for row in params]),
+        feasible=np.array([c.validation.ok for c in compiled]),
+        reports=np.array([json.dumps(c.validation.to_dict()) for c in compiled]),
+        gas_names=np.array([str(g) for g in first.gas_names]),
+        heat_comb=np.array(first.heat_comb, dtype=float),
+        density=np.array(first.density, dtype=float),
+        n_mfcs=np.array(n_mfcs),
+    )
+
+
+class SweepArchive:
+    """A compiled sweep loaded into memory, any variant can be pulled out without recompiling."""
+
+    def __init__(self, path):
+        with np.load(path, allow_pickle=False) as f:
+            self.plans = f["plans"]
+            self.offsets = f["offsets"]
+            self.params = f["params"]
+            self.param_names = f["param_names"].tolist()
+            self.labels = f["labels"].tolist()
+            self.feasible = f["feasible"]
+            self.reports = f["reports"].tolist()
+            self.gas_names = f["gas_names"].tolist()
+            self.heat_comb = f["heat_comb"].tolist()
+            self.density = f["density"].tolist()
+            self.n_mfcs = int(f["n_mfcs"])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def variant(self, i):
+        """The compiled recipe of variant i."""
+        plan = self.plans[self.offsets[i]:self.offsets[i + 1]].tolist()
+        report = recipe_validation.RecipeValidation.from_dict(json.loads(self.reports[i]))
+        return recipe_compiler.CompiledRecipe(plan, self.gas_names, self.heat_comb, self.density, report, len(plan))
+
+
+def parse_gas_override(text):
+    """'H2=0.2,0.3' -> ('H2', [0.2, 0.3]), 'recipe' keeps the recipe fraction."""
+    gas, _, values = text.partition("=")
+    if not values:
+        raise argparse.ArgumentTypeError(f"Expected GAS=fraction[,fraction...], got '{text}'")
+    return gas.strip(), [None if v.strip().lower() == "recipe" else float(v) for v in values.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile every combination of a recipe's sweep parameters into one archive.")
+    parser.add_argument("recipe", help="base recipe (.xlsx)")
+    parser.add_argument("--hrr-scale", type=float, nargs="+", default=[1.0], help="HRR scale factors")
+    parser.add_argument("--gas", type=parse_gas_override, action="append", default=[],
+                        help="override one gas's HRR fraction, e.g. H2=0.2,0.3,recipe (repeatable)")
+    parser.add_argument("--time-stretch", type=float, nargs="+", default=[1.0], help="time axis scale factors")
+    parser.add_argument("-o", "--output", default="recipe_sweep.npz", help="archive to write")
+    parser.add_argument("-r", "--resolution", type=float, default=0.1, help="interpolation step in seconds (default: 0.1)")
+    parser.add_argument("-n", "--num-mfcs", type=int, default=None, help="MFCs in use (default: all in the channel map)")
+    parser.add_argument("--channel-map", default=CHANNEL_MAP_PATH, help="channel map of the rig")
+    args = parser.parse_args(argv)
+
+    channels = ChannelMap.load(args.channel_map)
+    report, recipe = recipe_compiler.parse_sheet(pd.read_excel(args.recipe, header=None).to_numpy())
+    if not report.ok:
+        print(report.format(), file=sys.stderr)
+        return 1
+    overrides = dict(args.gas)
+    unknown = [g for g in overrides if g not in recipe["gas_names"]]
+    if unknown:
+        print(f"[ERROR] Gases not in the recipe: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+
+    n_mfcs = channels.n_mfcs if args.num_mfcs is None else args.num_mfcs
+    names, params = variant_grid(args.hrr_scale, overrides, args.time_stretch)
+    compiled = build_sweep(recipe, channels, names, params, n_mfcs, args.resolution)
+    save_sweep(args.output, compiled, names, params, n_mfcs)
+
+    for row, c in zip(params, compiled):
+        print(f"[{'PASS' if c.validation.ok else 'FAIL'}] {variant_label(names, row)}: {len(c.plan)} breakpoints")
+    print(f"{sum(c.validation.ok for c in compiled)}/{len(compiled)} variants feasible, saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+import numpy as np
+import pandas as pd
+
+from mixture_model import FUEL_PROPERTIES, OXIDIZERS, le_chatelier # shared with the live chamber estimate
+
+MAX_TEST_DURATION = 3600 # s, longest test a recipe may describe
+TIME_TITLE = "Time (s)"
+HRR_TITLE = "Heat Release Rate (kW)"
+
+
+def row_ranges(mask):
+    """Contiguous runs of True in a boolean array, as (first_row, last_row) pairs."""
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+class RecipeValidation:
+    """
+    Result of the pre-flight checks on one recipe.
+
+    Errors make the recipe unsafe or impossible to run and block START TEST.
+    Warnings are shown to the operator but do not block. Each entry records the
+    rule, a message and the time ranges [s] of the plan rows it applies to.
+    """
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+        self.flammable_windows = [] # [(t_start, t_end, mixture LFL %, mixture UFL %)]
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def add(self, level, rule, message, t=None, mask=None):
+        """Record a failed rule, with the plan times of the flagged rows if a row mask is given."""
+        windows = []
+        if mask is not None and t is not None:
+            windows = [(float(t[a]), float(t[b])) for a, b in row_ranges(mask)]
+        entry = {"rule": rule, "message": message, "windows": windows}
+        (self.errors if level == "error" else self.warnings).append(entry)
+
+    def to_dict(self):
+        """Plain dict of the report, for saving alongside compiled plans."""
+        return {"errors": self.errors, "warnings": self.warnings, "flammable_windows": self.flammable_windows}
+
+    @classmethod
+    def from_dict(cls, d):
+        report = cls()
+        report.errors = d.get("errors", [])
+        report.warnings = d.get("warnings", [])
+        report.flammable_windows = [tuple(w) for w in d.get("flammable_windows", [])]
+        return report
+
+    def format(self):
+        """Plain text report for the terminal or a report file."""
+        lines = [f"Recipe validation {'PASSED' if self.ok else 'FAILED'}: "
+                 f"{len(self.errors)} error(s), {len(self.warnings)} warning(s)"]
+        for level, entries in (("ERROR", self.errors), ("WARNING", self.warnings)):
+            for e in entries:
+                where = ""
+                if e["windows"]:
+                    shown = ", ".join(f"{a:.1f}-{b:.1f} s" for a, b in e["windows"][:5])
+                    more = f" (+{len(e['windows']) - 5} more)" if len(e["windows"]) > 5 else ""
+                    where = f" at {shown}{more}"
+                lines.append(f"[{level}] {e['rule']}: {e['message']}{where}")
+        for a, b, lfl, ufl in self.flammable_windows:
+            lines.append(f"[FLAMMABLE] {a:.1f}-{b:.1f} s, mixture LFL {lfl:.1f} %, UFL {ufl:.1f} %")
+        return "\n".join(lines)
+
+
+def check_sheet(data, report=None, gas_columns=range(1, 7), hrr_column=7, max_duration=MAX_TEST_DURATION):
+    """
+    Structural checks on the raw recipe sheet (pd.read_excel(..., header=None).to_numpy()).
+
+    Row 0 holds the titles, rows 2 and 3 the heat of combustion and density of each
+    gas, and the plan starts at row 4 with time in column 0. Run this before
+    converting the sheet, the conversion assumes it passed.
+    """
+    report = RecipeValidation() if report is None else report
+    gas_columns = list(gas_columns)
+    if data.ndim != 2 or data.shape[0] < 5 or data.shape[1] <= max(hrr_column, *gas_columns):
+        report.add("error", "Layout", f"Expected title and header rows plus at least one plan row over {max(hrr_column, *gas_columns) + 1} columns.")
+        return report
+
+    # ---- 1. Column titles ----
+    titles = data[0]
+    if str(titles[0]).strip() != TIME_TITLE:
+        report.add("error", "Column Titles", f"Column 0 is '{titles[0]}', expected '{TIME_TITLE}'.")
+    if str(titles[hrr_column]).strip() != HRR_TITLE:
+        report.add("error", "Column Titles", f"Column {hrr_column} is '{titles[hrr_column]}', expected '{HRR_TITLE}'.")
+    for c in gas_columns:
+        if pd.isnull(titles[c]) or not str(titles[c]).strip():
+            report.add("error", "Column Titles", f"Gas column {c} has no title.")
+
+    # ---- 2./3. Empty cells and numeric data, header rows and plan rows in one block ----
+    header = pd.DataFrame(data[2:4, gas_columns]).apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    if np.isnan(header).any():
+        report.add("error", "Gas Properties", "Heat of combustion and density must be numbers for every gas column.")
+    elif (header[1] <= 0).any():
+        report.add("error", "Gas Properties", "Gas densities must be greater than 0.")
+
+    cols = [0, *gas_columns, hrr_column]
+    raw = data[4:, cols]
+    values = pd.DataFrame(raw).apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    empty = pd.isnull(raw)
+    bad = np.isnan(values) & ~empty
+    if empty.any():
+        report.add("error", "Empty Cells", f"{int(empty.sum())} empty cell(s) in the plan, in rows {sorted(set((np.flatnonzero(empty.any(axis=1)) + 4).tolist()))[:10]}.")
+    if bad.any():
+        report.add("error", "Numeric Data", f"{int(bad.sum())} non-numeric cell(s) in the plan, in rows {sorted(set((np.flatnonzero(bad.any(axis=1)) + 4).tolist()))[:10]}.")
+
+    # ---- 4./5. Time strictly increasing and under the duration cap ----
+    t = values[:, 0]
+    if not np.isnan(t).any():
+        if (np.diff(t) <= 0).any():
+            report.add("error", "Time", "Time values are not strictly increasing.", t[1:], np.diff(t) <= 0)
+        if t.max() > max_duration:
+            report.add("error", "Time", f"Recipe runs to {t.max():.0f} s, longer than the {max_duration} s limit.")
+        if t.min() < 0:
+            report.add("error", "Time", "Time values must not be negative.")
+
+    # ---- Composition and HRR ----
+    percents, hrr = values[:, 1:-1], values[:, -1]
+    with np.errstate(invalid="ignore"):
+        if (percents < 0).any() or (hrr < 0).any():
+            report.add("error", "Composition", "Gas fractions and heat release rate must not be negative.", t, (percents < 0).any(axis=1) | (hrr < 0))
+        off = np.abs(percents.sum(axis=1) - 1.0) > 0.01
+    if off.any():
+        report.add("warning", "Composition", "Gas fractions do not add up to 1.", t, off)
+    return report
+
+
+def mfc_limits(channels, n):
+    """Per-MFC (max, warning max, min, max rate) arrays for the first n MFCs, inf/-inf where unset."""
+    mfcs = channels.mfcs[:n]
+    lim = np.array([c.limits if c.limits else [-np.inf, -np.inf, np.inf, np.inf] for c in mfcs], dtype=float).reshape(-1, 4)
+    full_scale = np.array([c.full_scale or np.inf for c in mfcs], dtype=float)
+    max_rate = np.array([c.extra.get("max_rate", np.inf) for c in mfcs], dtype=float)
+    return np.minimum(lim[:, 3], full_scale), lim[:, 2], lim[:, 0], max_rate
+
+
+def plan_violations(t, flows, channels, n_mfcs):
+    """
+    Boolean masks of every feasibility rule, computed in one vectorised pass.
+
+    Works on a single plan (t: rows, flows: rows x gases) or a batch of plans with
+    any leading dimensions (t: variants x rows, flows: variants x rows x gases).
+    Rate masks are one row shorter along the time axis.
+    """
+    n_gas = flows.shape[-1]
+    n_used = min(n_mfcs, n_gas)
+    f = flows[..., :n_used]
+    hi, warn_hi, lo, max_rate = mfc_limits(channels, n_used)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.abs(np.diff(f, axis=-2)) / np.diff(t, axis=-1)[..., None]
+    over = f > hi
+    masks = {
+        "unserved": np.abs(flows[..., n_used:]) > 0,
+        "over": over,
+        "under": f < lo,
+        "warn": (f > warn_hi) & ~over,
+        "rate": rate,
+        "too_fast": rate > max_rate,
+    }
+    return masks
+
+
+def check_plan(plan, channels, gas_names, n_mfcs=None, report=None):
+    """
+    Feasibility checks on a compiled plan, all rows at once.
+
+    Flags rows where a gas flow exceeds its MFC's range or rate-of-change limit,
+    gas that has no MFC to deliver it, and the time windows where the delivered
+    mixture is flammable.
+
+    Args:
+        plan: rows of [time, gas1..gasN SLPM, HRR] (UI.test_plan layout, before reduction)
+        channels: ChannelMap of the rig, gas column i is delivered by MFC i
+        gas_names: title of each gas column, e.g. ["H2", "CO", ...]
+        n_mfcs: MFCs in use, defaults to every MFC in the channel map
+    """
+    report = RecipeValidation() if report is None else report
+    plan = np.asarray(plan, dtype=float)
+    if plan.ndim != 2 or len(plan) == 0:
+        report.add("error", "Plan", "Compiled plan is empty.")
+        return report
+    n_mfcs = channels.n_mfcs if n_mfcs is None else min(n_mfcs, channels.n_mfcs)
+    t = plan[:, 0]
+    flows = plan[:, 1:len(gas_names) + 1]
+    if np.isnan(flows).any():
+        report.add("error", "Plan", "Compiled plan has missing flows, check the gas properties.", t, np.isnan(flows).any(axis=1))
+        return report
+
+    masks = plan_violations(t, flows, channels, n_mfcs)
+    masks["flammable"], masks["lfl"], masks["ufl"] = flammability(flows, gas_names)
+    return report_violations(report, t, flows, masks, channels, gas_names, n_mfcs)
+
+
+def report_violations(report, t, flows, masks, channels, gas_names, n_mfcs):
+    """Turn the masks of one plan (from plan_violations and flammability) into report entries."""
+    for k in np.flatnonzero(masks["unserved"].any(axis=0)):
+        report.add("error", "MFC Assignment", f"{gas_names[n_mfcs + k]} has flow but only {n_mfcs} MFC(s) are in use.", t, masks["unserved"][:, k])
+
+    hi, warn_hi, lo, max_rate = mfc_limits(channels, masks["over"].shape[1])
+    for k, c in enumerate(channels.mfcs[:masks["over"].shape[1]]):
+        name = f"{c.name} ({gas_names[k]})"
+        if masks["over"][:, k].any():
+            report.add("error", "MFC Range", f"{name} exceeds {hi[k]:.0f} {c.units}, peak {flows[:, k].max():.1f}.", t, masks["over"][:, k])
+        if masks["under"][:, k].any():
+            report.add("error", "MFC Range", f"{name} below {lo[k]:.0f} {c.units}.", t, masks["under"][:, k])
+        if masks["warn"][:, k].any():
+            report.add("warning", "MFC Range", f"{name} above the {warn_hi[k]:.0f} {c.units} warning level.", t, masks["warn"][:, k])
+        if masks["too_fast"][:, k].any():
+            report.add("error", "MFC Rate", f"{name} changes faster than {max_rate[k]:.0f} {c.units}/s, peak {np.nanmax(masks['rate'][:, k]):.0f}.", t[1:], masks["too_fast"][:, k])
+
+    flammable, lfl, ufl = masks["flammable"], masks["lfl"], masks["ufl"]
+    if flammable is not None:
+        for a, b in row_ranges(flammable):
+            report.flammable_windows.append((float(t[a]), float(t[b]), float(np.nanmin(lfl[a:b + 1])), float(np.nanmax(ufl[a:b + 1]))))
+        if report.flammable_windows:
+            report.add("warning", "Flammability", f"Delivered mixture is flammable before it reaches the chamber in {len(report.flammable_windows)} window(s).")
+    return report
+
+
+def flammability(flows, gas_names):
+    """
+    Rows where the delivered mixture can burn on its own.
+
+    Flows are in SLPM so they are proportional to mole fractions. A row is
+    flammable when the fuel fraction is between the Le Chatelier mixture LFL
+    and UFL (above the UFL it is too rich to burn) and there is at least the
+    minimum oxygen concentration of the most permissive fuel present. Gases
+    not in FUEL_PROPERTIES or OXIDIZERS count as inert.
+    Works over any leading dimensions, gases on the last axis.
+
+    Returns:
+        (flammable mask, mixture LFL %, mixture UFL %), or (None, None, None) if the
+        recipe has no fuel or no oxidizer.
+    """
+    names = [str(n).strip().upper() for n in gas_names]
+    fuel_idx = [i for i, n in enumerate(names) if n in FUEL_PROPERTIES]
+    ox_idx = [i for i, n in enumerate(names) if n in OXIDIZERS]
+    if not fuel_idx or not ox_idx:
+        return None, None, None
+    total = flows.sum(axis=-1)
+    fuel = flows[..., fuel_idx]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fuel_pct = 100 * fuel.sum(axis=-1) / total
+        o2_pct = 100 * flows[..., ox_idx].sum(axis=-1) / total
+    props = [FUEL_PROPERTIES[names[i]] for i in fuel_idx]
+    lfl = le_chatelier(fuel, [p["LFL"] for p in props])
+    ufl = le_chatelier(fuel, [p["UFL"] for p in props])
+    moc = np.where(fuel > 0, [p["MOC"] for p in props], np.inf).min(axis=-1)
+    with np.errstate(invalid="ignore"):
+        flammable = (total > 0) & (fuel_pct >= lfl) & (fuel_pct <= ufl) & (o2_pct >= moc)
+    return flammable, lfl, ufl
@@ -0,0 +1,345 @@
+"""
+Several gas carts (rigs) run from one controller window.
+
+Every rig is its own pipeline: a Data_Handler (serial link, histories, state
+save file, telemetry bus), a ControlSystem with its own state machine, safety
+checks and control thread, and optionally its own telemetry server. They share
+the window: the rig buttons pick which rig the graphs, values and buttons act
+on, and each rig's messages in the terminal are prefixed with its name. The
+EMERGENCY STOP button stops every rig.
+
+A rig's control loop and serial I/O run on that rig's own thread, so a hung
+link or a crashed loop on one rig cannot hold up another: its link watchdog
+puts only that rig in emergency stop, and a control loop that dies is
+restarted in emergency stop.
+
+Rigs are listed in rigs.json; without it there is one rig using the usual
+state_save.csv, channel_map.json and telemetry bus:
+
+    {"rigs": [
+        {"name": "Cart 1", "state_file": "state_save.csv", "channel_map": "channel_map.json", "telemetry_bus": "sbgc_telemetry"},
+        {"name": "Cart 2", "state_file": "state_save_cart2.csv", "channel_map": "channel_map.json", "telemetry_bus": "sbgc_telemetry_cart2",
+         "control_process": true}
+    ]}
+
+"control_process": true runs that rig's control loop and serial link in a
+child process (control_process.py) instead of a thread.
+
+All rigs in one window need the same MFC and sensor layout. Headless check
+with simulated Arduinos, one of which hangs part way through:
+
+    python rig_manager.py --rigs 4 --seconds 10
+    python rig_manager.py --rigs 4 --control-process   # each rig's loop in its own process
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from channel_map import CHANNEL_MAP_PATH
+from Controls import ControlSystem
+from control_process import ControlProcess
+from data_handler import Data_Handler, STATE_FILE
+from simulated_arduino import SimulatedArduino, FIRMWARE_ID
+from telemetry_bus import BUS_NAME
+from UI import UI_Object
+import telemetry_server
+
+RIGS_PATH = "rigs.json"
+DEFAULT_RIGS = {"rigs": [{"name": "Rig 1", "state_file": STATE_FILE, "channel_map": CHANNEL_MAP_PATH, "telemetry_bus": BUS_NAME}]}
+RECIPE_ATTRS = ("test_columns", "test_plan", "recipe_heat_comb", "recipe_density", "recipe_validation", "sweep") # UI state kept per rig
+SUPERVISE_PERIOD = 500 # ms between control thread checks
+
+
+class RigView:
+    """
+    The UI as one rig's ControlSystem and Data_Handler see it.
+
+    Terminal messages get the rig's name, display updates only happen while the
+    rig is shown, and the loaded recipe belongs to the rig. Everything else is
+    the shared window.
+    """
+
+    # Operator requests act on this rig only, with the same checks as the buttons
+    request_estop = UI_Object.request_estop
+    request_start_test = UI_Object.request_start_test
+    request_stop_test = UI_Object.request_stop_test
+    request_custom_setpoints = UI_Object.request_custom_setpoints
+    _refuse = UI_Object._refuse
+    rig_manager = None
+
+    def __init__(self, ui, rig, prefix):
+        self.ui = ui
+        self.dh = rig.dh
+        self.cs = rig.cs
+        self.channels = rig.dh.channels
+        self.prefix = prefix
+        self.active = False
+        self.recipe = {"test_columns": [], "test_plan": [], "recipe_heat_comb": [], "recipe_density": [],
+                       "recipe_validation": None, "sweep": None}
+
+    def __getattr__(self, name):
+        if name in RECIPE_ATTRS:
+            return getattr(self.ui, name) if self.active else self.recipe[name]
+        return getattr(self.ui, name)
+
+    def write_to_terminal(self, text, timestamp=True):
+        self.ui.write_to_terminal(self.prefix + text, timestamp)
+
+    def update_indicators(self, name):
+        if self.active:
+            self.ui.update_indicators(name)
+
+    def update_graphs(self):
+        if self.active:
+            self.ui.update_graphs()
+
+    def update_values_display(self):
+        if self.active:
+            self.ui.update_values_display()
+
+
+class Rig:
+    """One independent pipeline, wired the way SyntheticBatteryGasController.py wires a single rig."""
+
+    def __init__(self, config):
+        self.name = config["name"]
+        self.config = config
+        self.process = None
+        if config.get("control_process"): # loop and serial link in a child process, see control_process.py
+            self.process = ControlProcess(config)
+            self.dh, self.cs = self.process.dh, self.process.cs
+        else:
+            self.dh = Data_Handler(config.get("channel_map", CHANNEL_MAP_PATH), config.get("state_file", STATE_FILE),
+                                   config.get("telemetry_bus", BUS_NAME))
+            self.dh.rig_name = self.name
+            self.cs = ControlSystem()
+            self.dh.cs = self.cs
+            self.cs.dh = self.dh
+        self.view = None
+        self.server = None
+        self.restarts = 0 # control loops restarted after dying
+
+    def attach(self, view):
+        self.view = view
+        self.dh.UI = view
+        self.cs.UI = view
+
+
+class RigManager:
+    def __init__(self, configs):
+        if not configs:
+            raise ValueError("No rigs configured.")
+        names = [c["name"] for c in configs]
+        if len(set(names)) != len(names):
+            raise ValueError("Rig names must be unique.")
+        self.rigs = [Rig(c) for c in configs]
+        layout = self._layout(self.rigs[0])
+        for rig in self.rigs[1:]:
+            if self._layout(rig) != layout:
+                raise ValueError(f"{rig.name} has a different channel layout from {self.rigs[0].name}, "
+                                 "rigs shown in one window must share it.")
+        for rig in self.rigs:
+            rig.dh.connection.excluded_ports = lambda rig=rig: self.ports_in_use(rig)
+        self.channels = self.rigs[0].dh.channels
+        self.ui = None
+        self.active = None
+
+    @classmethod
+    def load(cls, path=RIGS_PATH):
+        """Build the rigs in rigs.json, or the single default rig if it is missing."""
+        if not os.path.exists(path):
+            return cls(DEFAULT_RIGS["rigs"])
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f)["rigs"])
+
+    @staticmethod
+    def _layout(rig):
+        ch = rig.dh.channels
+        return [(c.name, c.units) for c in ch.mfcs + ch.sensors]
+
+    def rig(self, name):
+        for rig in self.rigs:
+            if rig.name == name:
+                return rig
+        raise KeyError(f"No rig named '{name}'.")
+
+    def ports_in_use(self, rig):
+        """Serial ports held by the other rigs, so port discovery never takes another rig's Arduino."""
+        return {r.dh.port for r in self.rigs if r is not rig and r.dh.Arduino_connected}
+
+    # ---------- UI ---------- #
+    def attach_ui(self, ui):
+        """Share one window between the rigs and show the first one."""
+        self.ui = ui
+        ui.rig_manager = self
+        for rig in self.rigs:
+            rig.attach(RigView(ui, rig, f"[{rig.name}] " if len(self.rigs) > 1 else ""))
+        if len(self.rigs) > 1 and hasattr(ui, "build_rig_selector"):
+            ui.build_rig_selector([r.name for r in self.rigs])
+        self.select(self.rigs[0].name)
+
+    def select(self, name):
+        """Point the window (graphs, values, buttons, loaded recipe) at another rig."""
+        rig = self.rig(name)
+        if self.active is not None:
+            old = self.active.view
+            old.recipe = {attr: getattr(self.ui, attr) for attr in RECIPE_ATTRS}
+            old.active = False
+        for attr in RECIPE_ATTRS:
+            setattr(self.ui, attr, rig.view.recipe[attr])
+        self.ui.dh, self.ui.cs = rig.dh, rig.cs
+        rig.view.active = True
+        self.active = rig
+        if hasattr(self.ui, "show_rig"):
+            self.ui.show_rig(name)
+
+    # ---------- Lifecycle ---------- #
+    def start(self):
+        """Start every rig's control loop and telemetry server, then watch the control threads."""
+        for rig in self.rigs:
+            if rig.dh.telemetry_bus_error is not None:
+                rig.view.write_to_terminal(f"[WARNING] Shared-memory telemetry bus not available: {rig.dh.telemetry_bus_error}")
+            rig.server = telemetry_server.start_server(rig.view, rig.dh) # only if server_port is in the rig's state file
+            rig.cs.start()
+        self.ui.after(SUPERVISE_PERIOD, self.supervise)
+
+    def supervise(self):
+        """Restart any control loop whose thread died, in emergency stop. The other rigs carry on untouched."""
+        for rig in self.rigs:
+            cs = rig.cs
+            if cs.running and cs.thread is not None and not cs.thread.is_alive():
+                rig.restarts += 1
+                rig.view.write_to_terminal("[ERROR] Control loop stopped unexpectedly, restarting it in EMERGENCY STOP.")
+                cs.running = False
+                cs.STATE, cs.oldstate = 0, None
+                cs.start()
+                rig.view.update_indicators(rig.view.indicators[0])
+        if any(r.cs.running for r in self.rigs):
+            self.ui.after(SUPERVISE_PERIOD, self.supervise)
+
+    def connect_simulated(self, rig, **sim_options):
+        """Give a rig a simulated Arduino instead of a serial port (see simulated_arduino.py)."""
+        if rig.process is not None:
+            rig.process.send("simulate", sim_options)
+            return
+        rig.dh.auto_reconnect = False # reconnecting would go looking for real ports
+        rig.dh.connection.attach(SimulatedArduino(rig.dh.channels, **sim_options), f"SIM-{rig.name}", FIRMWARE_ID)
+
+    def estop_all(self, pressed=None):
+        for rig in self.rigs:
+            rig.cs.set_state(0, pressed)
+
+    def shutdown(self):
+        """Emergency stop every rig and release its link, server and telemetry bus."""
+        for rig in self.rigs:
+            try:
+                rig.cs.set_state(0)
+            except Exception:
+                pass
+        time.sleep(0.5) # let the control loops send their zero flow frames
+        for rig in self.rigs:
+            if rig.process is not None:
+                rig.process.stop()
+            rig.cs.running = False
+            rig.dh.connection.stop_watchdog()
+            if rig.server is not None:
+                rig.server.stop()
+            if rig.dh.telemetry_bus is not None:
+                rig.dh.telemetry_bus.close()
+
+
+class _HeadlessUI:
+    """Stands in for the window in the headless check."""
+
+    indicators = ["State", "Valve", "Arduino"]
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.lines = []
+        self.rig_manager = self.dh = self.cs = None
+        self.test_columns, self.test_plan, self.recipe_heat_comb, self.recipe_density = [], [], [], []
+        self.recipe_validation = self.sweep = None
+
+    def write_to_terminal(self, text, timestamp=True):
+        self.lines.append(text)
+        if self.verbose:
+            print(text)
+
+    def after(self, ms, fn):
+        timer = threading.Timer(ms / 1000, fn)
+        timer.daemon = True
+        timer.start()
+
+    def update_indicators(self, name):
+        pass
+
+    def update_graphs(self):
+        pass
+
+    def update_values_display(self):
+        pass
+
+
+def demo(n_rigs=4, seconds=10.0, stall_rig=2, verbose=False, budget=0.02, control_process=False):
+    """
+    Run n_rigs simulated rigs holding custom setpoints, with rig stall_rig's link
+    hanging a third of the way in. Passes if the hung rig ends in emergency stop
+    while every other rig kept its 99th percentile tick lateness under budget [s].
+    """
+    tmp = tempfile.mkdtemp()
+    configs = []
+    for i in range(n_rigs):
+        state_file = os.path.join(tmp, f"rig{i + 1}_state.csv")
+        with open(state_file, "w") as f:
+            f.write("line_pressure,15.0\nmixing_chamber_pressure,14.7\nMethane_Sensor,0.3\ngas_sensor_2,0.2\nnum_mfcs,2\n")
+        configs.append({"name": f"Rig {i + 1}", "state_file": state_file, "channel_map": CHANNEL_MAP_PATH,
+                        "telemetry_bus": f"sbgc_demo_{os.getpid()}_{i + 1}", "control_process": control_process})
+
+    manager = RigManager(configs)
+    manager.attach_ui(_HeadlessUI(verbose))
+    manager.start()
+    for i, rig in enumerate(manager.rigs):
+        stall = {"stall_after": seconds / 3, "stall_for": 3.0} if i + 1 == stall_rig else {}
+        manager.connect_simulated(rig, seed=i, **stall)
+    for i, rig in enumerate(manager.rigs):
+        rig.view.request_custom_setpoints(1, [10.0 * (i + 1), 5.0])
+    time.sleep(seconds)
+
+    ok = True
+    print(f"{'rig':>6} {'state':>6} {'samples':>8} {'ticks':>6} {'median late':>12} {'p99 late':>10} {'max late':>10}")
+    for i, rig in enumerate(manager.rigs):
+        late = sorted(rig.cs.tick_lateness)
+        p99 = late[min(len(late) - 1, int(0.99 * len(late)))] if late else float("nan")
+        print(f"{rig.name:>6} {rig.cs.STATE:>6} {len(rig.dh.response_history):>8} {len(late):>6} "
+              f"{1000 * statistics.median(late) if late else float('nan'):>10.1f}ms {1000 * p99:>8.1f}ms "
+              f"{1000 * max(late) if late else float('nan'):>8.1f}ms")
+        if i + 1 == stall_rig:
+            ok &= rig.cs.STATE == 0
+        else:
+            ok &= rig.cs.STATE == 3 and p99 < budget
+    manager.shutdown()
+    shutil.rmtree(tmp, ignore_errors=True)
+    print("[PASS]" if ok else "[FAIL]")
+    return 0 if ok else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run several simulated rigs headless and check they stay isolated.")
+    parser.add_argument("--rigs", type=int, default=4, help="number of simulated rigs (default: 4)")
+    parser.add_argument("--seconds", type=float, default=10.0, help="how long to run (default: 10)")
+    parser.add_argument("--stall-rig", type=int, default=2, help="rig whose link hangs part way through, 0 for none (default: 2)")
+    parser.add_argument("--budget", type=float, default=0.02, help="p99 tick lateness allowed for the healthy rigs [s] (default: 0.02)")
+    parser.add_argument("--control-process", action="store_true", help="run each rig's control loop in its own process")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the terminal messages")
+    args = parser.parse_args(argv)
+    return demo(args.rigs, args.seconds, args.stall_rig, args.verbose, args.budget, args.control_process)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Rolling statistics of the telemetry channels.
+
+Every sample of every MFC response and sensor goes into a buffer together with
+prefix sums of t, x, x*x, t*t and t*x. The sums over any recent window are the
+difference of two prefix sums, found with one binary search on time, so the
+mean, standard deviation and least squares slope dX/dt over the last N seconds
+cost the same for a 0.5 s and a 5 min window, and for all channels at once.
+
+Times and values are summed relative to the oldest kept sample, so the squared
+sums do not lose precision over a long session (the shifted-data form of the
+variance; Welford's update cannot drop old samples from a window). The buffer
+holds 2 * capacity rows: once full, the newest capacity rows are moved to the
+front and the sums rebuilt from them, which is O(1) per sample on average.
+min and max are a numpy reduction over the window's rows.
+"""
+import numpy as np
+
+
+def stats_fields(channels):
+    """Field names of the rolling statistics for a channel map, in row order."""
+    return [f"{c.name} Response" for c in channels.mfcs] + [c.name for c in channels.sensors]
+
+
+class RollingStats:
+    """
+    Windowed statistics over rows of channel values.
+
+    Args:
+        fields: channel names, in the order of the rows given to append()
+        capacity: rows always kept, the longest window that can be asked for
+    """
+
+    def __init__(self, fields, capacity=30000):
+        self.fields = list(fields)
+        self.columns = {name: i for i, name in enumerate(self.fields)}
+        self.capacity = capacity
+        size, width = 2 * capacity, len(self.fields)
+        self._t = np.zeros(size)
+        self._x = np.zeros((size, width))
+        # Prefix sums, row i holds the sum over rows 0..i-1
+        self._st = np.zeros(size + 1)
+        self._stt = np.zeros(size + 1)
+        self._sx = np.zeros((size + 1, width))
+        self._sxx = np.zeros((size + 1, width))
+        self._stx = np.zeros((size + 1, width))
+        self.reset()
+
+    @classmethod
+    def for_channels(cls, channels, capacity=30000):
+        return cls(stats_fields(channels), capacity)
+
+    def reset(self):
+        """Forget every sample, e.g. on a Clear Data press."""
+        self.n = 0
+        self.t0 = 0.0 # time and values the sums are taken relative to
+        self.x0 = np.zeros(len(self.fields))
+
+    def field(self, name):
+        """Column of a field in the arrays returned by the vector queries."""
+        return self.columns[name]
+
+    # ---------- Samples ---------- #
+    def append(self, t, values):
+        """Add one row: time [s] and a value per field."""
+        if self.n == len(self._t):
+            self._compact()
+        n = self.n
+        if n == 0:
+            self.t0, self.x0 = t, np.asarray(values, dtype=float)
+        dt = t - self.t0
+        dx = np.asarray(values, dtype=float) - self.x0
+        if not np.isfinite(dx).all():
+            return # a nan would stay in every sum until the next compaction
+        self._t[n] = t
+        self._x[n] = values
+        self._st[n + 1] = self._st[n] + dt
+        self._stt[n + 1] = self._stt[n] + dt * dt
+        self._sx[n + 1] = self._sx[n] + dx
+        self._sxx[n + 1] = self._sxx[n] + dx * dx
+        self._stx[n + 1] = self._stx[n] + dt * dx
+        self.n = n + 1
+
+    def _compact(self):
+        """Move the newest capacity rows to the front and rebuild the sums relative to the oldest of them."""
+        keep = self.capacity
+        self._t[:keep] = self._t[self.n - keep:self.n]
+        self._x[:keep] = self._x[self.n - keep:self.n]
+        self.n = keep
+        self.t0, self.x0 = self._t[0], self._x[0].copy()
+        dt = self._t[:keep] - self.t0
+        dx = self._x[:keep] - self.x0
+        np.cumsum(dt, out=self._st[1:keep + 1])
+        np.cumsum(dt * dt, out=self._stt[1:keep + 1])
+        np.cumsum(dx, axis=0, out=self._sx[1:keep + 1])
+        np.cumsum(dx * dx, axis=0, out=self._sxx[1:keep + 1])
+        np.cumsum(dt[:, None] * dx, axis=0, out=self._stx[1:keep + 1])
+
+    # ---------- Queries ---------- #
+    def _start(self, window):
+        """First row of the last window seconds (before the newest sample), all rows for None."""
+        if window is None or self.n == 0:
+            return 0
+        return int(np.searchsorted(self._t[:self.n], self._t[self.n - 1] - window, side="left"))
+
+    def _sums(self, window):
+        start, end = self._start(window), self.n
+        return (end - start, self._st[end] - self._st[start], self._stt[end] - self._stt[start],
+                self._sx[end] - self._sx[start], self._sxx[end] - self._sxx[start], self._stx[end] - self._stx[start])
+
+    def count(self, window=None):
+        return self.n - self._start(window)
+
+    def newest_time(self):
+        """Time of the newest sample [s], windows end there."""
+        if self.n == 0:
+            raise IndexError("no samples yet")
+        return float(self._t[self.n - 1])
+
+    def latest(self, name=None):
+        """Newest value of a field, or of every field. Raises IndexError before the first sample."""
+        if self.n == 0:
+            raise IndexError("no samples yet")
+        row = self._x[self.n - 1]
+        return float(row[self.columns[name]]) if name is not None else row.copy()
+
+    def means(self, window=None):
+        """Mean of every field over the last window seconds."""
+        n, _, _, sx, _, _ = self._sums(window)
+        return self.x0 + sx / n if n else np.full(len(self.fields), np.nan)
+
+    def stds(self, window=None):
+        """Sample standard deviation of every field over the last window seconds."""
+        n, _, _, sx, sxx, _ = self._sums(window)
+        if n < 2:
+            return np.full(len(self.fields), np.nan)
+        return np.sqrt(np.maximum(sxx - sx * sx / n, 0.0) / (n - 1))
+
+    def slopes(self, window=None):
+        """Least squares slope dX/dt of every field over the last window seconds [units/s]."""
+        n, st, stt, sx, _, stx = self._sums(window)
+        spread = n * stt - st * st
+        if n < 2 or spread <= 0:
+            return np.full(len(self.fields), np.nan)
+        return (n * stx - st * sx) / spread
+
+    def fitted(self, window=None):
+        """Every field's value at the newest sample on the window's least squares line: smoothed, but without the lag of the mean."""
+        n, st, stt, sx, _, stx = self._sums(window)
+        if n < 2 or n * stt - st * st <= 0:
+            return self.means(window)
+        slope = (n * stx - st * sx) / (n * stt - st * st)
+        t_end = self._t[self.n - 1] - self.t0
+        return self.x0 + sx / n + slope * (t_end - st / n)
+
+    def minima(self, window=None):
+        start = self._start(window)
+        return self._x[start:self.n].min(axis=0) if self.n > start else np.full(len(self.fields), np.nan)
+
+    def maxima(self, window=None):
+        start = self._start(window)
+        return self._x[start:self.n].max(axis=0) if self.n > start else np.full(len(self.fields), np.nan)
+
+    # One field at a time
+    def mean(self, name, window=None):
+        return float(self.means(window)[self.columns[name]])
+
+    def std(self, name, window=None):
+        return float(self.stds(window)[self.columns[name]])
+
+    def slope(self, name, window=None):
+        return float(self.slopes(window)[self.columns[name]])
+
+    def minimum(self, name, window=None):
+        return float(self.minima(window)[self.columns[name]])
+
+    def maximum(self, name, window=None):
+        return float(self.maxima(window)[self.columns[name]])
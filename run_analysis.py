@@ -0,0 +1,159 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# np.trapz was renamed to np.trapezoid in NumPy 2.0
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+_executor = None  # worker process pool, created on first use
+
+
+def history_to_array(history, width):
+    """Convert a [[time, v1, v2, ...], ...] history into a float array, dropping rows of the wrong width."""
+    rows = [row for row in history if len(row) == width]
+    if not rows:
+        return np.empty((0, width))
+    return np.asarray(rows, dtype=float)
+
+
+def hrr_coefficients(heat_comb, density):
+    """
+    Per-gas factors that turn a flow in SLPM into heat release in kW.
+
+    Inverse of the recipe conversion SLPM = percent * HRR / heat_comb * 60000 / density,
+    so HRR contribution [kW] = SLPM * density [g/L] * heat_comb [kJ/kg] / 60000.
+    """
+    return np.asarray(density, dtype=float) * np.asarray(heat_comb, dtype=float) / 60000.0
+
+
+def delivered_mass(t, flows, density):
+    """Grams of each gas delivered, from SLPM flows sampled at times t [s]."""
+    if len(t) < 2:
+        return np.zeros(flows.shape[1])
+    litres = _trapezoid(flows, t, axis=0) / 60.0
+    return litres * np.asarray(density, dtype=float)
+
+
+def detect_steps(setpoints, threshold):
+    """Indices where a setpoint column jumps by more than threshold between consecutive samples."""
+    return np.flatnonzero(np.abs(np.diff(setpoints)) > threshold) + 1
+
+
+def step_metrics(t_sp, sp, t_rp, rp, threshold=5.0):
+    """
+    Rise time (10-90 %) and overshoot for every setpoint step of one MFC.
+
+    Returns:
+        (rise_times [s], overshoots [%]) as arrays, NaN where the response never got there.
+    """
+    steps = detect_steps(sp, threshold)
+    rise_times = np.full(len(steps), np.nan)
+    overshoots = np.full(len(steps), np.nan)
+    if len(steps) == 0 or len(t_rp) == 0:
+        return rise_times, overshoots
+
+    # Response window of each step runs until the next step (or the end of the run)
+    starts = np.searchsorted(t_rp, t_sp[steps])
+    ends = np.append(starts[1:], len(t_rp))
+
+    for k, (step, a, b) in enumerate(zip(steps, starts, ends)):
+        if b - a < 2:
+            continue
+        s0, s1 = sp[step - 1], sp[step]
+        change = s1 - s0
+        # Normalised progress of the response towards the new setpoint, 0 = old, 1 = new
+        progress = (rp[a:b] - s0) / change
+        t_win = t_rp[a:b]
+        hit10 = np.flatnonzero(progress >= 0.1)
+        hit90 = np.flatnonzero(progress >= 0.9)
+        if len(hit10) and len(hit90):
+            rise_times[k] = t_win[hit90[0]] - t_win[hit10[0]]
+        overshoots[k] = max(0.0, (progress.max() - 1.0) * 100.0)
+
+    return rise_times, overshoots
+
+
+def analyze_run(setpoints, responses, plan, heat_comb, density, run_start=0.0,
+                gas_names=None, n_mfcs=None, step_threshold=5.0):
+    """
+    Compute the post-run summary for one test.
+
+    Args:
+        setpoints: array of [time, MFC1, ..., MFCn] setpoint rows (Data_Handler.setpoint_history)
+        responses: array of [time, MFC1, ..., MFCn] response rows (Data_Handler.response_history)
+        plan: array of compiled recipe rows [time, gas1..gasN SLPM, HRR] (UI.test_plan), may be empty
+        heat_comb, density: recipe header rows, one value per gas [kJ/kg], [g/L]
+        run_start: time the run started on the clock of the time columns [s], plan times are relative to it.
+            With a plan, rows before run_start or after the plan's last row are left out.
+        n_mfcs: number of MFCs in use, defaults to every column present
+
+    Returns:
+        dict with a per-MFC "table" (list of dicts) and run-level HRR tracking metrics.
+    """
+    setpoints = np.asarray(setpoints, dtype=float)
+    responses = np.asarray(responses, dtype=float)
+    plan = np.asarray(plan, dtype=float)
+    n_present = min(setpoints.shape[1], responses.shape[1]) - 1
+    n_mfcs = min(n_present if n_mfcs is None else n_mfcs, n_present, len(density))
+    density = np.asarray(density[:n_mfcs], dtype=float)
+    coef = hrr_coefficients(heat_comb[:n_mfcs], density)
+    if gas_names is None:
+        gas_names = [f"Gas {i+1}" for i in range(n_mfcs)]
+
+    t_sp = setpoints[:, 0] - run_start if len(setpoints) else np.empty(0)
+    t_rp = responses[:, 0] - run_start if len(responses) else np.empty(0)
+    sp = setpoints[:, 1:n_mfcs + 1]
+    rp = responses[:, 1:n_mfcs + 1]
+    if plan.ndim == 2 and len(plan): # only the planned test, not what was idling before or after it
+        keep_sp = (t_sp >= 0) & (t_sp <= plan[-1, 0])
+        keep_rp = (t_rp >= 0) & (t_rp <= plan[-1, 0])
+        t_sp, sp, t_rp, rp = t_sp[keep_sp], sp[keep_sp], t_rp[keep_rp], rp[keep_rp]
+
+    mass_delivered = delivered_mass(t_rp, rp, density)
+    mass_commanded = delivered_mass(t_sp, sp, density)
+
+    table = []
+    for i in range(n_mfcs):
+        rise, over = step_metrics(t_sp, sp[:, i], t_rp, rp[:, i], step_threshold)
+        table.append({
+            "MFC": i + 1,
+            "Gas": gas_names[i],
+            "Delivered (g)": float(mass_delivered[i]),
+            "Commanded (g)": float(mass_commanded[i]),
+            "Steps": len(rise),
+            "Mean Rise Time (s)": float(np.nanmean(rise)) if np.any(~np.isnan(rise)) else float("nan"),
+            "Max Overshoot (%)": float(np.nanmax(over)) if np.any(~np.isnan(over)) else float("nan"),
+        })
+
+    # HRR tracking: achieved HRR from the measured flows against the recipe HRR at the same instants
+    hrr = rp @ coef if n_mfcs else np.zeros(len(t_rp))
+    result = {"table": table, "Energy Delivered (kJ)": float(_trapezoid(hrr, t_rp)) if len(t_rp) > 1 else 0.0}
+    if len(plan) and plan.shape[1] >= 3 and len(t_rp):
+        hrr_plan = np.interp(t_rp, plan[:, 0], plan[:, -1], left=0.0, right=0.0)
+        err = hrr - hrr_plan
+        result.update({
+            "Energy Planned (kJ)": float(_trapezoid(hrr_plan, t_rp)) if len(t_rp) > 1 else 0.0,
+            "HRR RMS Error (kW)": float(np.sqrt(np.mean(err ** 2))),
+            "HRR Mean Abs Error (kW)": float(np.mean(np.abs(err))),
+            "HRR Max Abs Error (kW)": float(np.max(np.abs(err))),
+        })
+    return result
+
+
+def format_summary(result):
+    """Render the analysis result as a plain text table for the terminal."""
+    columns = ["MFC", "Gas", "Delivered (g)", "Commanded (g)", "Steps", "Mean Rise Time (s)", "Max Overshoot (%)"]
+    lines = [" | ".join(columns)]
+    for row in result["table"]:
+        lines.append(" | ".join(f"{row[c]:.2f}" if isinstance(row[c], float) else str(row[c]) for c in columns))
+    for key, val in result.items():
+        if key != "table":
+            lines.append(f"{key}: {val:.2f}")
+    return "\n".join(lines)
+
+
+def submit_analysis(*args, **kwargs):
+    """Run analyze_run in a worker process so the UI and control loop are not blocked. Returns a Future."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=1)
+    return _executor.submit(analyze_run, *args, **kwargs)
@@ -0,0 +1,462 @@
+"""
+Local archive of every test and custom setpoint run.
+
+When a run ends the Data_Handler hands its slice of the histories to
+RunArchive.submit(), which writes it on a background thread:
+
+    runs.sqlite                  the catalogue: one row per run (rig, kind, start and end
+                                 time, recipe name and hash, the state_save calibration
+                                 at the time, telemetry layout), its summary metrics
+                                 and its fault events
+    run_000123.npy               telemetry, float32, one row per field (time first)
+    run_000123_setpoints.npy     setpoints sent, float32, [time, MFC1..MFCn] rows
+
+The telemetry files are stored field by field, so reading one field of a run
+reads one contiguous block of the file. They are opened with numpy memory
+mapping: nothing is read until a field is used, and only the pages of that
+field. Times are seconds from the start of the run (float32 keeps them to 1 ms
+for the first 2 hours).
+
+Every run gets the Max, Min and Mean of each telemetry field as metrics, plus
+run_analysis.analyze_run's results for tests, so comparing runs only reads the
+catalogue. Metrics are indexed by name and value, and runs by recipe and start
+time, so a query like "all runs of this recipe above 50 kW last month" is a
+few index lookups however many runs there are:
+
+    python run_archive.py --recipe Example_Test_Recipe.xlsx --since 2026-09-01 --where "Max Achieved HRR (kW) > 50"
+    python run_archive.py --since 2026-09-01 --overlay "Achieved HRR (kW)"
+"""
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import numpy as np
+
+import run_analysis
+
+CATALOGUE = "runs.sqlite"
+OVERLAY_POINTS = 2000 # per run, min/max pairs of the field in time buckets
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    rig TEXT,
+    kind TEXT,              -- 'test' or 'custom'
+    started REAL,           -- time.time() the run started
+    ended REAL,
+    duration REAL,          -- s
+    end_state INTEGER,      -- state the run ended in, 0 = emergency stop
+    recipe_name TEXT,
+    recipe_hash TEXT,
+    samples INTEGER,
+    faults INTEGER,
+    fields TEXT,            -- JSON list of the telemetry file's rows
+    setpoint_fields TEXT,
+    calibration TEXT        -- JSON of state_save.csv when the run ended
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE INDEX IF NOT EXISTS runs_recipe ON runs (recipe_hash, started);
+CREATE INDEX IF NOT EXISTS runs_recipe_name ON runs (recipe_name, started);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS metrics_value ON metrics (name, value, run_id);
+CREATE TABLE IF NOT EXISTS events (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    t REAL,                 -- s from the start of the run
+    kind TEXT,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS events_run ON events (run_id, t);
+CREATE INDEX IF NOT EXISTS events_kind ON events (kind, run_id);
+"""
+
+_CONDITION = re.compile(r"^\s*(.+?)\s*(<=|>=|!=|<|>|=)\s*([-+]?[\d.]+(?:[eE][-+]?\d+)?)\s*$")
+
+
+def recipe_hash(plan, gas_names, heat_comb, density):
+    """Short hash identifying a compiled recipe (CompiledRecipe fields), the same for the same plan whatever the file is called."""
+    payload = json.dumps([[str(g) for g in gas_names], [float(v) for v in heat_comb], [float(v) for v in density],
+                          np.round(np.asarray(plan, dtype=float), 6).tolist()])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def telemetry_fields(channels, raw_sensors=()):
+    """Rows of a run's telemetry file: the Save Data column names, then the raw readings of the filtered sensors."""
+    return (["Time (s)"] + [f"{c.name} Response ({c.units})" for c in channels.mfcs] + [c.label for c in channels.sensors]
+            + ["Valve State", "Achieved HRR (kW)", "Energy Released (kJ)", "Chamber Fuel (%)", "Flammability Margin (%)"]
+            + [f"{c.name} Raw" for c in raw_sensors])
+
+
+def parse_condition(text):
+    """'Max Achieved HRR (kW) > 50' -> ('Max Achieved HRR (kW)', '>', 50.0)."""
+    match = _CONDITION.match(text)
+    if not match:
+        raise ValueError(f"Expected '<metric> <op> <number>', got '{text}'")
+    return match.group(1), match.group(2), float(match.group(3))
+
+
+def parse_date(text):
+    """'2026-09-01' or '2026-09-01 14:00' -> time.time() at that local time."""
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(text.strip(), fmt).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(f"Expected YYYY-MM-DD [HH:MM], got '{text}'")
+
+
+def decimate(t, y, points=OVERLAY_POINTS):
+    """
+    Thin a trace for plotting without losing its peaks: the min and max of
+    each of points / 2 equal sample buckets, in time order.
+    """
+    bucket = -(-len(y) // max(points // 2, 1))
+    if bucket <= 2:
+        return np.asarray(t), np.asarray(y)
+    m = len(y) // bucket
+    yb = np.asarray(y[:m * bucket]).reshape(m, bucket)
+    lo, hi = np.argmin(np.nan_to_num(yb, nan=np.inf), axis=1), np.argmax(np.nan_to_num(yb, nan=-np.inf), axis=1)
+    first = np.minimum(lo, hi)
+    second = np.maximum(lo, hi)
+    rows = np.arange(m) * bucket
+    idx = np.column_stack([rows + first, rows + second]).ravel()
+    if m * bucket < len(y): # the last partial bucket as it is
+        idx = np.concatenate([idx, np.arange(m * bucket, len(y))])
+    return np.asarray(t)[idx], np.asarray(y)[idx]
+
+
+def run_metrics(fields, data, analysis=None):
+    """Summary metrics of one run's telemetry (fields x samples array) and its run_analysis result."""
+    metrics = {}
+    with np.errstate(all="ignore"):
+        for name, row in zip(fields[1:], data[1:]):
+            finite = row[np.isfinite(row)]
+            if len(finite):
+                metrics[f"Max {name}"] = float(finite.max())
+                metrics[f"Min {name}"] = float(finite.min())
+                metrics[f"Mean {name}"] = float(finite.mean())
+    if analysis:
+        for row in analysis["table"]:
+            for key in ("Delivered (g)", "Commanded (g)", "Mean Rise Time (s)", "Max Overshoot (%)"):
+                metrics[f"{row['Gas']} {key}"] = row[key]
+        metrics.update({key: value for key, value in analysis.items() if key != "table"})
+    return {k: v for k, v in metrics.items() if v is not None and np.isfinite(v)}
+
+
+class RunTelemetry:
+    """
+    One archived run's files, memory mapped on first use.
+
+    field(name) is a read-only float32 view of that row of the telemetry
+    file, the time axis is field("Time (s)").
+    """
+
+    def __init__(self, directory, row):
+        self.id = row["id"]
+        self.fields = json.loads(row["fields"])
+        self.setpoint_fields = json.loads(row["setpoint_fields"])
+        self.path = os.path.join(directory, f"run_{self.id:06d}.npy")
+        self.setpoint_path = os.path.join(directory, f"run_{self.id:06d}_setpoints.npy")
+        self._data = self._setpoints = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.load(self.path, mmap_mode="r")
+        return self._data
+
+    @property
+    def setpoints(self):
+        """[time, MFC1..MFCn] rows of the setpoints sent during the run."""
+        if self._setpoints is None:
+            self._setpoints = np.load(self.setpoint_path, mmap_mode="r").T
+        return self._setpoints
+
+    def time(self):
+        return self.data[0]
+
+    def field(self, name):
+        return self.data[self.fields.index(name)]
+
+
+class RunArchive:
+    """
+    The run catalogue and telemetry files in one directory.
+
+    Args:
+        directory: where runs.sqlite and the run files live, created if missing
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, CATALOGUE)
+        self._executor = None # writer thread, created on the first run
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10) # rigs sharing a directory take turns writing
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA foreign_keys = ON")
+        return db
+
+    # ---------- Writing ---------- #
+    def submit(self, run):
+        """Store a run (see store) on the archive's writer thread. Returns a Future of its id."""
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return self._executor.submit(self.store, run)
+
+    def store(self, run):
+        """
+        Write one run's files and catalogue rows.
+
+        Args:
+            run: dict from Data_Handler.archive_run: rig, kind, started, ended,
+                end_state, start_ns, recipe (name, hash, gas_names, heat_comb,
+                density, plan, or None), calibration, events [(t_ns, kind, message)],
+                fields, telemetry (the run's rows of each telemetry history, one
+                row per sample in each, run clock ns time first), setpoint_fields,
+                setpoints ([t_ns, MFC1..] rows), n_mfcs (MFCs in use)
+        Returns:
+            the run's id
+        """
+        start = run["start_ns"]
+        n = min(len(h) for h in run["telemetry"])
+        parts = [np.asarray(h[len(h) - n:], dtype=float).reshape(n, -1) for h in run["telemetry"]]
+        data = np.hstack([parts[0]] + [p[:, 1:] for p in parts[1:]]).T # one row per field, the times of the first
+        data[0] = (data[0] - start) / 1e9
+        setpoints = np.asarray(run["setpoints"], dtype=float).reshape(-1, len(run["setpoint_fields"]))
+        setpoints[:, 0] = (setpoints[:, 0] - start) / 1e9
+
+        recipe = run["recipe"]
+        analysis = None
+        if recipe and recipe["plan"] and len(setpoints) > 1 and data.shape[1] > 1:
+            responses = data[:setpoints.shape[1]].T # [time, MFC1..MFCn], the response rows come first
+            try:
+                analysis = run_analysis.analyze_run(setpoints, responses, recipe["plan"], recipe["heat_comb"],
+                                                    recipe["density"], gas_names=recipe["gas_names"],
+                                                    n_mfcs=run["n_mfcs"])
+            except (ValueError, IndexError): # recipe and rig do not line up, keep the field metrics
+                analysis = None
+        metrics = run_metrics(run["fields"], data, analysis)
+
+        with self._connect() as db:
+            cursor = db.execute(
+                "INSERT INTO runs (rig, kind, started, ended, duration, end_state, recipe_name, recipe_hash, samples,"
+                " faults, fields, setpoint_fields, calibration) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run["rig"], run["kind"], run["started"], run["ended"], run["ended"] - run["started"], run["end_state"],
+                 recipe["name"] if recipe else None, recipe["hash"] if recipe else None, data.shape[1],
+                 len(run["events"]), json.dumps(run["fields"]), json.dumps(run["setpoint_fields"]),
+                 json.dumps(run["calibration"])))
+            run_id = cursor.lastrowid
+            db.executemany("INSERT INTO metrics VALUES (?, ?, ?)", [(run_id, k, v) for k, v in metrics.items()])
+            db.executemany("INSERT INTO events VALUES (?, ?, ?, ?)",
+                           [(run_id, (t - start) / 1e9, kind, message) for t, kind, message in run["events"]])
+            # Files before the commit: a run in the catalogue always has them
+            files = RunTelemetry(self.directory, {"id": run_id, "fields": "[]", "setpoint_fields": "[]"})
+            for path, array in ((files.path, data), (files.setpoint_path, setpoints.T)):
+                with open(path + ".tmp", "wb") as f:
+                    np.save(f, np.ascontiguousarray(array, dtype=np.float32))
+                os.replace(path + ".tmp", path)
+        db.close()
+        return run_id
+
+    def delete(self, run_id):
+        """Remove a run from the catalogue and its files."""
+        with self._connect() as db:
+            db.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+        db.close()
+        files = RunTelemetry(self.directory, {"id": run_id, "fields": "[]", "setpoint_fields": "[]"})
+        for path in (files.path, files.setpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # ---------- Queries ---------- #
+    def find(self, recipe=None, kind=None, since=None, until=None, where=(), rig=None, limit=None):
+        """
+        Runs matching every filter given, newest first.
+
+        Args:
+            recipe: recipe name or hash (a prefix of either)
+            kind: 'test' or 'custom'
+            since, until: time.time() range of the run start
+            where: conditions on metrics, (name, op, value) or '<name> <op> <value>' text
+            rig: rig name
+            limit: at most this many runs
+        Returns:
+            list of dicts of the runs table (without the calibration)
+        """
+        clauses, args = [], []
+        if recipe:
+            clauses.append("(recipe_name LIKE ? OR recipe_hash LIKE ?)")
+            args += [f"{recipe}%", f"{recipe}%"]
+        for column, value in (("kind", kind), ("rig", rig)):
+            if value:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+        if since is not None:
+            clauses.append("started >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("started < ?")
+            args.append(until)
+        for condition in where:
+            name, op, value = parse_condition(condition) if isinstance(condition, str) else condition
+            if op not in ("<", "<=", ">", ">=", "=", "!="):
+                raise ValueError(f"Unknown comparison '{op}'")
+            clauses.append(f"id IN (SELECT run_id FROM metrics WHERE name = ? AND value {op} ?)")
+            args += [name, value]
+        sql = ("SELECT id, rig, kind, started, ended, duration, end_state, recipe_name, recipe_hash, samples, faults,"
+               " fields, setpoint_fields FROM runs")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY started DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._connect() as db:
+            rows = [dict(r) for r in db.execute(sql, args)]
+        db.close()
+        return rows
+
+    def run(self, run_id):
+        """The runs table row of one run, with its calibration snapshot as a dict."""
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        db.close()
+        if row is None:
+            raise KeyError(f"No run {run_id} in {self.path}")
+        row = dict(row)
+        row["calibration"] = json.loads(row["calibration"] or "{}")
+        return row
+
+    def metrics(self, run_ids, names=None):
+        """{run id: {metric: value}} for the runs, every metric or only the named ones."""
+        run_ids = list(run_ids)
+        out = {run_id: {} for run_id in run_ids}
+        with self._connect() as db:
+            for lo in range(0, len(run_ids), 500): # SQLite's limit on parameters
+                chunk = run_ids[lo:lo + 500]
+                sql = f"SELECT run_id, name, value FROM metrics WHERE run_id IN ({','.join('?' * len(chunk))})"
+                args = list(chunk)
+                if names:
+                    sql += f" AND name IN ({','.join('?' * len(names))})"
+                    args += list(names)
+                for run_id, name, value in db.execute(sql, args):
+                    out[run_id][name] = value
+        db.close()
+        return out
+
+    def metric_names(self):
+        with self._connect() as db:
+            names = [r[0] for r in db.execute("SELECT DISTINCT name FROM metrics ORDER BY name")]
+        db.close()
+        return names
+
+    def events(self, run_id):
+        """[(t [s from the run start], kind, message), ...] of one run."""
+        with self._connect() as db:
+            rows = [tuple(r) for r in db.execute("SELECT t, kind, message FROM events WHERE run_id = ? ORDER BY t", (run_id,))]
+        db.close()
+        return rows
+
+    def telemetry(self, run):
+        """RunTelemetry of a run (id or a row from find), nothing is read yet."""
+        row = run if isinstance(run, dict) else self.run(run)
+        return RunTelemetry(self.directory, row)
+
+    def overlay(self, runs, field, points=OVERLAY_POINTS):
+        """
+        One field of many runs, thinned for plotting (see decimate).
+
+        Args:
+            runs: run ids or rows from find
+        Returns:
+            [(run id, t [s from its start], values), ...], runs without the field are left out
+        """
+        traces = []
+        for run in runs:
+            tel = self.telemetry(run)
+            if field in tel.fields:
+                t, y = decimate(tel.time(), tel.field(field), points)
+                traces.append((tel.id, t, y))
+        return traces
+
+
+def format_runs(rows, metrics=None, metric_names=()):
+    """Plain text table of runs from find, with the named metrics as extra columns."""
+    columns = ["Run", "Started", "Kind", "Recipe", "Duration (s)", "End", "Faults", *metric_names]
+    lines = [" | ".join(columns)]
+    for row in rows:
+        values = [str(row["id"]), time_text(row["started"]), row["kind"], row["recipe_name"] or "-",
+                  f"{row['duration']:.1f}", "E-STOP" if row["end_state"] == 0 else "OK", str(row["faults"])]
+        for name in metric_names:
+            value = (metrics or {}).get(row["id"], {}).get(name)
+            values.append("-" if value is None else f"{value:.2f}")
+        lines.append(" | ".join(values))
+    return "\n".join(lines)
+
+
+def time_text(wall):
+    return datetime.datetime.fromtimestamp(wall).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the run archive, compare runs and overlay their telemetry.")
+    parser.add_argument("--archive", default="run_archive", help="archive directory (default: run_archive)")
+    parser.add_argument("--recipe", help="recipe name or hash, or the start of one")
+    parser.add_argument("--kind", choices=["test", "custom"])
+    parser.add_argument("--rig")
+    parser.add_argument("--since", type=parse_date, help="runs started on or after YYYY-MM-DD [HH:MM]")
+    parser.add_argument("--until", type=parse_date, help="runs started before YYYY-MM-DD [HH:MM]")
+    parser.add_argument("--where", action="append", default=[], type=parse_condition,
+                        help="metric condition, e.g. 'Max Achieved HRR (kW) > 50' (repeatable)")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--metric", action="append", default=[], help="metric to show as a column (repeatable)")
+    parser.add_argument("--list-metrics", action="store_true", help="print the metric names in the archive")
+    parser.add_argument("--events", action="store_true", help="print the fault events of each run found")
+    parser.add_argument("--overlay", metavar="FIELD", help="plot this telemetry field of every run found")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(os.path.join(args.archive, CATALOGUE)):
+        print(f"[ERROR] No run archive in {args.archive}", file=sys.stderr)
+        return 1
+    archive = RunArchive(args.archive)
+    if args.list_metrics:
+        print("\n".join(archive.metric_names()))
+        return 0
+    rows = archive.find(args.recipe, args.kind, args.since, args.until, args.where, args.rig, args.limit)
+    shown = args.metric or [c[0] for c in args.where]
+    print(format_runs(rows, archive.metrics([r["id"] for r in rows], shown) if shown else None, shown))
+    print(f"{len(rows)} runs")
+    if args.events:
+        for row in rows:
+            for t, kind, message in archive.events(row["id"]):
+                print(f"run {row['id']} {t:8.2f} s [{kind}] {message}")
+    if args.overlay and rows:
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import LineCollection
+        traces = archive.overlay(rows, args.overlay)
+        fig, ax = plt.subplots()
+        ax.add_collection(LineCollection([np.column_stack([t, y]) for _, t, y in traces], linewidths=0.8,
+                                         colors=plt.cm.viridis(np.linspace(0, 1, max(len(traces), 1)))))
+        ax.autoscale()
+        ax.set_xlabel("Time from run start (s)")
+        ax.set_ylabel(args.overlay)
+        ax.set_title(f"{len(traces)} runs")
+        plt.show()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Common clock for the histories, and the mapping of the Arduino's clock onto it.
+
+Histories are stamped in integer nanoseconds on a RunClock: time.monotonic_ns()
+counted from the moment the Data_Handler was created. Data_Handler.run_start_ns
+marks where the current test started on that clock, so a test's time axis is
+(t - run_start_ns) / NS. Monotonic time does not jump when the computer's clock
+is set or synced; time.time() is only used to print wall clock times.
+
+Sketch 1.5+ stamps every telemetry line with its micros() at the moment the
+readings were taken ("D,<micros>,..." see telemetry_stream.py). ClockSync
+maps those stamps onto host monotonic time, so a sample's time no longer
+includes the USB/serial buffering and read timeouts on the host side:
+
+    host = host origin + slope * (board - board origin) + intercept
+
+A line can arrive late (USB polling, the host reading a burst a while after it
+came in) but never before it was sent, so only the least delayed line of each
+couple of seconds is kept, for the last few minutes (the crystal runs tens of
+ppm off the host clock and drifts with temperature). The fit is the line under
+all of them that is closest to them on average: the edge of their lower convex
+hull above their mean board time. A least squares fit would follow the typical
+delay instead, which changes when the stream starts and, with the host reading
+on a fixed schedule, walks along with the drift it is meant to measure.
+"""
+import collections
+import time
+import numpy as np
+
+NS = 1_000_000_000 # nanoseconds per second
+
+
+class RunClock:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.epoch_ns = time.monotonic_ns()
+        self.epoch_wall = time.time() # wall clock at the epoch, for exports and other processes
+
+    def now_ns(self):
+        return time.monotonic_ns() - self.epoch_ns
+
+    def from_monotonic(self, t):
+        """Run clock [ns] of a time.monotonic() time, or an array of them."""
+        if np.ndim(t):
+            return np.round(np.asarray(t) * NS).astype(np.int64) - self.epoch_ns
+        return int(round(t * NS)) - self.epoch_ns
+
+    def to_wall(self, t_ns):
+        """time.time() of a run clock time."""
+        return self.epoch_wall + t_ns / NS
+
+    def from_wall(self, wall):
+        """Run clock [ns] of a time.time() time, e.g. one from another process."""
+        return int(round((wall - self.epoch_wall) * NS))
+
+
+class ClockSync:
+    """
+    Running fit of the Arduino's clock against host time.monotonic().
+
+    Args:
+        window: board time the least delayed observation is picked from [s]
+        windows: windows the fit spans, the oldest is dropped for each new one so
+            the fit follows the crystal warming up
+        max_drift: largest clock rate difference believed, the fit is clamped to it
+    """
+
+    def __init__(self, window=2.0, windows=120, max_drift=0.01):
+        self.window = window
+        self.max_drift = max_drift
+        self.minima = collections.deque(maxlen=windows) # (board, host) least delayed observation of each closed window
+        self.reset()
+
+    def reset(self):
+        """Forget the board's clock, e.g. after a reconnect (the board may have rebooted)."""
+        self.origin = None # (board, host) of the first observation, the fit is centered on it
+        self.minima.clear()
+        self.current = None # least delayed observation of the open window
+        self.window_end = None
+        self.slope = 1.0
+        self.base = None # intercept putting the line under every closed window's observation
+        self.intercept = 0.0
+        self.observations = 0
+
+    def observe(self, board, host):
+        """
+        Add one line's board time [s] and the host time.monotonic() it had arrived by.
+
+        The newest line of a burst is the one to pass, it waited the least.
+        """
+        if self.origin is None:
+            self.origin = (board, host)
+            self.window_end = self.window
+        x, y = board - self.origin[0], host - self.origin[1]
+        if x >= self.window_end and self.current is not None:
+            self.minima.append(self.current)
+            self.current = None
+            self.window_end = x + self.window
+            self._fit()
+        if self.current is None or y - x < self.current[1] - self.current[0]:
+            self.current = (x, y)
+        bound = self.current[1] - self.slope * self.current[0]
+        self.intercept = bound if self.base is None else min(self.base, bound)
+        self.observations += 1
+
+    def _fit(self):
+        """Slope from the lower hull edge over the mean board time of the window minima, then the line under all of them."""
+        hull = [] # lower convex hull, the minima come in board time order
+        for p in self.minima:
+            while len(hull) > 1 and ((hull[-1][0] - hull[-2][0]) * (p[1] - hull[-2][1])
+                                     - (hull[-1][1] - hull[-2][1]) * (p[0] - hull[-2][0])) <= 0:
+                hull.pop()
+            hull.append(p)
+        mean = sum(p[0] for p in self.minima) / len(self.minima)
+        for a, b in zip(hull, hull[1:]):
+            if b[0] >= mean:
+                slope = (b[1] - a[1]) / (b[0] - a[0])
+                self.slope = min(1 + self.max_drift, max(1 - self.max_drift, slope))
+                break
+        self.base = min(y - self.slope * x for x, y in self.minima)
+
+    def to_host(self, board):
+        """Host time.monotonic() of board time [s], works on arrays. Needs one observation first."""
+        return self.origin[1] + self.slope * (board - self.origin[0]) + self.intercept
+
+    def drift_ppm(self):
+        """How much faster the board's clock runs than the host's [ppm]."""
+        return (1 / self.slope - 1) * 1e6
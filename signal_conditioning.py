@@ -0,0 +1,235 @@
+"""
+Per-channel signal conditioning of the sensor readings, applied on the host as
+telemetry arrives.
+
+A sensor in channel_map.json can list "filters", applied in order:
+
+    {"type": "median", "n": 5}                       spike rejection, median of the last n samples
+    {"type": "ema", "tau": 0.5}                      first order low-pass, time constant [s]
+    {"type": "lowpass", "cutoff": 2.0, "q": 0.707}   second order (biquad) low-pass [Hz]
+    {"type": "polynomial", "coeffs": [a2, a1, a0]}   calibration curve, highest power first (numpy.polyval)
+    {"type": "table", "x": [...], "y": [...]}        calibration lookup table, linear between points
+
+Both calibration stages take an optional temperature compensation from another
+sensor's raw reading:
+
+    "temp_channel": "Line Temperature", "temp_ref": 25, "temp_span": 0.002, "temp_offset": 0.0
+    value = curve(x) * (1 + temp_span * (T - temp_ref)) + temp_offset * (T - temp_ref)
+
+Every stage works on a block of samples (a stream burst) at once and keeps its
+state between blocks, and sensors with the same filters go through them
+together as the columns of one array, so a burst costs a few numpy calls
+however many samples and sensors it holds. The low-pass filters are designed for the telemetry rate, and are
+redesigned when it changes (e.g. the stream starting). The IIR filters are
+written as first order recurrences s[i] = p * s[i-1] + x[i], which numpy
+evaluates as a scaled cumulative sum instead of a loop over samples; the
+biquad is split into two of them (one per pole) by partial fractions. Filters
+start from the first sample held steady, so a pressure does not ramp up from 0.
+"""
+import json
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def recurrence(p, x, s):
+    """
+    s[i] = p * s[i-1] + x[i] down the columns of a block, without a Python loop.
+
+    Args:
+        p: pole, |p| < 1 (may be complex)
+        x: (samples x columns) block of inputs
+        s: state of each column before the block
+    Returns:
+        (s for every sample, state after the block)
+    """
+    out = np.empty(x.shape, dtype=np.result_type(p, x, s))
+    if p == 0:
+        out[:] = x
+        return out, out[-1] if len(x) else s
+    step = max(1, int(230 / -np.log(abs(p)))) # |p| ** -step stays below 1e100
+    for lo in range(0, len(x), step):
+        chunk = x[lo:lo + step]
+        pk = (p ** np.arange(len(chunk)))[:, None]
+        out[lo:lo + len(chunk)] = pk * (p * s + np.cumsum(chunk / pk, axis=0))
+        s = out[lo + len(chunk) - 1]
+    return out, s
+
+
+class Median:
+    def __init__(self, n=5):
+        self.n = int(n)
+        self.reset()
+
+    def reset(self):
+        self.history = None # the last n - 1 inputs
+
+    def process(self, x, sensors, rate):
+        if self.n < 2:
+            return x
+        if self.history is None:
+            self.history = np.repeat(x[:1], self.n - 1, axis=0)
+        buf = np.concatenate([self.history, x])
+        self.history = buf[-(self.n - 1):]
+        ordered = np.sort(sliding_window_view(buf, self.n, axis=0), axis=-1) # sorting a few values beats np.median's overhead
+        mid = self.n // 2
+        return ordered[..., mid] if self.n % 2 else (ordered[..., mid - 1] + ordered[..., mid]) / 2
+
+
+class EMA:
+    def __init__(self, tau=0.5):
+        self.tau = float(tau)
+        self.rate = None
+        self.reset()
+
+    def reset(self):
+        self.state = None
+
+    def process(self, x, sensors, rate):
+        if rate != self.rate:
+            self.rate = rate
+            self.a = 1 - np.exp(-1 / (rate * self.tau)) if self.tau > 0 else 1.0
+        if self.state is None:
+            self.state = x[0] / self.a # y = a * s, held at the first sample
+        s, self.state = recurrence(1 - self.a, x, self.state)
+        return self.a * s
+
+
+class Lowpass:
+    def __init__(self, cutoff=2.0, q=0.707):
+        self.cutoff = float(cutoff)
+        self.q = float(q)
+        self.rate = None
+        self.reset()
+
+    def reset(self):
+        self.state = None
+
+    def _design(self, rate):
+        """RBJ cookbook low-pass, split into y = c0 * x + sum(A * s) with s[i] = p * s[i-1] + x[i] per pole."""
+        self.rate = rate
+        self.bypass = self.cutoff >= 0.45 * rate # nothing to filter below the Nyquist rate
+        if self.bypass:
+            return
+        w0 = 2 * np.pi * self.cutoff / rate
+        alpha = np.sin(w0) / (2 * self.q)
+        a0 = 1 + alpha
+        b0 = b2 = (1 - np.cos(w0)) / 2 / a0
+        b1 = (1 - np.cos(w0)) / a0
+        a1, a2 = -2 * np.cos(w0) / a0, (1 - alpha) / a0
+        p1, p2 = np.roots([1, a1, a2]).astype(complex)
+        if abs(p1 - p2) < 1e-9: # critically damped, keep the partial fractions finite
+            p2 = p2 * (1 - 1e-7)
+        self.c0 = b2 / a2
+        r0, r1 = b0 - self.c0, b1 - self.c0 * a1 # remainder of the division by the denominator
+        self.poles = np.array([p1, p2])
+        self.gains = np.array([(r0 + r1 / p1) / (1 - p2 / p1), (r0 + r1 / p2) / (1 - p1 / p2)])
+        self.state = None
+
+    def process(self, x, sensors, rate):
+        if rate != self.rate:
+            self._design(rate)
+        if self.bypass:
+            return x
+        if self.state is None:
+            self.state = x[0] / (1 - self.poles[:, None]) # steady state at the first sample
+        y = self.c0 * x
+        for k in range(2):
+            s, self.state[k] = recurrence(self.poles[k], x, self.state[k])
+            y = y + (self.gains[k] * s).real
+        return y
+
+
+class _Calibration:
+    """Shared temperature compensation of the calibration curves."""
+
+    def __init__(self, temp_channel=None, temp_ref=25.0, temp_span=0.0, temp_offset=0.0):
+        self.temp_channel = temp_channel
+        self.temp_column = None # set by SignalConditioner
+        self.temp_ref = float(temp_ref)
+        self.temp_span = float(temp_span)
+        self.temp_offset = float(temp_offset)
+
+    def reset(self):
+        pass
+
+    def process(self, x, sensors, rate):
+        y = self.curve(x)
+        if self.temp_column is not None:
+            dT = sensors[:, self.temp_column, None] - self.temp_ref
+            y = y * (1 + self.temp_span * dT) + self.temp_offset * dT
+        return y
+
+
+class Polynomial(_Calibration):
+    def __init__(self, coeffs, **temp):
+        super().__init__(**temp)
+        self.coeffs = np.asarray(coeffs, dtype=float)
+
+    def curve(self, x):
+        return np.polyval(self.coeffs, x)
+
+
+class Table(_Calibration):
+    def __init__(self, x, y, **temp):
+        super().__init__(**temp)
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+
+    def curve(self, x):
+        return np.interp(x, self.x, self.y)
+
+
+STAGES = {"median": Median, "ema": EMA, "lowpass": Lowpass, "polynomial": Polynomial, "table": Table}
+
+
+class SignalConditioner:
+    """
+    The filter chains of every sensor of a channel map.
+
+    process() takes a block of raw sensor rows (samples x sensors, channel map
+    order) and returns the conditioned block; sensors without filters pass
+    through unchanged.
+    """
+
+    def __init__(self, channels):
+        names = [c.name for c in channels.sensors]
+        groups = {} # filter config -> sensor positions using it
+        for i, c in enumerate(channels.sensors):
+            if c.extra.get("filters"):
+                groups.setdefault(json.dumps(c.extra["filters"], sort_keys=True), []).append(i)
+        self.chains = [] # (sensor positions, stages)
+        for config, columns in groups.items():
+            stages = []
+            for spec in json.loads(config):
+                kind = spec.pop("type", None)
+                if kind not in STAGES:
+                    raise ValueError(f"Unknown filter type '{kind}' for {names[columns[0]]}")
+                stage = STAGES[kind](**spec)
+                if getattr(stage, "temp_channel", None):
+                    stage.temp_column = names.index(stage.temp_channel)
+                stages.append(stage)
+            self.chains.append((columns, stages))
+        self.active = bool(self.chains)
+        self.indices = [c.index for c in channels.sensors] # fields of the telemetry line, in sensor order
+
+    def reset(self):
+        """Restart every filter from the next sample, e.g. after a reconnect."""
+        for _, stages in self.chains:
+            for stage in stages:
+                stage.reset()
+
+    def process(self, sensors, rate):
+        """
+        Condition a block of sensor readings.
+
+        Args:
+            sensors: (samples x sensors) raw readings
+            rate: telemetry rate the block was sampled at [Hz]
+        """
+        out = np.array(sensors, dtype=float)
+        for columns, stages in self.chains:
+            x = out[:, columns]
+            for stage in stages:
+                x = stage.process(x, sensors, rate)
+            out[:, columns] = x
+        return out
@@ -0,0 +1,282 @@
+"""
+Simulated Arduino for running the controller without hardware.
+
+Speaks the sketch's serial protocol (ID handshake, setpoint frames, "S" ramp
+segments, "P" polls, "!" E-stop, "T" continuous telemetry, "D,<micros>,"
+stamped telemetry lines, seq counter restarting on a state change, "W" command
+watchdog and "K" heartbeats) through the
+small part of the pyserial interface Data_Handler uses, so it can be handed to
+ConnectionManager.attach() in place of a real port. MFC responses follow their
+setpoints with a first-order lag and the sensors sit at ambient values with a
+little noise, laid out by the channel map.
+"""
+import collections
+import math
+import random
+import threading
+import time
+
+FIRMWARE_ID = "ID,SBGC,1.6"
+SEG_QUEUE_SIZE = 16 # same as the sketch
+BAUD = 115200
+STREAM_MAX_HZ = 200
+STREAM_LINE_BYTES = 100
+STREAM_PINS = 10
+ADC_READ_US = 112
+WATCHDOG_MAX_MS = 60000
+NOISE = 0.002 # relative sensor noise of one read
+
+
+class SimulatedArduino:
+    """
+    Args:
+        channels: ChannelMap of the simulated rig
+        time_constant: MFC response lag [s]
+        reply_delay: time from a line being written to its answer arriving [s]
+        stall_after, stall_for: stop answering for stall_for seconds once stall_after
+            seconds have passed, like a hung USB link (None never stalls)
+        clock_drift: how much faster the board's micros() runs than the host clock [ppm]
+    """
+
+    def __init__(self, channels, time_constant=0.3, reply_delay=0.002, stall_after=None, stall_for=0.0, seed=None,
+                 clock_drift=0.0):
+        self.channels = channels
+        self.time_constant = time_constant
+        self.reply_delay = reply_delay
+        self.stall_at = None if stall_after is None else time.monotonic() + stall_after
+        self.stall_for = stall_for
+        self.random = random.Random(seed)
+        self.timeout = 1.0
+        self.is_open = True
+
+        self.state = 1
+        self.valve = 0
+        self.seq = 1
+        self.setpoints = [0.0] * channels.n_mfcs
+        self.responses = [0.0] * channels.n_mfcs
+        self.ambient = {"Mixing Chamber Pressure": 14.7, "Line Pressure": 15.0, "Gas Sensor 1": 0.3,
+                        "Gas Sensor 2": 0.2, "Line Temperature": 22.0, "E-Stop": 1}
+        self.segments = collections.deque() # (duration [s], valve, targets)
+        self.segment_start = None # monotonic time the active segment started
+        self.segment_from = None # setpoints when the active segment started
+        self.last_update = time.monotonic()
+        self.replies = collections.deque() # (time.monotonic() the reply arrives, line)
+        self.boot = time.monotonic() # micros() counts from here
+        self.clock_rate = 1 + clock_drift * 1e-6
+        self.readings_micros = 0 # micros() of the latest stream frame, replies while streaming repeat it
+        self.stream_rate = 0
+        self.oversample = 1
+        self.next_stream = None # monotonic time of the next stream frame
+        self.watchdog_ms = 0 # command watchdog, 0 = off
+        self.last_command = time.monotonic() # time of the last complete command line
+        self.lock = threading.Lock()
+        self.arrived = threading.Condition(self.lock)
+
+    # ---------- pyserial interface ---------- #
+    @property
+    def in_waiting(self):
+        now = time.monotonic()
+        with self.lock:
+            self._stream_until(now)
+            return sum(len(r) for t, r in self.replies if t <= now)
+
+    def write(self, data):
+        with self.lock:
+            self._stream_until(time.monotonic())
+            for line in data.decode("utf-8").splitlines():
+                self._handle(line.strip())
+            self.arrived.notify_all()
+        return len(data)
+
+    def readline(self):
+        if self.stall_at is not None and time.monotonic() >= self.stall_at:
+            self.stall_at = None
+            time.sleep(self.stall_for)
+            return b""
+        deadline = time.monotonic() + self.timeout # a real port gives up after its timeout
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self._stream_until(now)
+                if self.replies and self.replies[0][0] <= now:
+                    return self.replies.popleft()[1]
+                if now >= deadline:
+                    return b""
+                wake = min(deadline, self.replies[0][0]) if self.replies else deadline
+                if self.next_stream is not None:
+                    wake = min(wake, self.next_stream + self.reply_delay)
+                self.arrived.wait(max(0.0, wake - now))
+
+    def read(self, size=1):
+        """Whatever has arrived, up to size bytes, without waiting (the host only asks for in_waiting)."""
+        now = time.monotonic()
+        out = []
+        n = 0
+        with self.lock:
+            self._stream_until(now)
+            while self.replies and self.replies[0][0] <= now and n < size:
+                t, line = self.replies.popleft()
+                if len(line) > size - n: # the rest of the line stays for the next read
+                    self.replies.appendleft((t, line[size - n:]))
+                    line = line[:size - n]
+                out.append(line)
+                n += len(line)
+        return b"".join(out)
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self.replies.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+    # ---------- Protocol ---------- #
+    def _handle(self, line):
+        if not line:
+            return
+        self.last_command = time.monotonic()
+        if line == "ID":
+            self._reply(FIRMWARE_ID + "\n")
+            return
+        self._update()
+        if line.startswith("T,"):
+            return self._stream_command(line)
+        if line == "!": # one byte E-stop: everything off, no parsing
+            return self._estop()
+        if line == "K": # heartbeat, no reply
+            return
+        fields = line.split(",")
+        try:
+            if fields[0] == "P":
+                pass
+            elif fields[0] == "W":
+                ms = int(fields[1])
+                if not 0 <= ms <= WATCHDOG_MAX_MS:
+                    return self._error("Watchdog must be 0 to 60000 ms")
+                self.watchdog_ms = ms
+            elif fields[0] == "S":
+                state, valve, duration = int(fields[1]), int(fields[2]), int(fields[3]) / 1000
+                if len(self.segments) >= SEG_QUEUE_SIZE:
+                    return self._error("Segment queue full")
+                self._set_state(state)
+                if not self.segments:
+                    self.segment_start, self.segment_from = time.monotonic(), list(self.setpoints)
+                self.segments.append((duration, valve, [float(v) for v in fields[4:4 + self.channels.n_mfcs]]))
+            else:
+                state, valve = int(fields[0]), int(fields[1])
+                if valve not in (0, 1):
+                    return self._error("Valve must be 0 or 1")
+                self._set_state(state)
+                self.segments.clear() # a direct setpoint frame overrides any queued ramp
+                self.valve = valve
+                self.setpoints = [float(v) for v in fields[2:2 + self.channels.n_mfcs]]
+                if state == 0:
+                    self.setpoints = [0.0] * self.channels.n_mfcs
+                    self.valve = 0
+        except (IndexError, ValueError):
+            return self._error("Invalid field count")
+        self._send_line()
+
+    def _estop(self, at=None):
+        self._set_state(0)
+        self.segments.clear()
+        self.valve = 0
+        self.setpoints = [0.0] * self.channels.n_mfcs
+        self._send_line(at)
+
+    def _check_watchdog(self, now):
+        """The sketch's command watchdog: no command for watchdog_ms while flows run stops them, at the moment it expired."""
+        if not self.watchdog_ms or self.state not in (2, 3):
+            return
+        expired = self.last_command + self.watchdog_ms / 1000
+        if now > expired:
+            self._update(expired)
+            self._error("Command watchdog expired", at=expired)
+            self._estop(at=expired)
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.seq = 1
+
+    def _reply(self, line, at=None):
+        self.replies.append(((time.monotonic() if at is None else at) + self.reply_delay, line.encode("utf-8")))
+
+    def _stream_command(self, line):
+        fields = line.split(",")
+        try:
+            rate = int(fields[1])
+            oversample = int(fields[2]) if len(fields) > 2 else 1
+        except (IndexError, ValueError):
+            return self._error("Invalid stream field count (expected 1 or 2)")
+        if rate == 0:
+            self.stream_rate, self.next_stream = 0, None
+        elif rate > STREAM_MAX_HZ or rate * STREAM_LINE_BYTES * 10 > BAUD:
+            return self._error("Stream rate too high for the baud rate")
+        elif oversample < 1 or rate * oversample * STREAM_PINS * ADC_READ_US > 500000:
+            return self._error("Oversampling too high for the stream rate")
+        else:
+            self.stream_rate, self.oversample = rate, oversample
+            self.next_stream = time.monotonic() + 1 / rate
+        self._update()
+        self._send_line()
+
+    def _stream_until(self, now):
+        """Queue the stream frames the board would have sent by now, each stamped with its micros()."""
+        while self.next_stream is not None and self.next_stream <= now:
+            t = self.next_stream
+            self._check_watchdog(t)
+            self._update(t)
+            self.readings_micros = self._micros(t)
+            self._reply(f"D,{self.readings_micros}," + self._frame(), at=t)
+            self.seq += 1
+            self.next_stream += 1 / (self.stream_rate * self.clock_rate) # on the board's clock
+        self._check_watchdog(now)
+
+    def _error(self, message, at=None):
+        self._reply(f"ERR,{self.seq},{message}\n", at)
+        self.seq += 1
+
+    def _update(self, now=None):
+        """Advance the ramp and the MFC lag to now."""
+        now = time.monotonic() if now is None else max(now, self.last_update)
+        while self.segments:
+            duration, valve, targets = self.segments[0]
+            elapsed = now - self.segment_start
+            self.valve = valve
+            if elapsed < duration:
+                a = elapsed / duration
+                self.setpoints = [s + (t - s) * a for s, t in zip(self.segment_from, targets)]
+                break
+            self.setpoints = self.segment_from = targets
+            self.segment_start += duration
+            self.segments.popleft()
+        dt = now - self.last_update
+        self.last_update = now
+        a = min(1.0, dt / self.time_constant) if self.time_constant else 1.0
+        self.responses = [r + (s - r) * a for r, s in zip(self.responses, self.setpoints)]
+
+    def _send_line(self, at=None):
+        micros = self.readings_micros if self.stream_rate else self._micros(time.monotonic() if at is None else at)
+        self._reply(f"D,{micros}," + self._frame(), at)
+        self.seq += 1
+
+    def _micros(self, t):
+        return int((t - self.boot) * self.clock_rate * 1e6) % 2 ** 32
+
+    def _frame(self):
+        """Telemetry line at the current seq. While streaming the readings are averages of oversample reads."""
+        noise = NOISE / math.sqrt(self.oversample if self.stream_rate else 1)
+        parts = ["0"] * self.channels.frame_length
+        parts[self.channels.seq_index] = str(self.seq)
+        parts[self.channels.state_index] = str(self.state)
+        parts[self.channels.valve_index] = str(self.valve)
+        for c, r in zip(self.channels.mfcs, self.responses):
+            parts[c.index] = f"{r:.3f}"
+        for c in self.channels.sensors:
+            value = self.ambient.get(c.name, 0.0)
+            parts[c.index] = str(value) if c.cast is int else f"{value * (1 + self.random.gauss(0, noise)):.3f}"
+        return ",".join(parts) + "\n"
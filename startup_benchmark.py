@@ -0,0 +1,138 @@
+"""
+Startup time benchmark for the controller GUI.
+
+Launches the app several times in fresh processes and reports the median time
+from process launch to:
+    imports      all app modules imported (source runs only)
+    first frame  window drawn with the control buttons and E-stop
+    graphs       overview graphs built (matplotlib imported in the background)
+
+    python startup_benchmark.py --runs 5
+    python startup_benchmark.py --budget 1.5   # exit 1 if the first frame takes longer than 1.5 s
+    python startup_benchmark.py --exe dist/SyntheticBatteryGasController_onedir/SyntheticBatteryGasController.exe
+
+Without a display only the import phase is measured. The app is started as
+SyntheticBatteryGasController.py does, with SBGC_STARTUP_REPORT set so it
+writes its timings to a file and closes once the graphs are up.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PHASES = ("interpreter", "imports", "first frame", "graphs")
+
+
+def report_startup(ui, path):
+    """
+    Called by SyntheticBatteryGasController.py in a timing run. Records when the first
+    frame and the graphs are up, writes the times to path as JSON and closes the app.
+    """
+    launched = float(os.environ.get("SBGC_LAUNCHED", time.time()))
+    result = {k: v - launched for k, v in json.loads(os.environ.get("SBGC_MARKS", "{}")).items()}
+
+    def first_frame():
+        result["first frame"] = time.time() - launched
+        wait_for_graphs()
+
+    def wait_for_graphs():
+        if ui.canvas is None:
+            ui.after(5, wait_for_graphs)
+            return
+        ui.canvas.draw()
+        result["graphs"] = time.time() - launched
+        with open(path, "w") as f:
+            json.dump(result, f)
+        if ui.cs is not None:
+            ui.cs.running = False
+        ui.destroy()
+
+    ui.after_idle(first_frame)
+
+
+def child(launched, path):
+    """Source run: import and start the app the same way the main script does."""
+    marks = {"interpreter": time.time()}
+    import SyntheticBatteryGasController # module level imports of the app
+    marks["imports"] = time.time()
+    os.environ["SBGC_MARKS"] = json.dumps(marks)
+    try:
+        import runpy
+        runpy.run_path(os.path.join(HERE, "SyntheticBatteryGasController.py"), run_name="__main__")
+    except Exception as e: # no display
+        with open(path, "w") as f:
+            json.dump({**{k: v - launched for k, v in marks.items()}, "error": str(e)}, f)
+
+
+def run_once(exe=None):
+    """Launch the app once and return its phase times [s]."""
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        launched = time.time()
+        env = dict(os.environ, SBGC_STARTUP_REPORT=path, SBGC_LAUNCHED=repr(launched))
+        if exe:
+            cmd, cwd = [exe], os.path.dirname(os.path.abspath(exe))
+        else:
+            cmd, cwd = [sys.executable, os.path.abspath(__file__), "--child", path], HERE
+        subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, timeout=120)
+        with open(path) as f:
+            text = f.read()
+        return json.loads(text) if text else {"error": "app exited without a report"}
+    finally:
+        os.remove(path)
+
+
+def benchmark(runs=5, exe=None):
+    """Median, min and max of each phase over several cold starts: {phase: (median, min, max)}, plus any error."""
+    results = [run_once(exe) for _ in range(runs)]
+    summary = {}
+    for phase in PHASES:
+        values = [r[phase] for r in results if phase in r]
+        if values:
+            summary[phase] = (statistics.median(values), min(values), max(values))
+    errors = [r["error"] for r in results if "error" in r]
+    if errors:
+        summary["error"] = errors[0]
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure GUI startup time.")
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts to time (default: 5)")
+    parser.add_argument("--exe", default=None, help="time a built exe instead of the source")
+    parser.add_argument("--budget", type=float, default=None, help="fail if the median first frame (or imports, headless) exceeds this many seconds")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        child(float(os.environ["SBGC_LAUNCHED"]), args.child)
+        return 0
+
+    summary = benchmark(args.runs, args.exe)
+    if "error" in summary:
+        print(f"Startup did not complete ({summary['error']}), only earlier phases were measured.")
+    for phase in PHASES:
+        if phase in summary:
+            med, lo, hi = summary[phase]
+            print(f"{phase:>12}: median {1000 * med:7.1f} ms   min {1000 * lo:7.1f} ms   max {1000 * hi:7.1f} ms")
+
+    if args.budget is not None:
+        phase = "first frame" if "first frame" in summary else "imports"
+        if phase not in summary:
+            print("[FAIL] nothing was measured")
+            return 1
+        if summary[phase][0] > args.budget:
+            print(f"[FAIL] {phase} {summary[phase][0]:.3f} s is over the {args.budget:.3f} s budget")
+            return 1
+        print(f"[PASS] {phase} {summary[phase][0]:.3f} s is within the {args.budget:.3f} s budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+Shared-memory telemetry bus: live samples for other processes on this computer.
+
+Data_Handler publishes every telemetry sample into a ring buffer in a named
+multiprocessing.shared_memory block. Other tools (DAQ, camera sync, ...) map
+the block and read it without touching the serial port. The writer never
+waits for readers; a reader that falls more than one ring behind loses the
+oldest samples and is told how many.
+
+Layout (little endian), default block name "sbgc_telemetry":
+
+    offset  size  field
+    0       8     magic b"SBGCTEL1"
+    8       4     uint32 layout version (1)
+    12      4     uint32 header size H in bytes (records start here)
+    16      4     uint32 record size R in bytes = 8 + 8 * n_fields
+    20      4     uint32 capacity, records in the ring
+    24      4     uint32 n_fields
+    28      4     uint32 length of the channel JSON
+    32      8     uint64 write index: records written so far
+    40      8     float64 time.time() the bus was created
+    64      ...   channel JSON: {"fields": [...], "units": [...]}
+    H + R*k       record k: uint64 id, then n_fields float64 values
+
+Record i (counting from 0) lives in slot i % capacity. The writer sets the slot
+id to 0, writes the values, sets the id to i + 1 and then advances the write
+index, so a reader knows a record is complete and unchanged if its id still
+reads i + 1 after the values were copied.
+
+Reader client, prints samples as they arrive:
+
+    python telemetry_bus.py
+    python telemetry_bus.py --fields "MFC 1 Response" "Mixing Chamber Pressure"
+"""
+import argparse
+import json
+import struct
+import sys
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+BUS_NAME = "sbgc_telemetry"
+MAGIC = b"SBGCTEL1"
+LAYOUT_VERSION = 1
+HEADER_FORMAT = "<8sIIIIII" # magic, version, header size, record size, capacity, n_fields, JSON length
+WRITE_INDEX_OFFSET = 32
+CREATED_OFFSET = 40
+CHANNELS_OFFSET = 64
+
+
+def telemetry_fields(channels):
+    """Field names and units of one bus record for a channel map, in record order."""
+    fields = [("Time", "s"), ("Seq", ""), ("State", ""), ("Valve", "")]
+    fields += [(f"{c.name} Response", c.units) for c in channels.mfcs]
+    fields += [(c.name, c.units) for c in channels.sensors]
+    fields += [(f"{c.name} Setpoint", c.units) for c in channels.mfcs]
+    fields += [("Achieved HRR", "kW"), ("Energy Released", "kJ")]
+    fields += [("Chamber Fuel", "%"), ("Flammability Margin", "%")]
+    return [f for f, _ in fields], [u for _, u in fields]
+
+
+def _attach(name, untrack=True):
+    """
+    Open an existing block without registering it for cleanup, so a reader exiting never unlinks it.
+    A process whose child made the block shares the child's resource tracker and must leave it alone (untrack=False).
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if not untrack:
+            return shm
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+class TelemetryBus:
+    """Writer side of the bus, owned by Data_Handler."""
+
+    def __init__(self, fields, units=None, name=BUS_NAME, capacity=8192):
+        self.fields = list(fields)
+        self.n_fields = len(self.fields)
+        self.capacity = capacity
+        meta = json.dumps({"fields": self.fields, "units": list(units or [""] * self.n_fields)}).encode("utf-8")
+        self.header_size = -(-(CHANNELS_OFFSET + len(meta)) // 64) * 64 # records start on a 64 byte boundary
+        self.record_size = 8 + 8 * self.n_fields
+        size = self.header_size + self.record_size * capacity
+
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError: # left behind by a crashed run
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = name
+
+        buf = self.shm.buf
+        buf[:self.header_size] = bytes(self.header_size)
+        struct.pack_into(HEADER_FORMAT, buf, 0, MAGIC, LAYOUT_VERSION, self.header_size,
+                         self.record_size, capacity, self.n_fields, len(meta))
+        struct.pack_into("<d", buf, CREATED_OFFSET, time.time())
+        buf[CHANNELS_OFFSET:CHANNELS_OFFSET + len(meta)] = meta
+
+        self._write_index = np.ndarray((1,), dtype="<u8", buffer=buf, offset=WRITE_INDEX_OFFSET)
+        dtype = np.dtype([("id", "<u8"), ("values", "<f8", (self.n_fields,))])
+        self._records = np.ndarray((capacity,), dtype=dtype, buffer=buf, offset=self.header_size)
+        self._ids = self._records["id"]
+        self._values = self._records["values"]
+        self.index = 0
+
+    @classmethod
+    def for_channels(cls, channels, name=BUS_NAME, capacity=8192):
+        return cls(*telemetry_fields(channels), name=name, capacity=capacity)
+
+    def publish(self, values):
+        """Append one record (n_fields numbers). Never blocks."""
+        slot = self.index % self.capacity
+        self._ids[slot] = 0
+        self._values[slot] = values
+        self.index += 1
+        self._ids[slot] = self.index
+        self._write_index[0] = self.index
+
+    def close(self):
+        """Remove the block, readers keep their mapping until they close it."""
+        self._write_index = self._records = self._ids = self._values = None
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except (FileNotFoundError, BufferError):
+            pass
+
+
+class TelemetryReader:
+    """
+    Reader side of the bus, for other processes.
+
+    read() returns the records written since the last call as a copied
+    (records x fields) array; view() gives the mapped ring itself with no copy.
+    """
+
+    def __init__(self, name=BUS_NAME, untrack=True):
+        self.shm = _attach(name, untrack)
+        buf = self.shm.buf
+        (magic, version, self.header_size, self.record_size, self.capacity,
+         self.n_fields, meta_len) = struct.unpack_from(HEADER_FORMAT, buf, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            self.shm.close()
+            raise ValueError(f"'{name}' is not a telemetry bus (layout {version})")
+        meta = json.loads(bytes(buf[CHANNELS_OFFSET:CHANNELS_OFFSET + meta_len]).decode("utf-8"))
+        self.fields = meta["fields"]
+        self.units = meta["units"]
+        self.created = struct.unpack_from("<d", buf, CREATED_OFFSET)[0]
+
+        self._write_index = np.ndarray((1,), dtype="<u8", buffer=buf, offset=WRITE_INDEX_OFFSET)
+        dtype = np.dtype([("id", "<u8"), ("values", "<f8", (self.n_fields,))])
+        self._records = np.ndarray((self.capacity,), dtype=dtype, buffer=buf, offset=self.header_size)
+        self._ids = self._records["id"]
+        self._values = self._records["values"]
+        self.next_index = int(self._write_index[0]) # start with the next new record
+        self.dropped = 0 # records overwritten before they were read
+
+    def field(self, name):
+        """Column of a field in the arrays returned by read()."""
+        return self.fields.index(name)
+
+    def write_index(self):
+        return int(self._write_index[0])
+
+    def view(self):
+        """The ring itself (no copy): structured array with "id" and "values", slot = record index % capacity."""
+        return self._records
+
+    def read(self, max_records=None):
+        """Copy out the complete records written since the last read, oldest first."""
+        end = self.write_index()
+        start = max(self.next_index, end - self.capacity + 1) # the slot being written next may be in use
+        if start > self.next_index:
+            self.dropped += start - self.next_index
+        if max_records is not None:
+            end = min(end, start + max_records)
+        if end <= start:
+            return np.empty((0, self.n_fields))
+
+        slots = np.arange(start, end) % self.capacity
+        expected = np.arange(start, end, dtype="<u8") + 1
+        before = self._ids[slots] # fancy indexing copies
+        values = self._values[slots]
+        # The writer zeroes a slot's id before touching its values, so an id still the same after the copy means the values are whole
+        valid = (before == expected) & (self._ids[slots] == expected)
+        self.dropped += int((~valid).sum())
+        self.next_index = end
+        return values[valid]
+
+    def latest(self):
+        """The newest complete record as {field: value}, or None if nothing has been written yet."""
+        for _ in range(3):
+            index = self.write_index()
+            if index == 0:
+                return None
+            slot = (index - 1) % self.capacity
+            if self._ids[slot] != index:
+                continue
+            values = self._values[slot].tolist()
+            if self._ids[slot] == index: # not overwritten while copying
+                return dict(zip(self.fields, values))
+        return None
+
+    def wait(self, timeout=None, poll=0.002):
+        """Block until new records arrive (polling, the writer is never signalled). Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.write_index() <= self.next_index:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(poll)
+        return True
+
+    def close(self):
+        self._write_index = self._records = self._ids = self._values = None
+        self.shm.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print live telemetry from the controller's shared-memory bus.")
+    parser.add_argument("--name", default=BUS_NAME, help=f"bus name (default: {BUS_NAME})")
+    parser.add_argument("--fields", nargs="+", default=None, help="fields to print (default: all)")
+    args = parser.parse_args(argv)
+
+    try:
+        reader = TelemetryReader(args.name)
+    except FileNotFoundError:
+        print(f"[ERROR] No telemetry bus '{args.name}', is the controller running?", file=sys.stderr)
+        return 1
+    fields = args.fields or reader.fields
+    cols = [reader.field(f) for f in fields]
+    print(",".join(fields))
+    try:
+        while True:
+            if reader.wait(timeout=1.0):
+                for row in reader.read():
+                    print(",".join(f"{row[c]:.6g}" for c in cols))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if reader.dropped:
+            print(f"[INFO] {reader.dropped} samples were overwritten before they were read", file=sys.stderr)
+        reader.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
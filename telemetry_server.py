@@ -0,0 +1,499 @@
+"""
+Network telemetry and command server for remote monitoring and control.
+
+Clients connect over TCP and talk in newline-delimited JSON. Every client can
+subscribe to the live telemetry (the same records as the shared-memory bus in
+telemetry_bus.py). Commands are only accepted after the client has sent the
+token, and they run through the same UI checks as the bottom buttons.
+
+Messages from the client, "id" is optional and echoed in the reply:
+
+    {"cmd": "auth", "token": "..."}
+    {"cmd": "subscribe", "format": "json" | "binary", "decimate": 1}
+    {"cmd": "unsubscribe"}
+    {"cmd": "ping"}
+    {"cmd": "estop"}  {"cmd": "start"}  {"cmd": "stop"}          (need auth)
+    {"cmd": "setpoints", "valve": 1, "flows": [SLPM, ...]}       (need auth)
+
+Messages from the server:
+
+    {"type": "hello", "version": 1, "fields": [...], "units": [...]}   on connect
+    {"type": "reply", "id": ..., "ok": true, "message": "..."}
+    {"type": "telemetry", "records": [[...], ...], "dropped": n}       json subscribers,
+                                                                       NaN and inf values are sent as null
+    binary subscribers get frames instead: one 0x00 byte, then uint32 records,
+    uint32 fields, uint32 dropped (little endian), then records x fields float64
+
+The serial thread only appends each record to a bounded queue per subscriber
+and never waits for the network. A client that cannot keep up loses its
+oldest records ("dropped" counts them since it subscribed); "decimate": N
+queues only every Nth record for clients that want a lower rate.
+
+Enable it by adding server_port (and optionally server_host, default
+127.0.0.1) to state_save.csv. The token is read from the SBGC_SERVER_TOKEN
+environment variable or server_token in state_save.csv, and one is generated
+and saved there if neither is set.
+
+    python telemetry_server.py --port 8765 --token TOKEN                     # print telemetry
+    python telemetry_server.py --port 8765 --token TOKEN --command estop     # send a command
+    python telemetry_server.py --demo                                        # localhost test, no rig needed
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import hmac
+import json
+import math
+import os
+import secrets
+import socket
+import struct
+import sys
+import threading
+import time
+
+from telemetry_bus import telemetry_fields
+
+PROTOCOL_VERSION = 1
+DEFAULT_HOST = "127.0.0.1"
+BINARY_HEADER = "<III" # after the 0x00 marker byte: records, fields, dropped
+MAX_AUTH_FAILURES = 3
+SEND_BUFFER = 64 * 1024 # bytes buffered per client before its queue starts dropping
+COMMAND_TIMEOUT = 5.0 # seconds to wait for the UI to act on a command
+
+
+class _Client:
+    """One connection: its telemetry queue and subscription settings."""
+
+    def __init__(self, writer, queue_size):
+        self.writer = writer
+        self.peer = writer.get_extra_info("peername")
+        self.queue = collections.deque(maxlen=queue_size)
+        self.subscribed = False
+        self.binary = False
+        self.decimate = 1
+        self.count = 0
+        self.dropped = 0
+        self.authenticated = False
+        self.auth_failures = 0
+
+    def offer(self, record):
+        """Called from the serial thread, never blocks."""
+        if not self.subscribed:
+            return
+        self.count += 1
+        if self.count % self.decimate:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1 # the deque drops the oldest record
+        self.queue.append(record)
+
+
+class TelemetryServer:
+    """
+    asyncio TCP server on its own thread.
+
+    commands maps a command name to a handler(message) -> (ok, message). schedule(fn)
+    decides where handlers run; the controller passes the Tk after() so they run on
+    the UI thread like a button press. By default they run on the server thread.
+    """
+
+    def __init__(self, fields, units=None, token=None, host=DEFAULT_HOST, port=0,
+                 commands=None, schedule=None, log=print, queue_size=1024, send_interval=0.05):
+        self.fields = list(fields)
+        self.units = list(units or [""] * len(self.fields))
+        self.token = token
+        self.host = host
+        self.port = port
+        self.commands = dict(commands or {})
+        self.schedule = schedule or (lambda fn: fn())
+        self.log = log
+        self.queue_size = queue_size
+        self.send_interval = send_interval
+        self._clients = () # replaced, never mutated, so publish() can iterate it from another thread
+        self._handlers = set()
+        self._loop = None
+        self._stopping = None
+        self._thread = None
+        self._ready = threading.Event()
+        self.error = None
+
+    def start(self):
+        """Start listening. Raises OSError if the port cannot be opened. Returns the bound port."""
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._serve()), name="TelemetryServer", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.port
+
+    def stop(self):
+        if self._loop is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join(timeout=2)
+
+    def publish(self, values):
+        """Queue one record for every subscriber. Safe to call from any thread, never blocks."""
+        for client in self._clients:
+            client.offer(values)
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            self.error = e
+            self._ready.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with server:
+            await self._stopping.wait()
+            for client in self._clients:
+                client.writer.close() # the handlers see end of stream and finish on their own
+            if self._handlers:
+                await asyncio.wait(self._handlers, timeout=1)
+
+    async def _handle(self, reader, writer):
+        client = _Client(writer, self.queue_size)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        writer.transport.set_write_buffer_limits(high=SEND_BUFFER) # a stalled client backs up into its own queue, not stale buffers
+        self._clients = self._clients + (client,)
+        self._handlers.add(asyncio.current_task())
+        self.log(f"[Server] Client connected from {client.peer}")
+        sender = asyncio.create_task(self._send_telemetry(client))
+        try:
+            self._write(client, {"type": "hello", "version": PROTOCOL_VERSION, "fields": self.fields, "units": self.units})
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                if not await self._on_message(client, line):
+                    break
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            sender.cancel()
+            self._clients = tuple(c for c in self._clients if c is not client)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+            self.log(f"[Server] Client {client.peer} disconnected")
+
+    async def _on_message(self, client, line):
+        """Handle one message. Returns False to close the connection."""
+        try:
+            msg = json.loads(line)
+            cmd = msg["cmd"]
+        except (ValueError, KeyError, TypeError):
+            self._write(client, {"type": "reply", "ok": False, "message": "Expected a JSON object with a 'cmd'."})
+            return True
+        reply = {"type": "reply", "id": msg.get("id"), "cmd": cmd}
+
+        if cmd == "ping":
+            ok, message = True, "pong"
+        elif cmd == "auth":
+            ok = self.token is not None and hmac.compare_digest(str(msg.get("token", "")).encode(), self.token.encode())
+            message = "Authenticated." if ok else "Wrong token."
+            client.authenticated = client.authenticated or ok
+            if not ok:
+                client.auth_failures += 1
+                self.log(f"[Server] Failed authentication from {client.peer}")
+        elif cmd == "subscribe":
+            ok, message = self._subscribe(client, msg)
+        elif cmd == "unsubscribe":
+            client.subscribed = False
+            ok, message = True, "Unsubscribed."
+        elif cmd in self.commands:
+            if not client.authenticated:
+                ok, message = False, "Not authenticated."
+            else:
+                self.log(f"[Server] {client.peer} requested '{cmd}'")
+                ok, message = await self._run_command(self.commands[cmd], msg)
+        else:
+            ok, message = False, f"Unknown command '{cmd}'."
+
+        reply.update(ok=bool(ok), message=message)
+        self._write(client, reply)
+        return client.auth_failures < MAX_AUTH_FAILURES
+
+    def _subscribe(self, client, msg):
+        fmt = msg.get("format", "json")
+        decimate = msg.get("decimate", 1)
+        if fmt not in ("json", "binary") or not isinstance(decimate, int) or decimate < 1:
+            return False, "format must be 'json' or 'binary' and decimate a positive integer."
+        client.binary = fmt == "binary"
+        client.decimate = decimate
+        client.count = client.dropped = 0
+        client.queue.clear()
+        client.subscribed = True
+        return True, f"Subscribed to {len(self.fields)} fields."
+
+    async def _run_command(self, handler, msg):
+        """Run a handler where schedule() puts it and wait for its (ok, message)."""
+        future = concurrent.futures.Future()
+
+        def call():
+            try:
+                future.set_result(handler(msg))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.schedule(call)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False, "The controller did not respond in time."
+        except Exception as e:
+            return False, f"Command failed: {e}"
+
+    async def _send_telemetry(self, client):
+        """Drain the client's queue every send_interval. Only this task waits on a slow client."""
+        while True:
+            await asyncio.sleep(self.send_interval)
+            n = len(client.queue)
+            if not n:
+                continue
+            records = [client.queue.popleft() for _ in range(n)]
+            if client.binary:
+                values = [float(v) for r in records for v in r]
+                client.writer.write(b"\x00" + struct.pack(BINARY_HEADER, len(records), len(self.fields), client.dropped)
+                                    + struct.pack(f"<{len(values)}d", *values))
+            else:
+                # Strict JSON has no NaN (e.g. the flammability margin with no fuel flowing), send null
+                records = [[v if math.isfinite(v) else None for v in r] for r in records]
+                self._write(client, {"type": "telemetry", "records": records, "dropped": client.dropped})
+            try:
+                await client.writer.drain()
+            except ConnectionError:
+                return
+
+    def _write(self, client, message):
+        client.writer.write(json.dumps(message, allow_nan=False).encode("utf-8") + b"\n")
+
+
+def command_handlers(ui):
+    """Map server commands onto the UI's operator requests."""
+
+    def setpoints(msg):
+        try:
+            flows = [float(v) for v in msg["flows"]]
+            valve = int(msg.get("valve", 1))
+        except (KeyError, TypeError, ValueError):
+            return False, "setpoints needs 'flows': [numbers] and optionally 'valve': 0 or 1."
+        return ui.request_custom_setpoints(valve, flows)
+
+    return {
+        "estop": lambda msg: ui.request_estop(),
+        "start": lambda msg: ui.request_start_test(),
+        "stop": lambda msg: ui.request_stop_test(),
+        "setpoints": setpoints,
+    }
+
+
+def start_server(ui, dh):
+    """Start the server if server_port is set in state_save.csv. Returns it, or None if disabled or it failed."""
+    try:
+        port = int(dh.state_saver("load", "server_port", None))
+    except KeyError:
+        return None
+    if port <= 0:
+        return None
+    try:
+        host = dh.state_saver("load", "server_host", None, cast=str)
+    except KeyError:
+        host = DEFAULT_HOST
+    token = os.environ.get("SBGC_SERVER_TOKEN")
+    if not token:
+        try:
+            token = dh.state_saver("load", "server_token", None, cast=str)
+        except KeyError:
+            token = secrets.token_urlsafe(16)
+            dh.state_saver("store", "server_token", token)
+            ui.write_to_terminal("[Server] Generated a command token, it is saved as server_token in state_save.csv")
+
+    fields, units = telemetry_fields(dh.channels)
+    server = TelemetryServer(fields, units, token=token, host=host, port=port, commands=command_handlers(ui),
+                             schedule=lambda fn: ui.after(0, fn), log=ui.write_to_terminal)
+    try:
+        server.start()
+    except OSError as e:
+        ui.write_to_terminal(f"[WARNING] Telemetry server could not listen on {host}:{port}: {e}")
+        return None
+    dh.telemetry_listeners.append(server.publish)
+    ui.write_to_terminal(f"[Server] Listening for telemetry clients on {host}:{server.port}")
+    return server
+
+
+class TelemetryClient:
+    """Blocking client for scripts and the localhost test."""
+
+    def __init__(self, host=DEFAULT_HOST, port=0, timeout=5.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile("rb")
+        self.next_id = 0
+        self.pending = collections.deque() # telemetry that arrived while waiting for a reply
+        hello = self._read()
+        self.fields, self.units = hello["fields"], hello["units"]
+
+    def _read(self):
+        first = self.file.read(1)
+        if not first:
+            raise ConnectionError("server closed the connection")
+        if first == b"\x00":
+            n, n_fields, dropped = struct.unpack(BINARY_HEADER, self.file.read(12))
+            values = struct.unpack(f"<{n * n_fields}d", self.file.read(8 * n * n_fields))
+            return {"type": "telemetry", "records": [list(values[i:i + n_fields]) for i in range(0, len(values), n_fields)],
+                    "dropped": dropped}
+        msg = json.loads(first + self.file.readline())
+        if msg["type"] == "telemetry": # null back to nan, as binary subscribers get it
+            msg["records"] = [[math.nan if v is None else v for v in r] for r in msg["records"]]
+        return msg
+
+    def request(self, cmd, **fields):
+        """Send one command and return its reply."""
+        self.next_id += 1
+        self.sock.sendall(json.dumps({"cmd": cmd, "id": self.next_id, **fields}).encode("utf-8") + b"\n")
+        while True:
+            msg = self._read()
+            if msg["type"] == "reply" and msg.get("id") == self.next_id:
+                return msg
+            if msg["type"] == "telemetry":
+                self.pending.append(msg)
+
+    def telemetry(self):
+        """The next batch of telemetry: (records, dropped)."""
+        while True:
+            msg = self.pending.popleft() if self.pending else self._read()
+            if msg["type"] == "telemetry":
+                return msg["records"], msg["dropped"]
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def demo(seconds=3.0, rate=2000, n_fields=20):
+    """
+    Localhost test with no rig: a synthetic producer publishes rig-sized records
+    at rate Hz to a subscriber that keeps up, a decimated binary subscriber and
+    one that never reads, then checks that nothing blocked the producer. The
+    gate is on the 99th percentile publish() time, a single slow call can be a
+    GIL or scheduler stall that has nothing to do with the server.
+    """
+    fields = ["Time", "Seq"] + [f"Value {i}" for i in range(n_fields - 2)]
+    received = []
+    server = TelemetryServer(fields, token="demo", log=lambda m: None, queue_size=256)
+    server.commands["estop"] = lambda msg: (received.append("estop") or True, "Emergency stop set.")
+    port = server.start()
+
+    slow = socket.socket()
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096) # before connecting, so the window stays small
+    slow.connect((DEFAULT_HOST, port))
+    slow.sendall(b'{"cmd": "subscribe"}\n') # and never read again
+    fast = TelemetryClient(port=port)
+    assert fast.request("subscribe")["ok"]
+    decimated = TelemetryClient(port=port)
+    decimated.request("subscribe", format="binary", decimate=10)
+
+    assert not fast.request("estop")["ok"], "command accepted without auth"
+    assert not fast.request("auth", token="wrong")["ok"]
+    assert fast.request("auth", token="demo")["ok"] and fast.request("estop")["ok"] and received == ["estop"]
+
+    publish_times = []
+    stop = threading.Event()
+
+    def produce():
+        seq, start = 0, time.perf_counter()
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            server.publish([time.time(), seq, *[math.sin(seq / 100 + i) for i in range(n_fields - 2)]])
+            publish_times.append(time.perf_counter() - t0)
+            seq += 1
+            time.sleep(max(0.0, start + seq / rate - time.perf_counter()))
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    counts = {"fast": 0, "decimated": 0}
+    fast_dropped = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        records, fast_dropped = fast.telemetry()
+        counts["fast"] += len(records)
+        records, _ = decimated.telemetry()
+        counts["decimated"] += len(records)
+    stop.set()
+    producer.join()
+    slow_client = server._clients[0] # connected first
+
+    print(f"published {slow_client.count} records at {rate} Hz over {seconds:.1f} s")
+    print(f"  live client:       {counts['fast']} received, {fast_dropped} dropped")
+    print(f"  decimated (1/10):  {counts['decimated']} received")
+    print(f"  stalled client:    {slow_client.dropped} dropped, queue held at {len(slow_client.queue)}")
+    publish_times.sort()
+    p99 = publish_times[int(0.99 * (len(publish_times) - 1))]
+    print(f"  publish() time:    {1e6 * p99:.0f} us 99th percentile, {1e6 * publish_times[-1]:.0f} us slowest")
+    for c in (fast, slow, decimated):
+        c.close()
+    server.stop()
+    ok = fast_dropped == 0 and slow_client.dropped > 0 and p99 < 0.001
+    print("[PASS]" if ok else "[FAIL]")
+    return 0 if ok else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Connect to the controller's telemetry server, or run a localhost test.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--token", default=os.environ.get("SBGC_SERVER_TOKEN"), help="command token (default: $SBGC_SERVER_TOKEN)")
+    parser.add_argument("--command", choices=("estop", "start", "stop"), default=None, help="send a command instead of printing telemetry")
+    parser.add_argument("--setpoints", type=float, nargs="+", default=None, help="send custom setpoints [SLPM] (valve open)")
+    parser.add_argument("--fields", nargs="+", default=None, help="fields to print (default: all)")
+    parser.add_argument("--decimate", type=int, default=1, help="only receive every Nth record")
+    parser.add_argument("--demo", action="store_true", help="run a localhost test with a synthetic producer")
+    args = parser.parse_args(argv)
+
+    if args.demo:
+        return demo()
+    if args.port is None:
+        parser.error("--port is required")
+
+    client = TelemetryClient(args.host, args.port)
+    dropped = 0
+    try:
+        if args.command or args.setpoints:
+            reply = client.request("auth", token=args.token or "")
+            if reply["ok"]:
+                reply = (client.request("setpoints", valve=1, flows=args.setpoints) if args.setpoints
+                         else client.request(args.command))
+            print(reply["message"], file=sys.stderr)
+            return 0 if reply["ok"] else 1
+
+        client.request("subscribe", decimate=args.decimate)
+        fields = args.fields or client.fields
+        cols = [client.fields.index(f) for f in fields]
+        print(",".join(fields))
+        while True:
+            records, dropped = client.telemetry()
+            for row in records:
+                print(",".join(f"{row[c]:.6g}" for c in cols))
+    except KeyboardInterrupt:
+        if dropped:
+            print(f"[INFO] {dropped} samples were dropped because this client fell behind", file=sys.stderr)
+    except ConnectionError as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return 1
+    finally:
+        client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Host side of the sketch's continuous telemetry mode (sketch 1.4+).
+
+"T,<rate_hz>,<oversample>" makes the Arduino read every MFC and sensor pin
+rate_hz * oversample times a second on its own schedule, average each
+oversample reads, and push
+
+    D,<micros>,<telemetry line>
+
+rate_hz times a second with no host command needed. micros is the board's
+micros() at the middle of the averaged reads. "T,0" stops the stream. Command
+replies share the seq counter with the stream, so the link health checks see
+one sequence; from sketch 1.5 they are D frames too, stamped with the time of
+the readings they carry (while streaming, the latest averaged ones).
+
+StreamParser takes whatever bytes have arrived, splits them into lines, turns a
+burst of D frames into numbers with one numpy call and unwraps the 32-bit
+micros() stamps (wrapping every ~71.6 min) into board seconds. Mapping those
+onto host time is run_clock.ClockSync's job.
+"""
+import numpy as np
+
+STREAM_PREFIX = b"D,"
+MICROS_MODULUS = 2 ** 32
+MAX_PARTIAL = 4096 # bytes without a newline before the partial line is thrown away as noise
+
+
+class StreamParser:
+    def __init__(self, frame_length):
+        self.frame_length = frame_length # fields in a plain telemetry line
+        self.partial = b""
+        self.reset_clock()
+
+    def reset_clock(self):
+        """Forget the board's clock, e.g. after a reconnect (the board may have rebooted)."""
+        self.last_micros = None
+        self.wraps = 0
+
+    # ---------- Lines ---------- #
+    def feed(self, data):
+        """Split the bytes read so far into complete lines, keeping a trailing partial line for the next call."""
+        if not data:
+            return []
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        if len(self.partial) > MAX_PARTIAL:
+            self.partial = b""
+        return lines
+
+    def split(self, lines):
+        """
+        Separate D frames from the other lines (command replies, ERR frames).
+
+        Returns:
+            (frames, order, malformed): D frames without the "D," prefix; the
+            non-empty lines in arrival order, each a str for another line or None
+            for the next D frame; and the number of D frames with the wrong field
+            count, which are dropped.
+        """
+        commas = self.frame_length + 1 # after micros and each field but the last
+        frames, order, malformed = [], [], 0
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(STREAM_PREFIX):
+                if line.count(b",") == commas:
+                    frames.append(line[2:])
+                    order.append(None)
+                else:
+                    malformed += 1
+            else:
+                order.append(line.decode("utf-8", errors="ignore"))
+        return frames, order, malformed
+
+    # ---------- Numbers ---------- #
+    def parse(self, frames):
+        """
+        Convert a burst of D frames to numbers.
+
+        Args:
+            frames: D frames from split()
+        Returns:
+            (board, values, ok): board time of each frame [s], a (frames x frame_length)
+            array laid out like the plain telemetry line, and a mask that is False
+            for frames with a field that is not a number.
+        """
+        width = self.frame_length + 1
+        try:
+            rows = np.array(b",".join(frames).split(b","), dtype=float).reshape(len(frames), width)
+            ok = np.ones(len(frames), dtype=bool)
+        except ValueError: # a corrupted field somewhere in the burst, sort it out line by line
+            rows = np.full((len(frames), width), np.nan)
+            ok = np.zeros(len(frames), dtype=bool)
+            for i, frame in enumerate(frames):
+                try:
+                    rows[i] = np.array(frame.split(b","), dtype=float)
+                    ok[i] = True
+                except ValueError:
+                    pass
+        board = np.full(len(frames), np.nan)
+        if ok.any():
+            board[ok] = self.to_board_time(rows[ok, 0])
+        return board, rows[:, 1:], ok
+
+    def to_board_time(self, micros):
+        """Board time [s] of micros() stamps, unwrapping the 32-bit counter."""
+        previous = micros[0] if self.last_micros is None else self.last_micros
+        steps = np.diff(micros, prepend=previous)
+        wraps = self.wraps + np.cumsum(steps < -MICROS_MODULUS / 2)
+        self.wraps = int(wraps[-1])
+        self.last_micros = micros[-1]
+        return (micros + MICROS_MODULUS * wraps) / 1e6
@@ -0,0 +1,48 @@
+from link_health import LinkHealth
+
+
+def feed(health, state, seqs, t0=0.0):
+    """Register one frame per seq, 10 ms apart. Returns how many were accepted."""
+    return sum(health.on_packet(seq, state, t0 + 0.01 * i) for i, seq in enumerate(seqs))
+
+
+def test_state_change_resets_seq():
+    health = LinkHealth()
+    assert feed(health, 2, range(1, 501)) == 500
+    assert feed(health, 1, range(1, 11), t0=5.0) == 10
+    assert health.resets == 1
+    assert health.duplicates == 0
+    assert not health.link_lost()
+
+
+def test_state_change_with_lost_first_frame():
+    # The seq 1 frame of the new state is lost, the rest must not look like old repeats
+    health = LinkHealth()
+    assert feed(health, 2, range(1, 501)) == 500
+    assert feed(health, 1, range(2, 12), t0=5.0) == 10
+    assert health.resets == 1
+    assert health.duplicates == 0
+    assert not health.link_lost()
+
+
+def test_reboot_in_same_state_resets_seq():
+    health = LinkHealth()
+    feed(health, 1, range(1, 101))
+    assert feed(health, 1, range(1, 11), t0=5.0) == 10
+    assert health.resets == 1
+    assert not health.link_lost()
+
+
+def test_repeated_seq_is_a_frozen_link():
+    health = LinkHealth(stale_limit=5)
+    feed(health, 1, range(1, 101))
+    assert feed(health, 1, [50] * 5, t0=5.0) == 0
+    assert health.duplicates == 5
+    assert health.link_lost()
+
+
+def test_gap_counts_lost_packets():
+    health = LinkHealth()
+    feed(health, 1, [1, 2, 3, 7, 8])
+    assert health.lost == 3
+    assert health.gaps == 1